@@ -0,0 +1,35 @@
+# SQLite backend tuned for concurrent requests
+#
+# Adds two OPTIONS to django.db.backends.sqlite3:
+#   'pragmas': {name: value} run on every new connection (journal_mode,
+#              synchronous, busy_timeout, ...)
+#   'transaction_mode': 'IMMEDIATE' makes atomic blocks take the write lock
+#              up front. With the default deferred BEGIN, two transactions
+#              that both read before writing cannot both upgrade their lock
+#              and one fails with "database is locked" right away, whatever
+#              the busy timeout.
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        mode = kwargs.pop('transaction_mode', 'DEFERRED')
+        if mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured('transaction_mode must be one of %s' % ', '.join(TRANSACTION_MODES))
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED')
+        self.cursor().execute('BEGIN %s' % mode.upper())
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,11 +48,16 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        # same output as rest_framework.renderers.JSONRenderer, faster with orjson installed
+        'fundoorAPI.renderers.ORJSONRenderer',
     ],
 }
 
 MIDDLEWARE = [
+    # first, so its latency covers the whole stack
+    'fundoorAPI.metrics.metrics_middleware',
+    # before any middleware that may query the database
+    'fundoorAPI.routing.replica_middleware',
     'corsheaders.middleware.CorsMiddleware', # for localhost
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -62,6 +69,10 @@ MIDDLEWARE = [
 ]
 
 CORS_ORIGIN_ALLOW_ALL = True
+# cross-origin fetches send no cookies: the frontend reads the read-your-writes
+# deadline of fundoorAPI/routing.py from this header and sends it back
+CORS_EXPOSE_HEADERS = ['X-Fundoor-Primary']
+CORS_ALLOW_HEADERS = list(default_headers) + ['x-fundoor-primary']
 
 ROOT_URLCONF = 'fundoor.urls'
 
@@ -87,11 +98,84 @@ WSGI_APPLICATION = 'fundoor.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# Pick a profile with FUNDOOR_DB_PROFILE:
+#   sqlite        (default) WAL, persistent connections, immediate transactions
+#   sqlite-basic  stock SQLite settings, a connection per request
+#   postgres      PostgreSQL, configured with the POSTGRES_* variables
+
+DB_PROFILE = os.environ.get('FUNDOOR_DB_PROFILE', 'sqlite')
+
+DB_PROFILES = {
+    'sqlite-basic': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    'sqlite': {
+        'ENGINE': 'fundoor.db.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        # keep connections (and their PRAGMA setup) across requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # seconds a connection waits for the write lock
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                # readers never block the writer and the other way around
+                'journal_mode': 'WAL',
+                # fsync at checkpoints only, still safe against corruption in WAL mode
+                'synchronous': 'NORMAL',
+                'busy_timeout': 20000,
+                'mmap_size': 256 * 1024 * 1024,
+                # negative: KiB, so 64 MB of page cache per connection
+                'cache_size': -64000,
+                'temp_store': 'MEMORY',
+            },
+        },
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'fundoor'),
+        'USER': os.environ.get('POSTGRES_USER', 'fundoor'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # one persistent connection per worker thread; put PgBouncer in
+        # transaction mode in front to share them between processes
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # server side cursors do not survive transaction pooling
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_PGBOUNCER', '') == '1',
+        'OPTIONS': {
+            'connect_timeout': 5,
+            'application_name': 'fundoor',
+        },
+    },
+}
+
+DATABASES = {
+    'default': DB_PROFILES[DB_PROFILE],
+}
+
+# Read replicas, see fundoorAPI/routing.py. GET requests read from them,
+# except for clients that wrote within STICKY_SECONDS. With the SQLite
+# profiles, FUNDOOR_SQLITE_REPLICA names a file that `manage.py sync_replica`
+# copies the primary to; with postgres, POSTGRES_REPLICA_HOST is a streaming
+# replica of the primary.
+
+if DB_PROFILE.startswith('sqlite') and os.environ.get('FUNDOOR_SQLITE_REPLICA'):
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=os.environ['FUNDOOR_SQLITE_REPLICA'])
+elif DB_PROFILE == 'postgres' and os.environ.get('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = dict(DATABASES['default'], HOST=os.environ['POSTGRES_REPLICA_HOST'])
+if 'replica' in DATABASES:
+    # no test database of its own
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['fundoorAPI.routing.ReplicaRouter']
+
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': 10,
 }
 
 
@@ -138,4 +222,99 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+
+
+# USD price oracle for contributions, see fundoorAPI/pricing.py
+# Use 'fundoorAPI.pricing.StubProvider' to run offline
+
+PRICE_ORACLE = {
+    'PROVIDER': 'fundoorAPI.pricing.CoinbaseProvider',
+    'CACHE': True,
+    'TTL': 60,
+    'TIMEOUT': 2.0,
+    'REFRESH_INTERVAL': 30,
+    'REFRESH_IDLE': 600,
+}
+
+
+# Resized WebP variants of uploaded images, see fundoorAPI/media.py
+
+MEDIA_PIPELINE = {
+    'WORKERS': 2,
+    'VARIANTS': {'thumb': 160, 'card': 640, 'full': 1600},
+}
+
+
+# Let the front proxy send media files: 'x-accel-redirect' (nginx, with an
+# internal location at INTERNAL_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile'
+# (Apache mod_xsendfile, lighttpd). None streams them from Django.
+
+MEDIA_SENDFILE = {
+    'MODE': None,
+    'INTERNAL_PREFIX': '/protected-media/',
+}
+
+
+# Build read payloads from .values() rows instead of the read serializers,
+# see fundoorAPI/fastread.py. The output is identical either way.
+
+FAST_READ_PATH = True
+
+
+# Async read endpoints under /api/async/, see fundoorAPI/async_api.py. Run the
+# nested queries of a project page concurrently, each on its own connection.
+
+ASYNC_READS = {
+    'PARALLEL_QUERIES': True,
+    'QUERY_THREADS': 32,
+}
+
+
+# In-process cache of network, currency, category and user ids used by the
+# write endpoints, see fundoorAPI/refcache.py
+
+REFERENCE_CACHE = {
+    'CACHE': True,
+    'MAX_ENTRIES': 10000,
+    'TTL': 300,
+}
+
+
+# Per-endpoint request metrics served at /metrics, see fundoorAPI/metrics.py.
+# Point FUNDOOR_METRICS_DIR at a directory shared by the worker processes
+# (and emptied on deploy) to report all of them from any one.
+
+METRICS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': os.environ.get('FUNDOOR_METRICS_DIR'),
+    'FLUSH_INTERVAL': 5,
+}
+
+
+# Chain event indexer run by `manage.py index_chain`, see fundoorAPI/chain.py.
+# A network is indexed once it has an RPC_URL; START_BLOCK is where its
+# project contracts were first deployed.
+
+CHAIN_INDEXER = {
+    'NETWORKS': {
+        'Optimism': {'RPC_URL': os.environ.get('OPTIMISM_RPC_URL'), 'START_BLOCK': 0},
+        'Optimism Goerli Testnet': {'RPC_URL': os.environ.get('OPTIMISM_GOERLI_RPC_URL'), 'START_BLOCK': 0},
+    },
+    'CONFIRMATIONS': 12,
+    'BLOCK_RANGE': 2000,
+    'BATCH_REQUESTS': 10,
+    'POLL_INTERVAL': 15,
+}
+
+
+# Write-behind mode for add_project_comment and vote_community_action, see
+# fundoorAPI/writequeue.py. Writes are queued in their own SQLite file and
+# answered 202; run `manage.py drain_write_queue` to apply them.
+
+WRITE_QUEUE = {
+    'ENABLED': os.environ.get('FUNDOOR_WRITE_QUEUE', '') == '1',
+    'PATH': os.environ.get('FUNDOOR_WRITE_QUEUE_PATH', os.path.join(BASE_DIR, 'write_queue.sqlite3')),
+    'MAX_PENDING': 10000,
+    'BATCH_SIZE': 500,
+}
@@ -0,0 +1,217 @@
+# Incrementally maintained aggregates
+#
+# record_* functions are called inside the transaction that writes the
+# underlying row, so the aggregate can never be committed without it.
+# rebuild_* functions recompute everything from the base tables and are used
+# by the management commands to repair drift. Both copy the funding totals
+# onto the project cards of fundoorAPI.cards.
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .cards import refresh_funding
+from .models import *
+
+
+def latest(field, value):
+    # GREATEST ignores NULL on PostgreSQL but returns NULL on SQLite
+    return Coalesce(Greatest(field, Value(value)), Value(value))
+
+
+def distinct_count(queryset, group, field):
+    # {group value: distinct field values}, from the (group, field) index
+    return dict(queryset.values(group).order_by().annotate(count=Count(field, distinct=True)).values_list(
+        group, 'count'))
+
+
+def record_contribution(contribution):
+    project_id = contribution.project_id
+    # the funding row lock queues concurrent writers of the project, so the
+    # recount sees every contribution committed before this one
+    ProjectFunding.objects.select_for_update().get_or_create(project_id=project_id)
+    contributors = distinct_count(Contribution.objects.filter(project_id=project_id), 'project_id', 'user_id')
+
+    ProjectFunding.objects.filter(project_id=project_id).update(
+        total_usd=F('total_usd') + contribution.usd_amount,
+        contribution_count=F('contribution_count') + 1,
+        contributor_count=contributors.get(project_id, 0),
+        last_contribution_at=latest('last_contribution_at', contribution.created_at),
+    )
+
+    ProjectCurrencyFunding.objects.get_or_create(project_id=project_id, currency_id=contribution.currency_id)
+    ProjectCurrencyFunding.objects.filter(project_id=project_id, currency_id=contribution.currency_id).update(
+        total_amount=F('total_amount') + contribution.amount,
+    )
+    refresh_funding([project_id])
+
+
+def record_contributions(contributions):
+    # batch form of record_contribution: one update per touched project and currency
+    totals = defaultdict(lambda: [Decimal(0), 0, None])
+    amounts = defaultdict(Decimal)
+    for contribution in contributions:
+        total = totals[contribution.project_id]
+        total[0] += Decimal(contribution.usd_amount)
+        total[1] += 1
+        total[2] = max(filter(None, [total[2], contribution.created_at]))
+        amounts[(contribution.project_id, contribution.currency_id)] += Decimal(contribution.amount)
+    if not totals:
+        return
+
+    project_ids = list(totals)
+    ProjectFunding.objects.bulk_create([ProjectFunding(project_id=pk) for pk in project_ids], ignore_conflicts=True)
+    ProjectCurrencyFunding.objects.bulk_create([
+        ProjectCurrencyFunding(project_id=project_id, currency_id=currency_id) for project_id, currency_id in amounts
+    ], ignore_conflicts=True)
+    # distinct contributors are recounted under the funding row locks, like record_contribution
+    list(ProjectFunding.objects.select_for_update().filter(project_id__in=project_ids).values_list('pk'))
+    contributors = distinct_count(Contribution.objects.filter(project_id__in=project_ids), 'project_id', 'user_id')
+
+    for project_id, (usd, count, last) in totals.items():
+        ProjectFunding.objects.filter(project_id=project_id).update(
+            total_usd=F('total_usd') + usd,
+            contribution_count=F('contribution_count') + count,
+            contributor_count=contributors.get(project_id, 0),
+            last_contribution_at=latest('last_contribution_at', last),
+        )
+    for (project_id, currency_id), amount in amounts.items():
+        ProjectCurrencyFunding.objects.filter(project_id=project_id, currency_id=currency_id).update(
+            total_amount=F('total_amount') + amount,
+        )
+    refresh_funding(project_ids)
+
+
+def compute_funding(project_ids=None):
+    # recompute funding rows from Contribution in two grouped queries
+    contributions = Contribution.objects.all()
+    if project_ids is not None:
+        contributions = contributions.filter(project_id__in=project_ids)
+
+    totals = contributions.values('project_id').order_by().annotate(
+        total_usd=Coalesce(Sum('usd_amount'), Value(0), output_field=ProjectFunding._meta.get_field('total_usd')),
+        contribution_count=Count('id'),
+        contributor_count=Count('user_id', distinct=True),
+        last_contribution_at=Max('created_at'),
+    )
+    funding = [ProjectFunding(**row) for row in totals]
+
+    per_currency = contributions.values('project_id', 'currency_id').order_by().annotate(total_amount=Sum('amount'))
+    currency_funding = [ProjectCurrencyFunding(**row) for row in per_currency]
+    return funding, currency_funding
+
+
+def funding_drift(project_ids=None):
+    # project ids whose stored totals differ from a fresh recomputation
+    funding, currency_funding = compute_funding(project_ids)
+    expected = {
+        row.project_id: (row.total_usd, row.contribution_count, row.contributor_count, row.last_contribution_at)
+        for row in funding
+    }
+    expected_currency = {(row.project_id, row.currency_id): row.total_amount for row in currency_funding}
+
+    stored_funding = ProjectFunding.objects.all()
+    stored_currency = ProjectCurrencyFunding.objects.all()
+    if project_ids is not None:
+        stored_funding = stored_funding.filter(project_id__in=project_ids)
+        stored_currency = stored_currency.filter(project_id__in=project_ids)
+    stored = {
+        row.project_id: (row.total_usd, row.contribution_count, row.contributor_count, row.last_contribution_at)
+        for row in stored_funding
+    }
+    stored_by_currency = {(row.project_id, row.currency_id): row.total_amount for row in stored_currency}
+
+    drifted = {pk for pk in expected.keys() | stored.keys() if expected.get(pk) != stored.get(pk)}
+    drifted |= {
+        key[0] for key in expected_currency.keys() | stored_by_currency.keys()
+        if expected_currency.get(key) != stored_by_currency.get(key)
+    }
+    return sorted(drifted)
+
+
+def rebuild_funding(project_ids=None, batch_size=1000):
+    funding, currency_funding = compute_funding(project_ids)
+    with transaction.atomic():
+        stale_funding = ProjectFunding.objects.all()
+        stale_currency = ProjectCurrencyFunding.objects.all()
+        if project_ids is not None:
+            stale_funding = stale_funding.filter(project_id__in=project_ids)
+            stale_currency = stale_currency.filter(project_id__in=project_ids)
+        stale_funding.delete()
+        stale_currency.delete()
+        ProjectFunding.objects.bulk_create(funding, batch_size=batch_size)
+        ProjectCurrencyFunding.objects.bulk_create(currency_funding, batch_size=batch_size)
+        refresh_funding(project_ids)
+    return len(funding)
+
+
+def record_vote(vote):
+    # the proposal row lock queues concurrent voters, so the recount sees
+    # every vote committed before this one
+    proposals = CommunityProposal.objects.filter(pk=vote.proposal_id)
+    list(proposals.select_for_update().values_list('pk'))
+    voters = distinct_count(Vote.objects.filter(proposal_id=vote.proposal_id), 'proposal_id', 'voter_id')
+    weight_field = 'yes_weight' if vote.vote else 'no_weight'
+    proposals.update(**{
+        weight_field: F(weight_field) + vote.weight,
+        'voter_count': voters.get(vote.proposal_id, 0),
+    })
+
+
+def record_votes(votes):
+    # batch form of record_vote: one update per touched proposal
+    weights = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for vote in votes:
+        weights[vote.proposal_id][0 if vote.vote else 1] += Decimal(vote.weight)
+    if not weights:
+        return
+
+    list(CommunityProposal.objects.select_for_update().filter(pk__in=list(weights)).values_list('pk'))
+    voters = distinct_count(Vote.objects.filter(proposal_id__in=list(weights)), 'proposal_id', 'voter_id')
+    for proposal_id, (yes, no) in weights.items():
+        CommunityProposal.objects.filter(pk=proposal_id).update(
+            yes_weight=F('yes_weight') + yes,
+            no_weight=F('no_weight') + no,
+            voter_count=voters.get(proposal_id, 0),
+        )
+
+
+def compute_tallies(proposal_ids=None):
+    # {proposal_id: (yes_weight, no_weight, voter_count)} from the Vote table in one grouped query
+    votes = Vote.objects.all()
+    if proposal_ids is not None:
+        votes = votes.filter(proposal_id__in=proposal_ids)
+    weight = CommunityProposal._meta.get_field('yes_weight')
+    rows = votes.values('proposal_id').order_by().annotate(
+        yes=Coalesce(Sum('weight', filter=Q(vote=True)), Value(0), output_field=weight),
+        no=Coalesce(Sum('weight', filter=Q(vote=False)), Value(0), output_field=weight),
+        voters=Count('voter_id', distinct=True),
+    )
+    return {row['proposal_id']: (row['yes'], row['no'], row['voters']) for row in rows}
+
+
+def tally_drift(proposal_ids=None):
+    # [(proposal_id, stored, expected)] for every proposal whose stored tally is wrong
+    expected = compute_tallies(proposal_ids)
+    proposals = CommunityProposal.objects.all()
+    if proposal_ids is not None:
+        proposals = proposals.filter(pk__in=proposal_ids)
+    drifted = []
+    for pk, yes, no, voters in proposals.values_list('pk', 'yes_weight', 'no_weight', 'voter_count').iterator():
+        stored = (yes, no, voters)
+        wanted = expected.get(pk, (0, 0, 0))
+        if stored != wanted:
+            drifted.append((pk, stored, wanted))
+    return drifted
+
+
+def rebuild_tallies(proposal_ids=None, batch_size=1000):
+    drifted = tally_drift(proposal_ids)
+    with transaction.atomic():
+        CommunityProposal.objects.bulk_update([
+            CommunityProposal(pk=pk, yes_weight=yes, no_weight=no, voter_count=voters)
+            for pk, _, (yes, no, voters) in drifted
+        ], ['yes_weight', 'no_weight', 'voter_count'], batch_size=batch_size)
+    return drifted
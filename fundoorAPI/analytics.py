@@ -0,0 +1,76 @@
+# Contribution charts and leaderboards
+#
+# Both are grouped aggregations over a project's contributions, served from the
+# (project, created_at) and (project, user) indexes. Results are cached under a
+# key that includes the project's funding generation (contribution count and
+# latest contribution time from ProjectFunding), so the next contribution to a
+# project moves it to a new key and the old entry simply ages out.
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+
+from .models import *
+from .serializers import ContributionBucketReadSerializer, TopContributorReadSerializer
+
+INTERVALS = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'week': TruncWeek,
+}
+
+DEFAULT_TOP = 10
+MAX_TOP = 100
+
+# entries of past generations are dead weight, let them expire
+CACHE_TIMEOUT = 24 * 3600
+
+
+def funding_generation(project_address):
+    # (project id, generation) or None when the project does not exist
+    row = Project.objects.filter(project_address=project_address).values_list(
+        'id', 'funding__contribution_count', 'funding__last_contribution_at').first()
+    if row is None:
+        return None
+    project_id, count, last = row
+    return project_id, '%d-%s' % (count or 0, last.timestamp() if last else 0)
+
+
+def cached(key, compute):
+    data = cache.get(key)
+    if data is None:
+        data = compute()
+        cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def contribution_buckets(project_id, interval):
+    # usd and count per bucket, oldest first, with running totals
+    buckets = Contribution.objects.filter(project_id=project_id).annotate(
+        bucket=INTERVALS[interval]('created_at'),
+    ).values('bucket').annotate(
+        usd_amount=Sum('usd_amount'), contribution_count=Count('id'),
+    ).order_by('bucket')
+
+    rows, cumulative_usd, cumulative_count = [], 0, 0
+    for bucket in buckets:
+        cumulative_usd += bucket['usd_amount']
+        cumulative_count += bucket['contribution_count']
+        rows.append(dict(bucket, cumulative_usd=cumulative_usd, cumulative_count=cumulative_count))
+    return list(ContributionBucketReadSerializer(rows, many=True).data)
+
+
+def top_contributors(project_id, limit):
+    rows = Contribution.objects.filter(project_id=project_id).values('user__address').annotate(
+        total_usd=Sum('usd_amount'), contribution_count=Count('id'),
+    ).order_by('-total_usd', 'user__address')[:limit]
+    return list(TopContributorReadSerializer(rows, many=True).data)
+
+
+def contribution_series(project_id, generation, interval):
+    key = 'contribution_series:%d:%s:%s' % (project_id, generation, interval)
+    return cached(key, lambda: contribution_buckets(project_id, interval))
+
+
+def leaderboard(project_id, generation, limit):
+    key = 'top_contributors:%d:%s:%d' % (project_id, generation, limit)
+    return cached(key, lambda: top_contributors(project_id, limit))
@@ -4,42 +4,70 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
 from django.http import FileResponse
+from django.urls import reverse
+from django.db import IntegrityError, transaction
+from django.utils.http import parse_etags
 # Data operator
-from django.db.models import Sum
+from django.db.models import Sum, prefetch_related_objects
 from django.db.models.functions import Coalesce
 # Import Decimal
 from decimal import Decimal 
+import hashlib
 # import database models and serializers
 from .models import *
 from .serializers import *
+from .aggregates import record_contribution, record_vote
+from .analytics import DEFAULT_TOP, INTERVALS, MAX_TOP, contribution_series, funding_generation, leaderboard
+from .bulk import MAX_BATCH_SIZE, ingest_contributions, ingest_votes
+from .cards import card_page
+from . import fastread, refcache, writequeue
+from .media import schedule as schedule_media
+from .pagination import InvalidCursor, chunked, paginate_by_created, parse_limit
+from .search import search_page
+
+# projects serialized per prefetch round in search_projects
+SEARCH_CHUNK_SIZE = 25
+
+# Define a dictionary to map query parameters to model fields
+SEARCH_FIELDS = {
+    'title': 'title__icontains',
+    'category': 'category__name__icontains',
+    'fundraiser': 'fundraiser__address',
+    'contributor': 'contribution__user__address',
+}
+
+# payloads of search_projects: ProjectReadSerializer, or the ProjectCard
+# table alone for listings
+SEARCH_VIEWS = ('full', 'card')
 
 # Creating API endpoints
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def initiate_project(request):
     try:
-        network, _ = Network.objects.get_or_create(
-            name = request.data.get('chain', 'Optimism Goerli Testnet'), 
-            chainid = request.data.get('chainid', 420)
+        # reference rows are resolved to ids through the in-process cache
+        network_id = refcache.network_id(
+            request.data.get('chain', 'Optimism Goerli Testnet'),
+            request.data.get('chainid', 420)
             )
-        currency, _ = Currency.objects.get_or_create(
-            address = request.data.get('currency', ''),
-            name = request.data.get('currencyName', 'ERC20'),
-            network = network
+        currency_id = refcache.currency_id(
+            request.data.get('currency', ''),
+            network_id,
+            name = request.data.get('currencyName', 'ERC20')
             )
-        category, _ = Category.objects.get_or_create(name=request.data.get('category'))
-        fundraiser, _ = User.objects.get_or_create(address=request.data.get('walletAddress'))
+        category_id = refcache.category_id(request.data.get('category'))
+        fundraiser_id = refcache.user_id(request.data.get('walletAddress'), create=True)
 
         project_data = {
             'title': request.data.get('title', ''),
             'description': request.data.get('description', ''),
-            'currency': [currency.id], 
-            'category': category.id,
+            'currency': [currency_id], 
+            'category': category_id,
             'project_address': request.data.get('projectAddress', ''),
             'community_oversight': request.data.get('communityOversight', False),
             'release_epoch': request.data.get('releaseEpoch', 0),
             'creation_hash': request.data.get('transactionHash', ''),
-            'fundraiser': fundraiser.id,
+            'fundraiser': fundraiser_id,
         }
         
         project_serializer = ProjectWriteSerializer(data=project_data)
@@ -53,7 +81,8 @@ def initiate_project(request):
                 media_data = {'image': image, 'project': project.id}
                 media_serializer = MediaSerializer(data=media_data)
                 if media_serializer.is_valid():
-                    media_serializer.save()
+                    # resizing happens off the request
+                    schedule_media(media_serializer.save())
 
             return Response(status=status.HTTP_200_OK)
         else:
@@ -72,24 +101,61 @@ def contribute_project(request):
     # context is required to allow access to the located project object 
     serializer = ContributionWriteSerializer(data=request.data, context={'project': project})
     if serializer.is_valid():
-        serializer.save()
-        return Response({'response': 1, 'message': 'Contribution successful'}, status=status.HTTP_201_CREATED)
+        accepted = Response({'response': 1, 'message': 'Contribution successful'}, status=status.HTTP_201_CREATED)
+        try:
+            # the funding aggregates commit or roll back together with the contribution
+            with transaction.atomic():
+                contribution = serializer.save()
+                record_contribution(contribution)
+                Project.bump_version(pk=project.pk)
+        except IntegrityError:
+            data = serializer.validated_data
+            network_id = data['currency'][2]
+            response = replayed(Contribution.objects.filter(network_id=network_id, hsh=data['hsh']), {
+                'project_id': project.pk, 'user__address': data['contributor'],
+                'currency__address': data['currencyAddress'], 'amount': data['amount'],
+            }, accepted)
+            if response is None:
+                # some other constraint failed
+                raise
+            return response
+        return accepted
     else:
         return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+def replayed(stored, expected, accepted):
+    # a retried write hit the unique (network, hsh) index: answer as the first
+    # attempt was answered, unless the hash was stored for something else;
+    # None when nothing is stored under it, the caller decides what that means
+    original = stored.values(*expected).first()
+    if original is None:
+        return None
+    if original != expected:
+        return Response({'error': 'Transaction hash already recorded'}, status=status.HTTP_409_CONFLICT)
+    return accepted
+
+def queued(kind, payload):
+    # write-behind mode: acknowledge once the write is durably queued
+    try:
+        job_id = writequeue.enqueue(kind, payload)
+    except writequeue.QueueFull as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(writequeue.queue_settings()['RETRY_AFTER'])})
+    return Response({'response': 1, 'job': job_id, 'status': 'pending'}, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': reverse('get_write_status', args=[job_id])})
+
 @api_view(['POST'])
 def add_currency(request):
     try:
-        network, _ = Network.objects.get_or_create(
-            name = request.data.get('chain', 'Optimism Goerli Testnet'), 
-            chainid = request.data.get('chainid', 420)
-            )
-        currency, _ = Currency.objects.get_or_create(
-            address = request.data.get('currencyAddress', ''),
-            network = network
+        network_id = refcache.network_id(
+            request.data.get('chain', refcache.DEFAULT_NETWORK[0]),
+            request.data.get('chainid', refcache.DEFAULT_NETWORK[1])
             )
+        currency_id = refcache.currency_id(request.data.get('currencyAddress', ''), network_id)
         project = Project.objects.get(project_address=request.data['projectAddress'])
-        project.currency.add(currency)
+        with transaction.atomic():
+            project.currency.add(currency_id)
+            Project.bump_version(pk=project.pk)
 
     except Project.DoesNotExist:
         return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -110,7 +176,7 @@ def add_project_comment(request):
     if not user_address:
         return Response({'error': 'User address not provided'}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        user = User.objects.get(address=user_address)
+        user_id = refcache.user_id(user_address)
     except User.DoesNotExist:
         return Response({'error': 'User is not a fundraiser or contributor'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -121,11 +187,15 @@ def add_project_comment(request):
     serializer = CommentWriteSerializer(data={
         'project': project.id,
         'details': request.data['details'],
-        'user': user.id
+        'user': user_id
     })
 
     if serializer.is_valid():
-        serializer.save()
+        if writequeue.enabled():
+            return queued('comment', {'projectAddress': project_address, 'user': user_address, 'details': details})
+        with transaction.atomic():
+            serializer.save()
+            Project.bump_version(pk=project.pk)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -149,7 +219,9 @@ def propose_community_action(request):
     serializer = CommunityProposalWriteSerializer(data=project_data)
 
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
+            Project.bump_version(pk=project.pk)
         return Response({'response': 1, 'message': 'Propose successful'}, status=status.HTTP_201_CREATED)
     else:
         return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -157,55 +229,153 @@ def propose_community_action(request):
 @api_view(['POST'])
 def vote_community_action(request):
     try:
-        voter = User.objects.get(address=request.data.get('user'))
+        voter_id = refcache.user_id(request.data.get('user'))
     except User.DoesNotExist:
         return Response({'error': 'User is not a voter'}, status=status.HTTP_404_NOT_FOUND)
 
     vote_data = {
-        'voter': voter.id,
+        'voter': voter_id,
         'proposal': request.data.get('proposal'),
         'weight': request.data.get('weight'),
         'vote': request.data.get('vote'),
         'hsh': request.data.get('hsh'),
+        'chain': request.data.get('chain'),
+        'chainid': request.data.get('chainid'),
     }
     
-    # Deserialize the request data
+    # Deserialize the request data; the network is looked up from the proposal's project
     serializer = VoteWriteSerializer(data=vote_data)
     if serializer.is_valid():
-        # Save the vote to the database
-        serializer.save()
+        accepted = Response({'message': 'Vote recorded successfully'}, status=status.HTTP_201_CREATED)
+        data = serializer.validated_data
+        stored = Vote.objects.filter(network_id=data['network_id'], hsh=data['hsh'])
+        expected = {
+            'voter_id': voter_id, 'proposal_id': data['proposal'].pk, 'weight': data['weight'], 'vote': data['vote'],
+        }
+        if writequeue.enabled():
+            # a retry of a vote the worker has applied already
+            response = replayed(stored, expected, accepted)
+            if response is not None:
+                return response
+            return queued('vote', {
+                'user': request.data.get('user'), 'proposal': data['proposal'].pk, 'weight': str(data['weight']),
+                'vote': data['vote'], 'hsh': data['hsh'], 'chain': data['chain'], 'chainid': data['chainid'],
+            })
+        try:
+            # Save the vote and its proposal tally in one transaction
+            with transaction.atomic():
+                vote = serializer.save()
+                record_vote(vote)
+                Project.bump_version(communityproposal=vote.proposal_id)
+        except IntegrityError:
+            response = replayed(stored, expected, accepted)
+            if response is None:
+                # some other constraint failed
+                raise
+            return response
 
         # Respond with a success message
-        return Response({'message': 'Vote recorded successfully'}, status=status.HTTP_201_CREATED)
+        return accepted
     else:
         # Respond with validation errors
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def bulk_response(data, key, ingest):
+    # data is the request body, {key: [item, ...]}
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return Response({'error': 'Expected a list of items'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > MAX_BATCH_SIZE:
+        return Response({'error': 'At most %d items per batch' % MAX_BATCH_SIZE}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = ingest(items)
+    created = sum(1 for result in results if result.get('status') == 'created')
+    return Response({'response': 1, 'created': created, 'data': results}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+def bulk_contribute(request):
+    # batch form of contribute_project for indexers and backfills
+    return bulk_response(request.data, 'contributions', ingest_contributions)
+
+@api_view(['POST'])
+def bulk_vote(request):
+    # batch form of vote_community_action for indexers and backfills
+    return bulk_response(request.data, 'votes', ingest_votes)
+
 # Reading API endpoints
+@api_view(['GET'])
+def get_write_status(request, job_id):
+    # status of a write queued by add_project_comment or vote_community_action
+    job = writequeue.job_status(job_id)
+    if job is None:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"response": 1, "data": job})
+
 @api_view(['GET'])
 def get_project_data(request, project_address):
     try:
-        project = Project.objects.get(project_address=project_address)
-        project_serializer = ProjectReadSerializer(instance=project, context={'request': request})
+        fields = ProjectReadSerializer.select_fields(
+            request.query_params.get('fields'), request.query_params.get('expand'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({"response": 1, "data": project_serializer.data}, status=status.HTTP_200_OK)
+    try:
+        # Answer polling clients from the version alone when nothing changed
+        row = Project.objects.filter(project_address=project_address).values_list('id', 'version').first()
+        if row is None:
+            raise Project.DoesNotExist
+        project_id, version = row
+        if etag_matches(request, project_etag(project_address, version, fields)):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=project_cache_headers(project_address, version, fields))
+
+        if fastread.enabled():
+            # everything below is read after the version, so it is at least that new
+            rows = list(fastread.project_queryset(Project.objects.filter(pk=project_id), fields))
+            if not rows:
+                raise Project.DoesNotExist
+            data = fastread.project_rows(rows, fields, request)
+            headers = project_cache_headers(project_address, version, fields)
+            return Response({"response": 1, "data": data[0]}, status=status.HTTP_200_OK, headers=headers)
+
+        project = ProjectReadSerializer.setup_eager_loading(Project.objects.all(), fields).get(project_address=project_address)
+        project_serializer = ProjectReadSerializer(instance=project, fields=fields, context={'request': request})
+
+        # the loaded row's version: the nested data read after it is at least that new
+        headers = project_cache_headers(project_address, project.version, fields)
+        return Response({"response": 1, "data": project_serializer.data}, status=status.HTTP_200_OK, headers=headers)
     except Project.DoesNotExist:
         return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+def project_etag(project_address, version, fields=None):
+    # each field selection is a different representation of the project
+    selection = '' if fields is None else '-' + hashlib.sha1(','.join(fields).encode()).hexdigest()[:12]
+    return '"%s-v%d%s"' % (project_address, version, selection)
+
+def project_cache_headers(project_address, version, fields=None):
+    # clients may keep the payload but must revalidate it on every use
+    return {'ETag': project_etag(project_address, version, fields), 'Cache-Control': 'no-cache'}
+
+def etag_matches(request, etag):
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+    return etag in tags or '*' in tags
+
 @api_view(['GET'])
 def get_community_proposals(request, project_address):
     try:
         project = Project.objects.get(project_address=project_address)
         # Filter community proposals based on the project address
-        queryset = CommunityProposal.objects.filter(project=project.id)
-        serializer = CommunityProposalReadSerializer(queryset, many=True)
+        if fastread.enabled():
+            data = fastread.community_proposals(project.id)
+        else:
+            queryset = CommunityProposal.objects.filter(project=project.id)
+            data = CommunityProposalReadSerializer(queryset, many=True).data
 
         # Create the custom response
         custom_response = {
             "response": 1,
-            "data": serializer.data
+            "data": data
         }
         return Response(custom_response, status=status.HTTP_200_OK)
 
@@ -219,47 +389,149 @@ def get_community_proposals(request, project_address):
 @api_view(['GET'])
 def get_votes(request, proposal_id):
     try:
-        # Query the database to get all votes for the given proposal_id
-        votes = Vote.objects.filter(proposal=proposal_id)
-        
-        # Serialize the votes data
-        serializer = VoteReadSerializer(votes, many=True)
+        if fastread.enabled():
+            # dicts straight from the rows, no serializer involved
+            data = fastread.votes(proposal_id)
+        else:
+            # Query the database to get all votes for the given proposal_id
+            votes = Vote.objects.filter(proposal=proposal_id).select_related('voter')
+
+            # Serialize the votes data
+            data = VoteReadSerializer(votes, many=True).data
         
         # Return the serialized data as a response
-        return Response({"response": 1, "data": serializer.data}, status=status.HTTP_200_OK)
+        return Response({"response": 1, "data": data}, status=status.HTTP_200_OK)
     
     except Vote.DoesNotExist:
         return Response({'error': 'No votes found for the given proposal ID.'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+def get_project_comments(request, project_address):
+    try:
+        limit = parse_limit(request.query_params.get('limit'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    project_id = Project.objects.filter(project_address=project_address).values_list('id', flat=True).first()
+    if project_id is None:
+        return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    # newest first, one keyset page over the (project, created_at, id) index
+    if fastread.enabled():
+        comments = Comment.objects.filter(project=project_id).values(*fastread.COMMENT_VALUES)
+    else:
+        comments = Comment.objects.filter(project=project_id).select_related('user')
+    try:
+        page, next_cursor = paginate_by_created(comments, request.query_params.get('cursor'), limit)
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    data = fastread.comments(page) if fastread.enabled() else CommentReadSerializer(page, many=True).data
+    return Response({"response": 1, "data": data, "next": next_cursor}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def get_vote_tally(request, proposal_id):
+    try:
+        # tallies are maintained on the proposal row, the Vote table is not read
+        proposal = CommunityProposal.objects.get(pk=proposal_id)
+        serializer = VoteTallyReadSerializer(proposal)
+        return Response({"response": 1, "data": serializer.data}, status=status.HTTP_200_OK)
+    except CommunityProposal.DoesNotExist:
+        return Response({'error': 'Proposal not found'}, status=status.HTTP_404_NOT_FOUND)
+
+@api_view(['GET'])
+def get_contribution_series(request, project_address):
+    interval = request.query_params.get('interval', 'day')
+    if interval not in INTERVALS:
+        return Response({'error': 'interval must be one of %s' % ', '.join(INTERVALS)}, status=status.HTTP_400_BAD_REQUEST)
+
+    found = funding_generation(project_address)
+    if found is None:
+        return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+    # cached until the next contribution to the project
+    data = contribution_series(*found, interval)
+    return Response({"response": 1, "interval": interval, "data": data}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def get_top_contributors(request, project_address):
+    try:
+        limit = parse_limit(request.query_params.get('limit'), DEFAULT_TOP, MAX_TOP)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    found = funding_generation(project_address)
+    if found is None:
+        return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+    # cached until the next contribution to the project
+    data = leaderboard(*found, limit)
+    return Response({"response": 1, "data": data}, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 def search_projects(request):
     filter_field = request.query_params.get('field', None)
     filter_value = request.query_params.get('value', '')
+    search_text = request.query_params.get('q', None)
 
-    # Define a dictionary to map query parameters to model fields
-    field_mapping = {
-        'title': 'title__icontains',
-        'category': 'category__name__icontains',
-        'fundraiser': 'fundraiser__address',
-        'contributor': 'contribution__user__address',
-    }
-
-    # Check if the specified field is valid
-    if filter_field not in field_mapping:
+    # Check if the specified field is valid, q= selects the full-text mode instead
+    if search_text is None and filter_field not in SEARCH_FIELDS:
         return Response({'error': 'Invalid filter field'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Get the corresponding lookup field
-    query = {field_mapping[filter_field]: filter_value}
+    view = request.query_params.get('view', 'full')
+    if view not in SEARCH_VIEWS:
+        return Response({'error': 'Invalid view'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        limit = parse_limit(request.query_params.get('limit'))
+        fields = ProjectReadSerializer.select_fields(
+            request.query_params.get('fields'), request.query_params.get('expand'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if view == 'card' and fields is not None:
+        return Response({'error': 'fields and expand only apply to view=full'}, status=status.HTTP_400_BAD_REQUEST)
+
+    fast = fastread.enabled()
+    cursor = request.query_params.get('cursor')
+    if view == 'card':
+        # Get one page of cards, a single query on one table
+        try:
+            page, next_cursor = card_page(filter_field, filter_value, search_text, cursor, limit, rows=fast)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if fast:
+            data = fastread.card_rows(page, request)
+        else:
+            data = ProjectCardReadSerializer(page, many=True, context={'request': request}).data
+        return Response({"response": 1, "data": data, "next": next_cursor}, status=status.HTTP_200_OK)
 
-    # Get the project set
-    projects = Project.objects.filter(**query).distinct()
+    if fast:
+        # pages of plain rows, turned into payloads by fastread
+        projects = fastread.project_queryset(Project.objects.all(), fields)
+    else:
+        projects = Project.objects.select_related(*ProjectReadSerializer.related_lookups(fields)).annotate(
+            **ProjectReadSerializer.annotations(fields))
+    try:
+        if search_text is not None:
+            # Get one bm25 ranked page of full-text matches
+            page, next_cursor = search_page(projects, search_text, cursor, limit)
+        else:
+            # Get one keyset page of the project set
+            query = {SEARCH_FIELDS[filter_field]: filter_value}
+            page, next_cursor = paginate_by_created(projects.filter(**query).distinct(), cursor, limit)
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Serialize the filtered projects
-    serializer = ProjectReadSerializer(projects, many=True, context={'request': request})
+    # Serialize the page chunk by chunk so nested rows are only held for one chunk at a time
+    data = []
+    for chunk in chunked(page, SEARCH_CHUNK_SIZE):
+        if fast:
+            data.extend(fastread.project_rows(chunk, fields, request))
+            continue
+        prefetch_related_objects(chunk, *ProjectReadSerializer.prefetch_lookups(fields))
+        data.extend(ProjectReadSerializer(chunk, many=True, fields=fields, context={'request': request}).data)
 
-    return Response({"response": 1, "data": serializer.data}, status=status.HTTP_200_OK)
+    return Response({"response": 1, "data": data, "next": next_cursor}, status=status.HTTP_200_OK)
 
 
 # Updating API endpoints
@@ -272,7 +544,9 @@ def update_comment(request, comment_id):
 
     serializer = CommentWriteSerializer(comment, data=request.data, partial=True)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            comment = serializer.save()
+            Project.bump_version(pk=comment.project_id)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -282,7 +556,9 @@ def update_comment(request, comment_id):
 def delete_comment(request, comment_id):
     try:
         comment = Comment.objects.get(pk=comment_id)
-        comment.delete()
+        with transaction.atomic():
+            comment.delete()
+            Project.bump_version(pk=comment.project_id)
         return Response({'message': 'Comment deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
     except Comment.DoesNotExist:
         return Response({'error': 'Comment not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FundoorapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fundoorAPI'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,178 @@
+# Async read endpoints for ASGI deployments
+#
+# Same payloads, status codes and bytes as the read endpoints in api.py, built
+# with the fastread row builders. Under ASGI a request waiting on the database
+# holds no worker thread. The nested relations of a project page are
+# independent queries; with PARALLEL_QUERIES they run at the same time on pool
+# threads, each with its own database connection, otherwise one after another
+# on the request's thread as Django's async ORM does.
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed
+
+from . import fastread
+from .api import SEARCH_FIELDS, SEARCH_VIEWS, etag_matches, project_cache_headers, project_etag
+from .cards import card_page
+from .models import *
+from .pagination import InvalidCursor, paginate_by_created, parse_limit
+from .renderers import ORJSONRenderer
+from .search import search_page
+from .serializers import ProjectReadSerializer
+
+DEFAULTS = {
+    'PARALLEL_QUERIES': True,
+    # threads, and so at most as many database connections, for parallel
+    # queries; the event loop's default executor is sized by CPU count instead
+    'QUERY_THREADS': 32,
+}
+
+renderer = ORJSONRenderer()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def async_settings():
+    return {**DEFAULTS, **getattr(settings, 'ASYNC_READS', {})}
+
+
+def json_response(data=None, status=200, headers=None):
+    return HttpResponse(renderer.render(data), status=status, headers=headers, content_type='application/json')
+
+
+def get_only(view):
+    # require_GET only learns to wrap coroutines in Django 5.0
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET'])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def own_connection(fn):
+    # pool threads are not request threads, so their connections are not
+    # recycled by the request signals; apply CONN_MAX_AGE here instead
+    @functools.wraps(fn)
+    def run(*args):
+        close_old_connections()
+        try:
+            return fn(*args)
+        finally:
+            close_old_connections()
+    return run
+
+
+def get_pool(workers):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async-query')
+    return _pool
+
+
+async def run_query(fn, *args):
+    options = async_settings()
+    if options['PARALLEL_QUERIES']:
+        pool = get_pool(options['QUERY_THREADS'])
+        return await sync_to_async(own_connection(fn), thread_sensitive=False, executor=pool)(*args)
+    return await sync_to_async(fn)(*args)
+
+
+async def project_rows(rows, fields, request):
+    # fastread.project_rows with the nested queries gathered
+    fields = ProjectReadSerializer.resolve_fields(fields)
+    ids = [row['id'] for row in rows]
+    to_datetime = fastread.datetime_formatter()
+    names = fastread.nested_fields(fields, ids)
+    results = await asyncio.gather(*(run_query(fastread.NESTED_ROWS[name], ids, request, to_datetime) for name in names))
+    return fastread.build_projects(rows, fields, dict(zip(names, results)), to_datetime)
+
+
+@get_only
+async def get_project_data(request, project_address):
+    try:
+        fields = ProjectReadSerializer.select_fields(request.GET.get('fields'), request.GET.get('expand'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+
+    found = await Project.objects.filter(project_address=project_address).values_list('id', 'version').afirst()
+    if found is None:
+        return json_response({'error': 'Project not found'}, status=404)
+    project_id, version = found
+    headers = project_cache_headers(project_address, version, fields)
+    if etag_matches(request, project_etag(project_address, version, fields)):
+        return HttpResponse(status=304, headers=headers)
+
+    rows = [row async for row in fastread.project_queryset(Project.objects.filter(pk=project_id), fields)]
+    if not rows:
+        return json_response({'error': 'Project not found'}, status=404)
+    data = await project_rows(rows, fields, request)
+    return json_response({"response": 1, "data": data[0]}, headers=headers)
+
+
+@get_only
+async def get_community_proposals(request, project_address):
+    project_id = await Project.objects.filter(project_address=project_address).values_list('id', flat=True).afirst()
+    if project_id is None:
+        return json_response({'error': 'Project not found'}, status=404)
+    proposals = CommunityProposal.objects.filter(project=project_id).values(*fastread.PROPOSAL_VALUES)
+    return json_response({"response": 1, "data": [fastread.proposal_row(row) async for row in proposals]})
+
+
+@get_only
+async def get_votes(request, proposal_id):
+    to_datetime = fastread.datetime_formatter()
+    votes = Vote.objects.filter(proposal=proposal_id).values(*fastread.VOTE_VALUES)
+    return json_response({"response": 1, "data": [fastread.vote_row(row, to_datetime) async for row in votes]})
+
+
+@get_only
+async def search_projects(request):
+    filter_field = request.GET.get('field', None)
+    filter_value = request.GET.get('value', '')
+    search_text = request.GET.get('q', None)
+    if search_text is None and filter_field not in SEARCH_FIELDS:
+        return json_response({'error': 'Invalid filter field'}, status=400)
+
+    view = request.GET.get('view', 'full')
+    if view not in SEARCH_VIEWS:
+        return json_response({'error': 'Invalid view'}, status=400)
+
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+        fields = ProjectReadSerializer.select_fields(request.GET.get('fields'), request.GET.get('expand'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    if view == 'card' and fields is not None:
+        return json_response({'error': 'fields and expand only apply to view=full'}, status=400)
+
+    cursor = request.GET.get('cursor')
+    if view == 'card':
+        try:
+            page, next_cursor = await sync_to_async(card_page)(
+                filter_field, filter_value, search_text, cursor, limit, rows=True)
+        except InvalidCursor as e:
+            return json_response({'error': str(e)}, status=400)
+        return json_response({"response": 1, "data": fastread.card_rows(page, request), "next": next_cursor})
+
+    projects = fastread.project_queryset(Project.objects.all(), fields)
+    try:
+        # the paging helpers are synchronous and shared with api.py
+        if search_text is not None:
+            page, next_cursor = await sync_to_async(search_page)(projects, search_text, cursor, limit)
+        else:
+            queryset = projects.filter(**{SEARCH_FIELDS[filter_field]: filter_value}).distinct()
+            page, next_cursor = await sync_to_async(paginate_by_created)(queryset, cursor, limit)
+    except InvalidCursor as e:
+        return json_response({'error': str(e)}, status=400)
+
+    data = await project_rows(page, fields, request)
+    return json_response({"response": 1, "data": data, "next": next_cursor})
@@ -0,0 +1,52 @@
+# Shared helpers for the bench_* management commands
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test import Client
+
+
+@contextmanager
+def scratch_database(alias='default'):
+    # benchmarks seed and time against a throwaway test database so they
+    # never touch db.sqlite3
+    connection = connections[alias]
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def bench_client():
+    # 'testserver' is only an allowed host under the test runner
+    return Client(SERVER_NAME='localhost')
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    # samples are in seconds, the summary is in milliseconds
+    count = len(samples)
+    return {
+        'count': count,
+        'mean_ms': (sum(samples) / count * 1000) if count else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+def time_calls(fn, arguments):
+    samples = []
+    for argument in arguments:
+        started = time.perf_counter()
+        fn(argument)
+        samples.append(time.perf_counter() - started)
+    return samples
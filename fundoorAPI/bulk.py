@@ -0,0 +1,324 @@
+# Batch ingestion of contributions and votes
+#
+# Used by the bulk_* endpoints, backfill jobs and the write queue worker
+# (fundoorAPI/writequeue.py), which also batches comments. A batch resolves every
+# referenced project, user, currency and proposal with a few IN queries, skips
+# transaction hashes that are already stored on their network (or repeated
+# within the batch) as duplicates, or as errors when they were stored for
+# different content, inserts the rest with bulk_create and updates the
+# aggregates, all inside one transaction. Each item gets its own result so callers can retry failures.
+# The chain indexer (fundoorAPI/chain.py) also passes the block each log came
+# from, which lets it roll the rows back after a reorg.
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+
+from .aggregates import record_contributions, record_votes
+from .models import *
+from .pricing import price_oracle
+
+MAX_BATCH_SIZE = 5000
+
+# keeps IN lists under SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+class ContributionItemSerializer(serializers.Serializer):
+    projectAddress = serializers.CharField(max_length=42)
+    contributor = serializers.CharField(max_length=42)
+    currencyAddress = serializers.CharField(max_length=42)
+    amount = serializers.DecimalField(max_digits=80, decimal_places=18)
+    hsh = serializers.CharField(max_length=100)
+    # optional while the project has the address on a single network, see pick_network
+    chain = serializers.CharField(max_length=100, required=False, allow_null=True, default=None)
+    chainid = serializers.IntegerField(required=False, allow_null=True, default=None)
+    blockNumber = serializers.IntegerField(min_value=0, required=False, allow_null=True, default=None)
+    blockHash = serializers.CharField(max_length=66, required=False, allow_null=True, default=None)
+
+
+class VoteItemSerializer(serializers.Serializer):
+    user = serializers.CharField(max_length=42)
+    proposal = serializers.IntegerField()
+    weight = serializers.DecimalField(max_digits=80, decimal_places=18)
+    vote = serializers.BooleanField()
+    hsh = serializers.CharField(max_length=100)
+    # optional for projects on a single network, see pick_network
+    chain = serializers.CharField(max_length=100, required=False, allow_null=True, default=None)
+    chainid = serializers.IntegerField(required=False, allow_null=True, default=None)
+    blockNumber = serializers.IntegerField(min_value=0, required=False, allow_null=True, default=None)
+    blockHash = serializers.CharField(max_length=66, required=False, allow_null=True, default=None)
+
+
+class CommentItemSerializer(serializers.Serializer):
+    projectAddress = serializers.CharField(max_length=42)
+    user = serializers.CharField(max_length=42)
+    details = serializers.CharField()
+
+
+def chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def project_networks(project_ids):
+    # {project id: {(name, chainid): network id}} of the networks the projects
+    # have a currency on
+    networks = {}
+    for chunk in chunks(set(project_ids)):
+        rows = Project.currency.through.objects.filter(project_id__in=chunk).values_list(
+            'project_id', 'currency__network_id', 'currency__network__name', 'currency__network__chainid')
+        for project_id, network_id, name, chainid in rows:
+            networks.setdefault(project_id, {})[(name, chainid)] = network_id
+    return networks
+
+
+def project_currencies(project_ids):
+    # {project id: {address: {(name, chainid): currency}}} of the projects'
+    # currencies; an address may be deployed on several networks
+    currencies = {}
+    rows = Project.currency.through.objects.select_related('currency__network')
+    for chunk in chunks(set(project_ids)):
+        for row in rows.filter(project_id__in=chunk):
+            network = row.currency.network
+            currencies.setdefault(row.project_id, {}).setdefault(row.currency.address, {})[
+                (network.name, network.chainid)] = row.currency
+    return currencies
+
+
+def pick_network(choices, chain=None, chainid=None, missing='Project has no network'):
+    # the (name, chainid) key of choices, what a project has on each network,
+    # that a write names, or the only one when it names none. Nothing is
+    # looked up by name alone or created, so a retry lands on the same
+    # (network, hsh) whether or not it repeats the chain.
+    if not choices:
+        raise ValueError(missing)
+    if chain is None and chainid is None:
+        if len(choices) > 1:
+            raise ValueError('chain and chainid are required')
+        return next(iter(choices))
+    if (chain, chainid) not in choices:
+        raise ValueError('Project is not on this network')
+    return (chain, chainid)
+
+
+def validate_items(items, serializer_class):
+    # (valid, results): valid holds (index, validated_data), results one dict per item
+    results = [{'index': index} for index in range(len(items))]
+    valid = []
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+            if 'hsh' in serializer.validated_data:
+                results[index]['hsh'] = serializer.validated_data['hsh']
+        else:
+            results[index].update(status='error', error=serializer.errors)
+    return valid, results
+
+
+# what a retry must repeat for its hash to count as a duplicate, the fields
+# replayed() of api.py compares
+CONTENT_FIELDS = {
+    Contribution: ['project_id', 'user__address', 'currency_id', 'amount'],
+    Vote: ['proposal_id', 'voter__address', 'weight', 'vote'],
+}
+
+
+def content(instance):
+    # the CONTENT_FIELDS values of an unsaved instance, as .values() returns them
+    values = {}
+    for field in CONTENT_FIELDS[type(instance)]:
+        value = instance
+        for name in field.split('__'):
+            value = getattr(value, name)
+        values[field] = value
+    return values
+
+
+def existing_keys(model, keys):
+    # {(network id, hash): CONTENT_FIELDS values} of the keys that are stored already
+    keys = set(keys)
+    found = {}
+    for chunk in chunks({hsh for _, hsh in keys}):
+        for row in model.objects.filter(hsh__in=chunk).values('network_id', 'hsh', *CONTENT_FIELDS[model]):
+            key = (row.pop('network_id'), row.pop('hsh'))
+            if key in keys:
+                found[key] = row
+    return found
+
+
+def resolve_users(addresses):
+    # contributors and voters are created on first sight, like initiate_project does for fundraisers
+    addresses = set(addresses)
+    users = {}
+    for chunk in chunks(addresses):
+        users.update(User.objects.in_bulk(chunk, field_name='address'))
+    missing = addresses - users.keys()
+    if missing:
+        User.objects.bulk_create([User(address=address) for address in missing], ignore_conflicts=True)
+        for chunk in chunks(missing):
+            users.update(User.objects.in_bulk(chunk, field_name='address'))
+    return users
+
+
+def instance_key(instance):
+    return (instance.network_id, instance.hsh)
+
+
+def skip_duplicates(rows, results, stored):
+    # drop the [(index, instance)] rows whose (network id, hash) is stored
+    # already or appeared earlier in the batch: duplicates when their content
+    # matches, like retries, errors when the hash was recorded for something else
+    seen = dict(stored)
+    fresh = []
+    for index, instance in rows:
+        key = instance_key(instance)
+        if key not in seen:
+            seen[key] = content(instance)
+            fresh.append((index, instance))
+        elif seen[key] == content(instance):
+            results[index]['status'] = 'duplicate'
+        else:
+            results[index].update(status='error', error='Transaction hash already recorded')
+    return fresh
+
+
+def insert_new(model, rows, results):
+    # bulk_create [(index, instance)]; hashes a concurrent writer stored since
+    # they were checked fail the unique index, are skipped like the others,
+    # and the rest is inserted again
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([instance for _, instance in rows], batch_size=LOOKUP_CHUNK_SIZE)
+            break
+        except IntegrityError:
+            if attempt:
+                raise
+            for _, instance in rows:
+                instance.pk = None
+            rows = skip_duplicates(rows, results, existing_keys(model, (instance_key(row[1]) for row in rows)))
+    for index, _ in rows:
+        results[index]['status'] = 'created'
+    return [instance for _, instance in rows]
+
+
+@transaction.atomic
+def ingest_contributions(items):
+    valid, results = validate_items(items, ContributionItemSerializer)
+
+    projects = {}
+    for chunk in chunks({data['projectAddress'] for _, data in valid}):
+        projects.update(Project.objects.in_bulk(chunk, field_name='project_address'))
+    currencies = project_currencies(project.pk for project in projects.values())
+
+    rows = []
+    for index, data in valid:
+        project = projects.get(data['projectAddress'])
+        if project is None:
+            results[index].update(status='error', error='Project not found')
+            continue
+        # the project's currency at the address, like ContributionWriteSerializer
+        choices = currencies.get(project.pk, {}).get(data['currencyAddress'], {})
+        try:
+            chain = pick_network(choices, data['chain'], data['chainid'], missing='Currency not found')
+        except ValueError as error:
+            results[index].update(status='error', error=str(error))
+        else:
+            rows.append((index, data, project, choices[chain]))
+
+    users = resolve_users(data['contributor'] for _, data, _, _ in rows)
+    rates = {name: price_oracle().usd_rate(name) for name in {currency.name for _, _, _, currency in rows}}
+
+    contributions = []
+    for index, data, project, currency in rows:
+        rate = rates[currency.name]
+        contributions.append((index, Contribution(
+            project=project,
+            usd_amount=(rate * data['amount']).quantize(Decimal('0.01')) if rate is not None else Decimal(0),
+            user=users[data['contributor']],
+            currency=currency,
+            network_id=currency.network_id,
+            amount=data['amount'],
+            hsh=data['hsh'],
+            block_number=data['blockNumber'],
+            block_hash=data['blockHash'],
+        )))
+
+    stored = existing_keys(Contribution, (instance_key(row[1]) for row in contributions))
+    contributions = insert_new(Contribution, skip_duplicates(contributions, results, stored), results)
+    record_contributions(contributions)
+    Project.bump_version(pk__in={contribution.project_id for contribution in contributions})
+    return results
+
+
+@transaction.atomic
+def ingest_votes(items):
+    valid, results = validate_items(items, VoteItemSerializer)
+    proposals = {}
+    for chunk in chunks({data['proposal'] for _, data in valid}):
+        proposals.update(CommunityProposal.objects.filter(pk__in=chunk).values_list('pk', 'project_id'))
+    networks = project_networks(proposals.values())
+
+    rows = []
+    for index, data in valid:
+        if data['proposal'] not in proposals:
+            results[index].update(status='error', error='Proposal not found')
+            continue
+        choices = networks.get(proposals[data['proposal']], {})
+        try:
+            chain = pick_network(choices, data['chain'], data['chainid'])
+        except ValueError as error:
+            results[index].update(status='error', error=str(error))
+        else:
+            rows.append((index, data, choices[chain]))
+
+    users = resolve_users(data['user'] for _, data, _ in rows)
+    votes = []
+    for index, data, network_id in rows:
+        votes.append((index, Vote(
+            voter=users[data['user']],
+            proposal_id=data['proposal'],
+            weight=data['weight'],
+            vote=data['vote'],
+            hsh=data['hsh'],
+            network_id=network_id,
+            block_number=data['blockNumber'],
+            block_hash=data['blockHash'],
+        )))
+
+    stored = existing_keys(Vote, (instance_key(row[1]) for row in votes))
+    votes = insert_new(Vote, skip_duplicates(votes, results, stored), results)
+    record_votes(votes)
+    Project.bump_version(communityproposal__in={vote.proposal_id for vote in votes})
+    return results
+
+
+@transaction.atomic
+def ingest_comments(items):
+    # comments are only taken from known users, like add_project_comment does
+    valid, results = validate_items(items, CommentItemSerializer)
+    projects, users = {}, {}
+    for chunk in chunks({data['projectAddress'] for _, data in valid}):
+        projects.update(Project.objects.in_bulk(chunk, field_name='project_address'))
+    for chunk in chunks({data['user'] for _, data in valid}):
+        users.update(User.objects.in_bulk(chunk, field_name='address'))
+
+    comments = []
+    for index, data in valid:
+        project = projects.get(data['projectAddress'])
+        user = users.get(data['user'])
+        if project is None:
+            results[index].update(status='error', error='Project not found')
+        elif user is None:
+            results[index].update(status='error', error='User not found')
+        else:
+            comments.append((index, Comment(project=project, user=user, details=data['details'])))
+
+    Comment.objects.bulk_create([comment for _, comment in comments], batch_size=LOOKUP_CHUNK_SIZE)
+    for index, comment in comments:
+        results[index].update(status='created', id=comment.pk)
+    Project.bump_version(pk__in={comment.project_id for _, comment in comments})
+    return results
@@ -0,0 +1,142 @@
+# Denormalized project cards for listings
+#
+# A ProjectCard row holds what a listing shows of a project: title, category,
+# fundraiser, first image, total raised and contributor count. A page of
+# search_projects?view=card is then one scan of one table, with no joins and
+# no nested queries. Cards are refreshed inside the transaction of the write
+# that changes them: project, category, user and media saves through the
+# receivers in signals.py and media.store_variants, funding through the
+# record_* and rebuild_* functions of aggregates.py. bulk_create sends no
+# signals, so bulk loads call rebuild_cards (`manage.py rebuild_project_cards`).
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import *
+from .pagination import paginate_by_created
+from .search import fallback_queryset, fts_enabled, search_page
+
+# stored fields besides the project
+CARD_FIELDS = [
+    'project_address', 'title', 'category', 'fundraiser', 'image', 'total_usd', 'contributor_count', 'created_at',
+]
+
+# the .values() names of card rows; the project id comes out as id, the sort
+# key of paginate_by_created and search_page
+CARD_VALUES = ['id'] + CARD_FIELDS
+
+# the SEARCH_FIELDS of api.py on card columns; contributors are not on the
+# card and come from Contribution
+CARD_SEARCH_FIELDS = {
+    'title': 'title__icontains',
+    'category': 'category__icontains',
+    'fundraiser': 'fundraiser',
+    'contributor': 'project__in',
+}
+
+
+def card_queryset(queryset=None):
+    # cards with the project id as id, as model instances or, with
+    # .values(*CARD_VALUES), as the rows fastread.card_rows takes
+    queryset = ProjectCard.objects.all() if queryset is None else queryset
+    return queryset.annotate(id=F('project_id'))
+
+
+def card_filter(field, value):
+    # a search_projects field= filter on the card columns
+    if field == 'contributor':
+        value = Contribution.objects.filter(user__address=value).values('project_id')
+    return Q(**{CARD_SEARCH_FIELDS[field]: value})
+
+
+def card_page(field, value, text, cursor, limit, rows=False):
+    # (cards, next_cursor) of search_projects?view=card, as .values() rows
+    # with rows=True; text selects the full-text mode like q=
+    cards = card_queryset()
+    if rows:
+        cards = cards.values(*CARD_VALUES)
+    if text is None:
+        return paginate_by_created(cards.filter(card_filter(field, value)), cursor, limit)
+    if fts_enabled():
+        return search_page(cards, text, cursor, limit)
+    # the LIKE fallback also matches descriptions, which are not on the card
+    matches = fallback_queryset(Project.objects.all(), text).values('pk')
+    return paginate_by_created(cards.filter(project__in=matches), cursor, limit)
+
+
+def first_images(project_ids=None):
+    # {project id: storage name} of each project's first image
+    media = Media.objects.exclude(image='').exclude(image=None).order_by('id')
+    if project_ids is not None:
+        media = media.filter(project_id__in=project_ids)
+    images = {}
+    for project_id, image, variants in media.values_list('project_id', 'image', 'variants').iterator():
+        images.setdefault(project_id, variants.get('card') or image)
+    return images
+
+
+def compute_cards(project_ids=None):
+    # unsaved ProjectCards built from the tables they denormalize
+    projects = Project.objects.all()
+    if project_ids is not None:
+        projects = projects.filter(pk__in=project_ids)
+    images = first_images(project_ids)
+    rows = projects.values(
+        'id', 'project_address', 'title', 'category__name', 'fundraiser__address', 'created_at',
+        'funding__total_usd', 'funding__contributor_count',
+    )
+    return [ProjectCard(
+        project_id=row['id'],
+        project_address=row['project_address'],
+        title=row['title'],
+        category=row['category__name'],
+        fundraiser=row['fundraiser__address'],
+        image=images.get(row['id'], ''),
+        total_usd=row['funding__total_usd'] or 0,
+        contributor_count=row['funding__contributor_count'] or 0,
+        created_at=row['created_at'],
+    ) for row in rows.iterator()]
+
+
+def refresh_cards(project_ids):
+    # upsert the cards of these projects from their sources
+    project_ids = list(project_ids)
+    if not project_ids:
+        return
+    ProjectCard.objects.bulk_create(
+        compute_cards(project_ids), update_conflicts=True, unique_fields=['project'], update_fields=CARD_FIELDS)
+
+
+def refresh_funding(project_ids=None):
+    # copy total_usd and contributor_count from the ProjectFunding rows just
+    # written, one UPDATE for all the projects
+    cards = ProjectCard.objects.all()
+    if project_ids is not None:
+        cards = cards.filter(project_id__in=list(project_ids))
+    funding = ProjectFunding.objects.filter(project_id=OuterRef('project_id'))
+    cards.update(
+        total_usd=Coalesce(Subquery(funding.values('total_usd')[:1]), Value(0),
+                           output_field=ProjectCard._meta.get_field('total_usd')),
+        contributor_count=Coalesce(Subquery(funding.values('contributor_count')[:1]), Value(0)),
+    )
+
+
+def card_drift(project_ids=None):
+    # project ids whose stored card differs from a fresh computation
+    expected = {card.project_id: [getattr(card, name) for name in CARD_FIELDS] for card in compute_cards(project_ids)}
+    stored_cards = ProjectCard.objects.all()
+    if project_ids is not None:
+        stored_cards = stored_cards.filter(project_id__in=project_ids)
+    stored = {row[0]: list(row[1:]) for row in stored_cards.values_list('project_id', *CARD_FIELDS).iterator()}
+    return sorted(pk for pk in expected.keys() | stored.keys() if expected.get(pk) != stored.get(pk))
+
+
+def rebuild_cards(project_ids=None, batch_size=1000):
+    cards = compute_cards(project_ids)
+    with transaction.atomic():
+        stale = ProjectCard.objects.all()
+        if project_ids is not None:
+            stale = stale.filter(project_id__in=project_ids)
+        stale.delete()
+        ProjectCard.objects.bulk_create(cards, batch_size=batch_size)
+    return len(cards)
@@ -0,0 +1,360 @@
+# Chain event indexer
+#
+# Polls an Ethereum JSON-RPC endpoint for the logs of every project contract
+# on a network and stores them as Contribution and Vote rows through the bulk
+# ingestion path, so duplicates (keyed by network and transaction hash) are
+# skipped and the aggregates stay in step. Block ranges are fetched with
+# eth_getLogs, several ranges per JSON-RPC batch, and the last indexed block
+# (and its hash) is checkpointed per Network in the transaction that writes
+# the rows.
+#
+# Reorgs: every poll first checks that the checkpointed block still has the
+# hash it was indexed with. If not, the indexed rows of the last CONFIRMATIONS
+# blocks are deleted, their aggregates rebuilt, and those blocks scanned again.
+# Reorgs deeper than CONFIRMATIONS need a manual `index_chain --from-block`.
+#
+# Only projects registered (with a currency on the network) when a range is
+# scanned are watched; rescan with --from-block to pick up the history of a
+# project registered late.
+import logging
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .aggregates import rebuild_funding, rebuild_tallies
+from .bulk import chunks, ingest_contributions, ingest_votes
+from .models import *
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # network name -> {'RPC_URL': ..., 'START_BLOCK': block the project factory was deployed at}
+    'NETWORKS': {},
+    # blocks that may still be reorganised, rewound when the checkpoint's hash changes
+    'CONFIRMATIONS': 12,
+    # blocks per eth_getLogs call, halved while the node rejects a range as too large and
+    # doubled back after each batch it accepts
+    'BLOCK_RANGE': 2000,
+    # eth_getLogs calls per JSON-RPC batch
+    'BATCH_REQUESTS': 10,
+    # contract addresses per eth_getLogs filter
+    'ADDRESSES_PER_FILTER': 500,
+    # seconds between polls of index_chain
+    'POLL_INTERVAL': 15,
+    # seconds per HTTP request to the node
+    'TIMEOUT': 10,
+    # token decimals by currency name, others have 18
+    'DECIMALS': {'USDC': 6, 'USDT': 6},
+    # decimals of a vote's weight
+    'WEIGHT_DECIMALS': 18,
+}
+
+# attempts at a batch whose end block changed while it was fetched
+MAX_ATTEMPTS = 3
+
+
+def chain_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAIN_INDEXER', {})}
+
+
+# events of the project contract, topic 0 is the keccak-256 hash of the signature
+# Contributed(address,address,uint256)
+CONTRIBUTED = '0x188177a91f9b084dadc3c86215ff29aa75ddaf05ed75983c8c498c40989d58c9'
+# Voted(address,uint256,bool,uint256)
+VOTED = '0x9fea94799b68dbb994c4e44547ea7b5c9e4068fbc385b8b688005a16b60c3cc6'
+
+
+def word_address(word):
+    # the address in a 32 byte topic or data word
+    return '0x' + word[-40:].lower()
+
+
+def data_words(data):
+    data = data.removeprefix('0x')
+    return [int(data[start:start + 64], 16) for start in range(0, len(data), 64)]
+
+
+def decode_log(log):
+    # ('contribution', contributor, currency, raw amount), ('vote', voter, nonce, support, raw weight) or None
+    topics = log.get('topics') or []
+    try:
+        if topics[0] == CONTRIBUTED:
+            return 'contribution', word_address(topics[1]), word_address(topics[2]), data_words(log['data'])[0]
+        if topics[0] == VOTED:
+            support, weight = data_words(log['data'])[:2]
+            return 'vote', word_address(topics[1]), int(topics[2], 16), bool(support), weight
+    except (IndexError, ValueError):
+        logger.warning('undecodable log %s:%s', log.get('transactionHash'), log.get('logIndex'))
+    return None
+
+
+class RPCError(Exception):
+    pass
+
+
+class RangeTooLarge(RPCError):
+    # the node refused an eth_getLogs call for covering too many blocks or logs
+    pass
+
+
+# how providers word that refusal (geth-style nodes, Infura, Alchemy, QuickNode,
+# Ankr, Cloudflare); anything else is not fixed by a narrower range
+RANGE_ERROR_MESSAGES = (
+    'block range', 'range too large', 'range is too', 'max range', 'more than', 'too many', 'response size',
+    'limited to',
+)
+
+
+def rpc_error(method, error):
+    message = error.get('message', '') if isinstance(error, dict) else str(error)
+    if method == 'eth_getLogs' and any(part in message.lower() for part in RANGE_ERROR_MESSAGES):
+        return RangeTooLarge('%s: %s' % (method, error))
+    return RPCError('%s: %s' % (method, error))
+
+
+class RPCClient:
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def post(self, payload):
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as error:
+            raise RPCError('%s: %s' % (self.url, error)) from error
+
+    def call(self, method, *params):
+        return self.batch([(method, list(params))])[0]
+
+    def batch(self, calls):
+        # results of [(method, params)], in order; raises RPCError if any call failed
+        replies = self.post([
+            {'jsonrpc': '2.0', 'id': index, 'method': method, 'params': params}
+            for index, (method, params) in enumerate(calls)
+        ])
+        if not isinstance(replies, list):
+            raise RPCError(replies.get('error') if isinstance(replies, dict) else replies)
+        results = {}
+        for reply in replies:
+            if reply.get('error') is not None:
+                raise rpc_error(calls[reply['id']][0], reply['error'])
+            results[reply['id']] = reply.get('result')
+        return [results.get(index) for index in range(len(calls))]
+
+
+def quantity(number):
+    return hex(number)
+
+
+class Indexer:
+
+    def __init__(self, network, client, start_block=0, confirmations=12, block_range=2000, batch_requests=10,
+                 addresses_per_filter=500, decimals=None, weight_decimals=18):
+        self.network = network
+        self.client = client
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.block_range = self.max_block_range = block_range
+        self.batch_requests = batch_requests
+        self.addresses_per_filter = addresses_per_filter
+        self.decimals = decimals or {}
+        self.weight_decimals = weight_decimals
+        self.chain_checked = False
+
+    def checkpoint(self):
+        checkpoint, _ = ChainCheckpoint.objects.get_or_create(
+            network=self.network, defaults={'block_number': self.start_block - 1})
+        return checkpoint
+
+    def block_hash(self, number):
+        block = self.client.call('eth_getBlockByNumber', quantity(number), False)
+        return block and block['hash']
+
+    def watched(self):
+        # lower-case contract address -> (stored address, project id)
+        projects = Project.objects.filter(currency__network=self.network).distinct()
+        return {address.lower(): (address, pk) for address, pk in projects.values_list('project_address', 'id')}
+
+    def poll(self):
+        # index every block up to the head; returns a summary of what changed
+        if not self.chain_checked:
+            chainid = int(self.client.call('eth_chainId'), 16)
+            if chainid != self.network.chainid:
+                raise RPCError('node serves chain %d, %s is %d' % (chainid, self.network.name, self.network.chainid))
+            self.chain_checked = True
+
+        head = int(self.client.call('eth_blockNumber'), 16)
+        checkpoint = self.checkpoint()
+        summary = {'head': head, 'from': checkpoint.block_number + 1, 'to': checkpoint.block_number,
+                   'rewound_to': None, 'contributions': 0, 'votes': 0, 'skipped': 0}
+        if checkpoint.block_hash and self.block_hash(checkpoint.block_number) != checkpoint.block_hash:
+            target = max(checkpoint.block_number - self.confirmations, self.start_block - 1)
+            logger.warning('%s: block %d was reorganised, rewinding to %d',
+                           self.network.name, checkpoint.block_number, target)
+            checkpoint = self.rollback(target)
+            summary['rewound_to'] = summary['to'] = target
+            summary['from'] = target + 1
+
+        watched = self.watched()
+        while checkpoint.block_number < head:
+            end = self.scan(checkpoint, head, watched, summary)
+            summary['to'] = end
+        return summary
+
+    def scan(self, checkpoint, head, watched, summary):
+        # index the next batch of ranges after the checkpoint, returns its last block
+        start = checkpoint.block_number + 1
+        end = min(start + self.block_range * self.batch_requests - 1, head)
+        ranges = [(first, min(first + self.block_range - 1, end)) for first in range(start, end + 1, self.block_range)]
+        addresses = list(watched)
+        filters = [
+            {'fromBlock': quantity(first), 'toBlock': quantity(last), 'address': chunk, 'topics': [[CONTRIBUTED, VOTED]]}
+            for first, last in ranges for chunk in chunks(addresses, self.addresses_per_filter)
+        ]
+        header = ('eth_getBlockByNumber', [quantity(end), False])
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                # the end block's header before and after the logs, a reorg in
+                # between shows as two different hashes
+                results = self.client.batch([header] + [('eth_getLogs', [f]) for f in filters] + [header])
+            except RangeTooLarge:
+                # most nodes cap the blocks or logs one call may cover; other
+                # errors (timeouts, 5xx) reach the caller, which retries later
+                if self.block_range == 1:
+                    raise
+                self.block_range = max(self.block_range // 2, 1)
+                logger.info('%s: retrying with ranges of %d blocks', self.network.name, self.block_range)
+                return checkpoint.block_number
+            before, after = results[0], results[-1]
+            if before and after and before['hash'] == after['hash']:
+                break
+        else:
+            raise RPCError('block %d kept changing while it was fetched' % end)
+
+        logs = sorted(
+            (log for batch in results[1:-1] for log in batch or [] if not log.get('removed')),
+            key=lambda log: (int(log['blockNumber'], 16), int(log['logIndex'], 16)),
+        )
+        with transaction.atomic():
+            self.ingest(logs, watched, summary)
+            checkpoint.block_number, checkpoint.block_hash = end, after['hash']
+            checkpoint.save()
+        # a log limit depends on how busy the blocks are, widen again for the next ones
+        self.block_range = min(self.block_range * 2, self.max_block_range)
+        return end
+
+    def ingest(self, logs, watched, summary):
+        contributions, votes = [], []
+        for log in logs:
+            project = watched.get(log['address'].lower())
+            event = decode_log(log)
+            if project is None or event is None:
+                continue
+            block = {'hsh': log['transactionHash'], 'blockNumber': int(log['blockNumber'], 16),
+                     'blockHash': log['blockHash']}
+            if event[0] == 'contribution':
+                contributions.append((project, event[1:], block))
+            else:
+                votes.append((project, event[1:], block))
+        if not contributions and not votes:
+            return
+
+        users = self.user_addresses(
+            [event[0] for _, event, _ in contributions] + [event[0] for _, event, _ in votes])
+        if contributions:
+            currencies = {
+                address.lower(): (address, name)
+                for address, name in Currency.objects.filter(network=self.network).values_list('address', 'name')
+            }
+            items = []
+            for (project_address, _), (contributor, currency, amount), block in contributions:
+                stored, name = currencies.get(currency, (currency, None))
+                items.append({'projectAddress': project_address, 'contributor': users[contributor],
+                              'currencyAddress': stored, 'amount': self.scaled(amount, self.decimals.get(name, 18)),
+                              'chain': self.network.name, 'chainid': self.network.chainid, **block})
+            self.count(ingest_contributions(items), 'contributions', summary)
+        if votes:
+            proposals = {}
+            for chunk in chunks({project_id for (_, project_id), _, _ in votes}):
+                for pk, project_id, nonce in CommunityProposal.objects.filter(project_id__in=chunk).values_list(
+                        'pk', 'project_id', 'onchain_proposal_nonce'):
+                    proposals[(project_id, nonce)] = pk
+            items = []
+            for (_, project_id), (voter, nonce, support, weight), block in votes:
+                # unknown proposals fail validation in ingest_votes and are reported as skipped
+                items.append({'user': users[voter], 'proposal': proposals.get((project_id, nonce), 0),
+                              'weight': self.scaled(weight, self.weight_decimals), 'vote': support,
+                              'chain': self.network.name, 'chainid': self.network.chainid, **block})
+            self.count(ingest_votes(items), 'votes', summary)
+
+    def scaled(self, raw, decimals):
+        return str(Decimal(raw).scaleb(-decimals))
+
+    def count(self, results, label, summary):
+        for result in results:
+            if result.get('status') == 'created':
+                summary[label] += 1
+            elif result.get('status') == 'error':
+                summary['skipped'] += 1
+                logger.warning('%s: skipped %s: %s', self.network.name, result.get('hsh'), result.get('error'))
+
+    def user_addresses(self, addresses):
+        # lower-case address -> the form users are stored in; clients may have
+        # stored theirs checksummed, new users are stored lower-case
+        stored = {address: address for address in set(addresses)}
+        for chunk in chunks(list(stored)):
+            users = User.objects.annotate(lower=Lower('address')).filter(lower__in=chunk)
+            for lower, address in users.values_list('lower', 'address'):
+                stored[lower] = address
+        return stored
+
+    @transaction.atomic
+    def rollback(self, block_number):
+        # forget what was indexed after block_number; rows posted by clients carry no block and stay
+        projects = Project.objects.filter(currency__network=self.network).values('pk')
+        contributions = Contribution.objects.filter(
+            network=self.network, project__in=projects, block_number__gt=block_number)
+        votes = Vote.objects.filter(network=self.network, proposal__project__in=projects, block_number__gt=block_number)
+        project_ids = set(contributions.values_list('project_id', flat=True))
+        proposal_ids = set(votes.values_list('proposal_id', flat=True))
+        contributions.delete()
+        votes.delete()
+        if project_ids:
+            rebuild_funding(list(project_ids))
+        if proposal_ids:
+            rebuild_tallies(list(proposal_ids))
+            project_ids |= set(CommunityProposal.objects.filter(pk__in=proposal_ids).values_list('project_id', flat=True))
+        Project.bump_version(pk__in=project_ids)
+
+        checkpoint = self.checkpoint()
+        checkpoint.block_number = block_number
+        checkpoint.block_hash = self.block_hash(block_number) if block_number >= 0 else None
+        checkpoint.save()
+        return checkpoint
+
+
+def indexer(network_name, rpc_url=None):
+    # an Indexer configured from CHAIN_INDEXER['NETWORKS'][network_name]
+    options = chain_settings()
+    network_options = options['NETWORKS'].get(network_name, {})
+    rpc_url = rpc_url or network_options.get('RPC_URL')
+    if not rpc_url:
+        raise ValueError('no RPC_URL configured for network %r' % network_name)
+    return Indexer(
+        Network.objects.get(name=network_name),
+        RPCClient(rpc_url, timeout=options['TIMEOUT']),
+        start_block=network_options.get('START_BLOCK', 0),
+        confirmations=options['CONFIRMATIONS'],
+        block_range=options['BLOCK_RANGE'],
+        batch_requests=options['BATCH_REQUESTS'],
+        addresses_per_filter=options['ADDRESSES_PER_FILTER'],
+        decimals=options['DECIMALS'],
+        weight_decimals=options['WEIGHT_DECIMALS'],
+    )
@@ -0,0 +1,286 @@
+# Serializer-free read path
+#
+# Builds the read payloads straight from .values() rows instead of walking
+# ModelSerializer fields per object. The output must stay byte-for-byte equal
+# to the serializers in fundoorAPI/serializers.py: keys come out in the same
+# order and Decimal and datetime values are formatted by the very DRF fields
+# the serializers use. Enabled with the FAST_READ_PATH setting; the parity
+# tests in fundoorAPI/tests.py compare both paths.
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import *
+from .serializers import *
+
+
+def enabled():
+    return getattr(settings, 'FAST_READ_PATH', False)
+
+
+def formatter(serializer_class, name):
+    # the serializer's own field, so formatting can never drift from it
+    return serializer_class().fields[name].to_representation
+
+
+def nullable(format_value):
+    # serializers render None as is instead of formatting it
+    return lambda value: None if value is None else format_value(value)
+
+
+def datetime_formatter():
+    # a DateTimeField looks the current time zone up for every value, which
+    # dominates large payloads; pin it once per payload instead
+    current = timezone.get_current_timezone() if settings.USE_TZ else None
+    return nullable(serializers.DateTimeField(default_timezone=current).to_representation)
+
+
+USD_AMOUNT = formatter(ContributionReadSerializer, 'usd_amount')
+TOKEN_AMOUNT = formatter(ContributionReadSerializer, 'amount')
+TOTAL_USD = formatter(ProjectFundingReadSerializer, 'total_usd')
+WEIGHT = formatter(CommunityProposalReadSerializer, 'yes_weight')
+CARD_TOTAL_USD = formatter(ProjectCardReadSerializer, 'total_usd')
+
+IMAGE_STORAGE = Media._meta.get_field('image').storage
+
+
+def media_url(name, request):
+    url = IMAGE_STORAGE.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def group_by_project(rows):
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.pop('project_id')].append(row)
+    return grouped
+
+
+def currency_rows(ids, request, to_datetime):
+    rows = Project.currency.through.objects.filter(project_id__in=ids).values(
+        'project_id', 'currency__address', 'currency__name')
+    return group_by_project({
+        'project_id': row['project_id'],
+        'address': row['currency__address'],
+        'name': row['currency__name'],
+    } for row in rows)
+
+
+def media_rows(ids, request, to_datetime):
+    grouped = defaultdict(list)
+    for row in Media.objects.filter(project_id__in=ids).values('project_id', 'image', 'variants'):
+        grouped[row['project_id']].append({
+            'project': row['project_id'],
+            'image': media_url(row['image'], request) if row['image'] else None,
+            'variants': {label: media_url(name, request) for label, name in row['variants'].items()},
+        })
+    return grouped
+
+
+def contribution_rows(ids, request, to_datetime):
+    rows = Contribution.objects.filter(project_id__in=ids).values(
+        'project_id', 'created_at', 'usd_amount', 'user_id', 'user__address',
+        'currency_id', 'currency__address', 'currency__name', 'currency__network_id', 'amount', 'hsh')
+    return group_by_project({
+        'project_id': row['project_id'],
+        'created_at': to_datetime(row['created_at']),
+        'usd_amount': USD_AMOUNT(row['usd_amount']),
+        'user': {'id': row['user_id'], 'address': row['user__address']},
+        'currency': {
+            'id': row['currency_id'],
+            'address': row['currency__address'],
+            'name': row['currency__name'],
+            'network': row['currency__network_id'],
+        },
+        'amount': TOKEN_AMOUNT(row['amount']),
+        'hsh': row['hsh'],
+    } for row in rows)
+
+
+def proposal_row(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'description': row['description'],
+        'onchain_proposal_nonce': row['onchain_proposal_nonce'],
+        'yes_weight': WEIGHT(row['yes_weight']),
+        'no_weight': WEIGHT(row['no_weight']),
+        'voter_count': row['voter_count'],
+    }
+
+
+PROPOSAL_VALUES = ['id', 'title', 'description', 'onchain_proposal_nonce', 'yes_weight', 'no_weight', 'voter_count']
+
+
+def proposal_rows(ids, request, to_datetime):
+    rows = CommunityProposal.objects.filter(project_id__in=ids).values('project_id', *PROPOSAL_VALUES)
+    return group_by_project(dict(proposal_row(row), project_id=row['project_id']) for row in rows)
+
+
+COMMENT_VALUES = ['id', 'details', 'user_id', 'user__address', 'created_at']
+
+
+def comment_row(row, to_datetime):
+    return {
+        'id': row['id'],
+        'details': row['details'],
+        'user': {'id': row['user_id'], 'address': row['user__address']},
+        'created_at': to_datetime(row['created_at']),
+    }
+
+
+def comment_rows(ids, request, to_datetime):
+    rows = Comment.objects.filter(project_id__in=ids).values('project_id', *COMMENT_VALUES)
+    return group_by_project(dict(comment_row(row, to_datetime), project_id=row['project_id']) for row in rows)
+
+
+def currency_funding_rows(ids, request, to_datetime):
+    rows = ProjectCurrencyFunding.objects.filter(project_id__in=ids).values(
+        'project_id', 'currency__address', 'currency__name', 'total_amount')
+    return group_by_project({
+        'project_id': row['project_id'],
+        'address': row['currency__address'],
+        'name': row['currency__name'],
+        'total_amount': TOKEN_AMOUNT(row['total_amount']),
+    } for row in rows)
+
+
+# one query per selected relation, like ProjectReadSerializer.prefetch_lookups
+NESTED_ROWS = {
+    'currencies': currency_rows,
+    'media': media_rows,
+    'contribution': contribution_rows,
+    'community_proposals': proposal_rows,
+    'comments': comment_rows,
+    'funding': currency_funding_rows,
+}
+
+PROJECT_VALUES = [
+    'title', 'description', 'project_address', 'community_oversight', 'release_epoch', 'creation_hash',
+]
+
+# fields read through a join, which is only made when the field is selected
+JOINED_VALUES = {
+    'fundraiser': ['fundraiser__address'],
+    'category': ['category__name'],
+    'funding': [
+        'funding__total_usd', 'funding__contribution_count', 'funding__contributor_count', 'funding__last_contribution_at',
+    ],
+}
+
+
+def project_values(fields=None):
+    # the .values() names project_rows needs for a field selection; id and
+    # created_at are always there for keyset pagination
+    fields = ProjectReadSerializer.resolve_fields(fields)
+    values = ['id', 'created_at'] + [name for name in PROJECT_VALUES if name in fields]
+    for name, joined in JOINED_VALUES.items():
+        if name in fields:
+            values += joined
+    return values + list(ProjectReadSerializer.annotations(fields))
+
+
+def project_queryset(queryset, fields=None):
+    # queryset as the rows project_rows takes, with the same annotations as
+    # the serializer path
+    return queryset.annotate(**ProjectReadSerializer.annotations(fields)).values(*project_values(fields))
+
+
+def project_rows(rows, fields=None, request=None):
+    # ProjectReadSerializer(..., fields=fields).data for rows loaded with
+    # project_queryset(), in their order
+    fields = ProjectReadSerializer.resolve_fields(fields)
+    ids = [row['id'] for row in rows]
+    to_datetime = datetime_formatter()
+    nested = {name: NESTED_ROWS[name](ids, request, to_datetime) for name in nested_fields(fields, ids)}
+    return build_projects(rows, fields, nested, to_datetime)
+
+
+def nested_fields(fields, ids):
+    # the selected relations that need a query of their own
+    return [name for name in NESTED_ROWS if name in fields] if ids else []
+
+
+def build_projects(rows, fields, nested, to_datetime):
+    # payloads from project rows and the {field: {project id: rows}} of nested_fields
+    builders = {
+        'id': lambda row: row['id'],
+        'fundraiser': lambda row: {'address': row['fundraiser__address']},
+        'title': lambda row: row['title'],
+        'description': lambda row: row['description'],
+        'currencies': lambda row: nested['currencies'].get(row['id'], []),
+        'category': lambda row: {'name': row['category__name']},
+        'project_address': lambda row: row['project_address'],
+        'community_oversight': lambda row: row['community_oversight'],
+        'created_at': lambda row: to_datetime(row['created_at']),
+        'release_epoch': lambda row: row['release_epoch'],
+        'creation_hash': lambda row: row['creation_hash'],
+        'media': lambda row: nested['media'].get(row['id'], []),
+        'contribution': lambda row: nested['contribution'].get(row['id'], []),
+        'community_proposals': lambda row: nested['community_proposals'].get(row['id'], []),
+        'comments': lambda row: nested['comments'].get(row['id'], []),
+        'comment_count': lambda row: row['comment_count'],
+        'funding': lambda row: funding(row, nested['funding'], to_datetime),
+    }
+    selected = [(name, builders[name]) for name in ProjectReadSerializer.Meta.fields if name in fields]
+    return [{name: build(row) for name, build in selected} for row in rows]
+
+
+def funding(row, currency_funding, to_datetime):
+    # projects without contributions have no funding row, which reads as zero
+    return {
+        'total_usd': TOTAL_USD(row['funding__total_usd'] or 0),
+        'contribution_count': row['funding__contribution_count'] or 0,
+        'contributor_count': row['funding__contributor_count'] or 0,
+        'last_contribution_at': to_datetime(row['funding__last_contribution_at']),
+        'currencies': currency_funding.get(row['id'], []),
+    }
+
+
+def card_rows(rows, request=None):
+    # ProjectCardReadSerializer(..., many=True).data for rows of
+    # cards.card_queryset().values(*cards.CARD_VALUES)
+    to_datetime = datetime_formatter()
+    return [{
+        'id': row['id'],
+        'project_address': row['project_address'],
+        'title': row['title'],
+        'category': row['category'],
+        'fundraiser': row['fundraiser'],
+        'image': media_url(row['image'], request) if row['image'] else None,
+        'total_usd': CARD_TOTAL_USD(row['total_usd']),
+        'contributor_count': row['contributor_count'],
+        'created_at': to_datetime(row['created_at']),
+    } for row in rows]
+
+
+VOTE_VALUES = ['voter_id', 'voter__address', 'weight', 'vote', 'created_at', 'hsh']
+
+
+def vote_row(row, to_datetime):
+    return {
+        'voter': {'id': row['voter_id'], 'address': row['voter__address']},
+        'weight': TOKEN_AMOUNT(row['weight']),
+        'vote': row['vote'],
+        'created_at': to_datetime(row['created_at']),
+        'hsh': row['hsh'],
+    }
+
+
+def community_proposals(project_id):
+    # CommunityProposalReadSerializer(..., many=True).data
+    return [proposal_row(row) for row in CommunityProposal.objects.filter(project=project_id).values(*PROPOSAL_VALUES)]
+
+
+def comments(queryset):
+    # CommentReadSerializer(..., many=True).data for a .values(*COMMENT_VALUES) queryset or page
+    to_datetime = datetime_formatter()
+    return [comment_row(row, to_datetime) for row in queryset]
+
+
+def votes(proposal_id):
+    # VoteReadSerializer(..., many=True).data
+    to_datetime = datetime_formatter()
+    return [vote_row(row, to_datetime) for row in Vote.objects.filter(proposal=proposal_id).values(*VOTE_VALUES)]
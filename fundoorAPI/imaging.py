@@ -0,0 +1,68 @@
+# Image work for the media pipeline
+#
+# Runs inside pool worker processes, so it only depends on Pillow and plain
+# paths, never on Django models or settings.
+import io
+import os
+
+from PIL import Image, ImageOps
+
+# formats the original is re-saved in after its metadata is stripped
+STRIP_FORMATS = {'JPEG': {'quality': 95}, 'PNG': {}, 'WEBP': {'quality': 95}}
+
+
+def variant_name(name, label):
+    # user_upload/photo.jpg -> user_upload/photo.thumb.webp
+    return '%s.%s.webp' % (os.path.splitext(name)[0], label)
+
+
+def without_metadata(image):
+    # the image re-encoded without EXIF (GPS position, device serials, ...) as
+    # bytes, or None when it carries none; orientation is baked into the
+    # pixels first so nothing rotates
+    options = STRIP_FORMATS.get(image.format)
+    if options is None or not (image.getexif() or image.info.get('exif')):
+        return None
+    upright = ImageOps.exif_transpose(image)
+    upright.info.pop('exif', None)
+    buffer = io.BytesIO()
+    upright.save(buffer, image.format, **options)
+    return buffer.getvalue()
+
+
+def strip_stream(stream):
+    # without_metadata for an uploaded file, read before it is stored
+    with Image.open(stream) as image:
+        image.load()
+        return without_metadata(image)
+
+
+def strip_metadata(path, image):
+    # rewrite a stored original in place, for uploads stored before stripping
+    # moved into the request
+    data = without_metadata(image)
+    if data is not None:
+        with open(path, 'wb') as handle:
+            handle.write(data)
+
+
+def render_variants(media_root, name, sizes, quality):
+    # {label: relative name} of the WebP variants written next to the original
+    path = os.path.join(media_root, name)
+    with Image.open(path) as image:
+        image.load()
+        upright = ImageOps.exif_transpose(image)
+        if upright.mode not in ('RGB', 'RGBA'):
+            upright = upright.convert('RGBA' if 'transparency' in upright.info or upright.mode in ('LA', 'PA') else 'RGB')
+
+        variants = {}
+        for label, size in sizes.items():
+            variant = upright.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            relative = variant_name(name, label)
+            # no exif= argument, so variants never carry metadata
+            variant.save(os.path.join(media_root, relative), 'WEBP', quality=quality, method=4)
+            variants[label] = relative
+
+        strip_metadata(path, image)
+    return variants
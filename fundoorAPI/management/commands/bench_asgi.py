@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from fundoorAPI.aggregates import rebuild_funding
+from fundoorAPI.bench import scratch_database, summarize
+from fundoorAPI.models import *
+
+# (label, url prefix); the sync views are served under ASGI too, through
+# Django's sync_to_async adapter, which is what an ASGI switch alone buys
+DEPLOYMENTS = {
+    'wsgi': '/api/',
+    'asgi': '/api/async/',
+    'asgi-sync-views': '/api/',
+}
+
+
+def wsgi_environ(path, query):
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': sys.stdin.buffer,
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+
+
+def asgi_scope(path, query):
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Load test the read endpoints under WSGI (a thread pool) and ASGI (one event loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deployments', default=','.join(DEPLOYMENTS))
+        parser.add_argument('--concurrency', default='8,32,128', help='comma separated client counts')
+        parser.add_argument('--requests', type=int, default=512, help='per concurrency level')
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help='worker threads of the WSGI deployment, like gunicorn --threads')
+        parser.add_argument('--db-latency-ms', type=float, default=5.0,
+                            help='simulated round trip per query, as to a database server')
+        parser.add_argument('--path', default='get_project_data/0xp0/')
+        parser.add_argument('--query', default='expand=contribution,comments,funding,community_proposals')
+        # runs one deployment in this process so its peak memory is its own
+        parser.add_argument('--worker', help='internal')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_deployment(options['worker'], options)))
+            return
+
+        self.stdout.write('%-16s %6s %10s %10s %10s %8s' % (
+            'deployment', 'conc', 'req/s', 'p50 ms', 'p99 ms', 'rss MB'))
+        for deployment in options['deployments'].split(','):
+            command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_asgi', '--worker', deployment]
+            for name in ('concurrency', 'requests', 'wsgi_threads', 'db_latency_ms', 'path', 'query'):
+                command += ['--' + name.replace('_', '-'), str(options[name])]
+            done = subprocess.run(command, capture_output=True, text=True)
+            if done.returncode != 0:
+                self.stdout.write('%-16s failed: %s' % (deployment, (done.stderr.strip().splitlines() or ['?'])[-1]))
+                continue
+            for row in json.loads(done.stdout.strip().splitlines()[-1]):
+                self.stdout.write('%-16s %6d %10.1f %10.2f %10.2f %8.1f' % (
+                    deployment, row['concurrency'], row['rps'], row['p50_ms'], row['p99_ms'], row['rss_mb']))
+
+    def seed(self):
+        network = Network.objects.create(name='bench', chainid=1)
+        category = Category.objects.create(name='bench')
+        currency = Currency.objects.create(address='0xbenchcurrency', network=network, name='WETH')
+        users = User.objects.bulk_create([User(address='0xu%d' % i) for i in range(50)])
+        for index in range(20):
+            project = Project.objects.create(fundraiser=users[index], title='bench %d' % index, category=category,
+                                             project_address='0xp%d' % index, release_epoch=0)
+            project.currency.add(currency)
+            Contribution.objects.bulk_create([
+                Contribution(project=project, usd_amount=Decimal('3.50'), user=users[i], currency=currency,
+                             amount=Decimal('0.002'), hsh='0x%d_%d' % (index, i))
+                for i in range(50)
+            ])
+            Comment.objects.bulk_create([
+                Comment(project=project, details='comment %d' % i, user=users[i]) for i in range(20)
+            ])
+            CommunityProposal.objects.create(project=project, title='proposal', onchain_proposal_nonce=0)
+        rebuild_funding()
+
+    def run_deployment(self, deployment, options):
+        latency = options['db_latency_ms'] / 1000.0
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow_query)
+
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # a file, so every thread's connection sees the same data
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            # production-like request handling, no query log
+            with scratch_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost']):
+                self.seed()
+                connection.close()
+                connection_created.connect(add_latency)
+                path = DEPLOYMENTS[deployment] + options['path']
+                if deployment == 'wsgi':
+                    run = self.wsgi_runner(path, options['query'], options['wsgi_threads'])
+                else:
+                    run = self.asgi_runner(path, options['query'])
+                run(4, 16)
+                rows = []
+                for concurrency in [int(value) for value in options['concurrency'].split(',')]:
+                    started = time.perf_counter()
+                    samples = run(concurrency, options['requests'])
+                    elapsed = time.perf_counter() - started
+                    rows.append(dict(
+                        summarize(samples), concurrency=concurrency, rps=len(samples) / elapsed,
+                        rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                    ))
+                connection_created.disconnect(add_latency)
+                return rows
+
+    def wsgi_runner(self, path, query, workers):
+        from fundoor.wsgi import application
+
+        # a fixed worker pool: requests beyond it wait in a FIFO queue, as
+        # they do in the listen backlog of a gunicorn gthread worker
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+        def handle():
+            statuses = []
+            body = application(wsgi_environ(path, query), lambda status, headers: statuses.append(status))
+            try:
+                b''.join(body)
+            finally:
+                body.close()
+            if not statuses[0].startswith('200'):
+                raise RuntimeError(statuses[0])
+
+        def call():
+            pool.submit(handle).result()
+
+        def run(concurrency, total):
+            samples = []
+            lock = threading.Lock()
+
+            def client(count):
+                for _ in range(count):
+                    started = time.perf_counter()
+                    call()
+                    with lock:
+                        samples.append(time.perf_counter() - started)
+
+            clients = [threading.Thread(target=client, args=(share,)) for share in self.shares(total, concurrency)]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            return samples
+
+        return run
+
+    def asgi_runner(self, path, query):
+        from fundoor.asgi import application
+
+        async def call():
+            statuses, done = [], asyncio.Event()
+
+            async def receive():
+                if not statuses:
+                    statuses.append(None)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif not message.get('more_body'):
+                    done.set()
+
+            await application(asgi_scope(path, query), receive, send)
+            if statuses[1] != 200:
+                raise RuntimeError(statuses[1])
+
+        async def run_all(concurrency, total):
+            samples = []
+
+            async def client(count):
+                for _ in range(count):
+                    started = time.perf_counter()
+                    await call()
+                    samples.append(time.perf_counter() - started)
+
+            await asyncio.gather(*(client(share) for share in self.shares(total, concurrency)))
+            return samples
+
+        return lambda concurrency, total: asyncio.run(run_all(concurrency, total))
+
+    def shares(self, total, concurrency):
+        return [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
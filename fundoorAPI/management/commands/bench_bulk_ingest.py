@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from fundoorAPI.bench import bench_client, scratch_database
+from fundoorAPI.models import *
+
+STUB_ORACLE = {'PROVIDER': 'fundoorAPI.pricing.StubProvider', 'REFRESH_INTERVAL': None}
+
+
+class Command(BaseCommand):
+    help = 'Measure contribution and vote ingestion throughput, one per request vs batched'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='rows ingested through the batch endpoints')
+        parser.add_argument('--single-rows', type=int, default=1000, help='rows ingested one request at a time')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--projects', type=int, default=100)
+
+    def handle(self, *args, **options):
+        with scratch_database(), override_settings(PRICE_ORACLE=STUB_ORACLE):
+            network = Network.objects.create(name='bench', chainid=1)
+            category = Category.objects.create(name='bench')
+            fundraiser = User.objects.create(address='0xbenchfundraiser')
+            Currency.objects.create(address='0xbenchcurrency', network=network, name='WETH')
+            for i in range(options['projects']):
+                project = Project.objects.create(fundraiser=fundraiser, title='bench', category=category,
+                                                 project_address='0xp%d' % i, release_epoch=0)
+                CommunityProposal.objects.create(project=project, title='bench', onchain_proposal_nonce=0)
+            proposals = list(CommunityProposal.objects.values_list('id', flat=True))
+            User.objects.bulk_create([User(address='0xu%d' % i) for i in range(1000)])
+            client = bench_client()
+
+            def contribution(i):
+                return {'projectAddress': '0xp%d' % (i % options['projects']), 'contributor': '0xu%d' % (i % 1000),
+                        'currencyAddress': '0xbenchcurrency', 'amount': '1', 'hsh': '0xc%d' % i}
+
+            def vote(i):
+                return {'user': '0xu%d' % (i % 1000), 'proposal': proposals[i % len(proposals)],
+                        'weight': '1', 'vote': i % 3 != 0, 'hsh': '0xv%d' % i}
+
+            single = options['single_rows']
+            self.report('contribute_project', single, lambda: [
+                client.post('/api/contribute_project', contribution(i)) for i in range(single)])
+            self.report('vote_community_action', single, lambda: [
+                client.post('/api/vote_community_action', vote(i)) for i in range(single)])
+
+            rows, size = options['rows'], options['batch_size']
+            offset = single
+            self.report('bulk_contribute', rows, lambda: [
+                client.post('/api/bulk_contribute',
+                            {'contributions': [contribution(i) for i in range(low, min(offset + rows, low + size))]},
+                            content_type='application/json')
+                for low in range(offset, offset + rows, size)])
+            self.report('bulk_vote', rows, lambda: [
+                client.post('/api/bulk_vote',
+                            {'votes': [vote(i) for i in range(low, min(offset + rows, low + size))]},
+                            content_type='application/json')
+                for low in range(offset, offset + rows, size)])
+
+    def report(self, label, rows, run):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        self.stdout.write('%-22s %8d rows %8.2f s %10.0f rows/s' % (label, rows, elapsed, rows / elapsed))
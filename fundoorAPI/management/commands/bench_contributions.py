@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from fundoorAPI.bench import bench_client, scratch_database, summarize, time_calls
+from fundoorAPI.models import *
+
+
+class Command(BaseCommand):
+    help = 'Time contribute_project with the price oracle cache enabled and disabled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--upstream-ms', type=float, default=150,
+                            help='simulated latency of the price upstream')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            network = Network.objects.create(name='bench', chainid=1)
+            category = Category.objects.create(name='bench')
+            user = User.objects.create(address='0xbenchuser')
+            Currency.objects.create(address='0xbenchcurrency', network=network, name='WETH')
+            Project.objects.create(fundraiser=user, title='bench', category=category,
+                                   project_address='0xbenchproject', release_epoch=0)
+            client = bench_client()
+
+            self.stdout.write('%-10s %10s %10s %10s %10s' % ('cache', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms'))
+            for cache in (False, True):
+                oracle = {
+                    'PROVIDER': 'fundoorAPI.pricing.StubProvider',
+                    'PROVIDER_OPTIONS': {'delay': options['upstream_ms'] / 1000.0},
+                    'CACHE': cache,
+                    'TIMEOUT': 5.0,
+                }
+                with override_settings(PRICE_ORACLE=oracle):
+                    def contribute(index):
+                        client.post('/api/contribute_project', {
+                            'projectAddress': '0xbenchproject',
+                            'contributor': '0xbenchuser',
+                            'currencyAddress': '0xbenchcurrency',
+                            'amount': '1',
+                            'hsh': '0x%s%d' % (cache, index),
+                        })
+                    stats = summarize(time_calls(contribute, range(options['requests'])))
+                self.stdout.write('%-10s %10.3f %10.3f %10.3f %10.3f' % (
+                    'enabled' if cache else 'disabled',
+                    stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['mean_ms']))
@@ -0,0 +1,121 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from fundoorAPI.bench import bench_client, scratch_database
+from fundoorAPI.models import *
+
+STUB_ORACLE = {'PROVIDER': 'fundoorAPI.pricing.StubProvider', 'REFRESH_INTERVAL': None}
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent contribute_project writers against each database profile and count lock errors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='sqlite-basic,sqlite',
+                            help='comma separated DB_PROFILES names, e.g. sqlite-basic,sqlite,postgres')
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument('--writes', type=int, default=100, help='per writer')
+        # runs one profile in this process; each profile needs its own process
+        # because the database settings are read at startup
+        parser.add_argument('--worker', action='store_true', help='internal')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_profile(options)))
+            return
+
+        self.stdout.write('%-14s %8s %12s %12s %10s %10s' % (
+            'profile', 'writes', 'lock errors', 'other errors', 'writes/s', 'reads/s'))
+        for profile in options['profiles'].split(','):
+            command = [
+                sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_db_writers', '--worker',
+                '--writers', str(options['writers']), '--readers', str(options['readers']),
+                '--writes', str(options['writes']),
+            ]
+            done = subprocess.run(command, env=dict(os.environ, FUNDOOR_DB_PROFILE=profile),
+                                  capture_output=True, text=True)
+            if done.returncode != 0:
+                self.stdout.write('%-14s skipped: %s' % (profile, (done.stderr.strip().splitlines() or ['failed'])[-1]))
+                continue
+            result = json.loads(done.stdout.strip().splitlines()[-1])
+            self.stdout.write('%-14s %8d %12d %12d %10.1f %10.1f' % (
+                profile, result['writes'], result['lock_errors'], result['other_errors'],
+                result['writes'] / result['seconds'], result['reads'] / result['seconds']))
+
+    def run_profile(self, options):
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # a file, the default in-memory test database is not shared the same way
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            with scratch_database(), override_settings(PRICE_ORACLE=STUB_ORACLE):
+                network = Network.objects.create(name='bench', chainid=1)
+                category = Category.objects.create(name='bench')
+                fundraiser = User.objects.create(address='0xbenchfundraiser')
+                Currency.objects.create(address='0xbenchcurrency', network=network, name='WETH')
+                Project.objects.create(fundraiser=fundraiser, title='bench', category=category,
+                                       project_address='0xbenchproject', release_epoch=0)
+                User.objects.bulk_create([User(address='0xwriter%d' % i) for i in range(options['writers'])])
+                connection.close()
+                return self.hammer(options)
+
+    def hammer(self, options):
+        counts = {'writes': 0, 'lock_errors': 0, 'other_errors': 0, 'reads': 0}
+        lock = threading.Lock()
+        writing = threading.Event()
+        writing.set()
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def writer(index):
+            client = bench_client()
+            try:
+                for i in range(options['writes']):
+                    try:
+                        client.post('/api/contribute_project', {
+                            'projectAddress': '0xbenchproject', 'contributor': '0xwriter%d' % index,
+                            'currencyAddress': '0xbenchcurrency', 'amount': '1', 'hsh': '0x%d_%d' % (index, i),
+                        })
+                        count('writes')
+                    except OperationalError as e:
+                        count('lock_errors' if 'locked' in str(e) else 'other_errors')
+            finally:
+                connection.close()
+
+        def reader():
+            client = bench_client()
+            try:
+                while writing.is_set():
+                    try:
+                        if client.get('/api/get_project_data/0xbenchproject/?expand=funding').status_code == 200:
+                            count('reads')
+                    except OperationalError:
+                        # a read that hit a locked database
+                        pass
+            finally:
+                connection.close()
+
+        writers = [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        seconds = time.perf_counter() - started
+        writing.clear()
+        for thread in readers:
+            thread.join()
+        return dict(counts, seconds=seconds, profile=settings.DB_PROFILE)
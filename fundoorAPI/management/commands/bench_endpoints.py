@@ -0,0 +1,318 @@
+import itertools
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from fundoorAPI import urls
+from fundoorAPI.bench import bench_client, scratch_database, summarize
+from fundoorAPI.models import *
+from fundoorAPI.seeding import Seeder
+
+STUB_ORACLE = {'PROVIDER': 'fundoorAPI.pricing.StubProvider', 'REFRESH_INTERVAL': None}
+
+# seeded into the scratch database, a tenth of seed_data's defaults
+SIZES = {
+    'users': 2000,
+    'projects': 500,
+    'contributions': 50000,
+    'comments': 10000,
+    'proposals': 500,
+    'votes': 10000,
+}
+
+# rows per request of the bulk endpoints
+BULK_ITEMS = 100
+
+
+class Command(BaseCommand):
+    help = ('Drive every route of fundoorAPI/urls.py with concurrent clients and report p50/p95/p99 latency, '
+            'throughput and queries per request, saved as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,8', help='comma separated client counts')
+        parser.add_argument('--requests', type=int, default=200, help='per endpoint and concurrency')
+        parser.add_argument('--endpoints', help='comma separated url names, all routes by default')
+        parser.add_argument('--output', default='bench_endpoints.json')
+        parser.add_argument('--baseline', help='an earlier --output to compare against')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='p95 increase in percent reported as a regression')
+        # a database filled by seed_data instead of a seeded scratch database
+        parser.add_argument('--existing', action='store_true',
+                            help='run against the configured database; write endpoints add rows to it')
+        parser.add_argument('--read-only', action='store_true', help='skip the write endpoints')
+        for name, default in SIZES.items():
+            parser.add_argument('--' + name, type=int, default=default, help='rows seeded into the scratch database')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        levels = [int(value) for value in options['concurrency'].split(',')]
+        baseline = self.load_baseline(options['baseline'])
+        with tempfile.TemporaryDirectory() as directory:
+            media = os.path.join(directory, 'media')
+            os.makedirs(os.path.join(media, 'user_upload'))
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], PRICE_ORACLE=STUB_ORACLE,
+                                   MEDIA_ROOT=media):
+                if options['existing']:
+                    report = self.bench(levels, options, dataset=None)
+                else:
+                    if connection.vendor == 'sqlite':
+                        # a file, so every client thread's connection sees the same data
+                        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+                    with scratch_database():
+                        seeder = Seeder({name: options[name] for name in SIZES}, seed=options['seed'])
+                        dataset = seeder.run()
+                        connection.close()
+                        report = self.bench(levels, options, dataset)
+
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.print_report(report, baseline, options['threshold'])
+        self.stdout.write('Saved to %s' % options['output'])
+
+    def load_baseline(self, path):
+        if not path:
+            return {}
+        try:
+            with open(path) as baseline:
+                results = json.load(baseline)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError('Unreadable baseline %s: %s' % (path, e))
+        return {(row['endpoint'], row['concurrency']): row for row in results}
+
+    def bench(self, levels, options, dataset):
+        targets = self.targets()
+        requests = self.requests(targets)
+        names = [pattern.name for pattern in urls.urlpatterns]
+        if options['endpoints']:
+            wanted = options['endpoints'].split(',')
+            unknown = set(wanted) - set(names)
+            if unknown:
+                raise CommandError('Unknown endpoints: %s' % ', '.join(sorted(unknown)))
+            names = [name for name in names if name in wanted]
+
+        results, skipped = [], {}
+        for name in names:
+            method, write, build = requests.get(name, (None, False, None))
+            if build is None:
+                skipped[name] = 'no request builder'
+                continue
+            if write and options['read_only']:
+                skipped[name] = 'write endpoint, --read-only'
+                continue
+            if isinstance(build, str):
+                skipped[name] = build
+                continue
+            self.stdout.write('%s ...' % name)
+            self.run(method, build, 2, 8)
+            for concurrency in levels:
+                started = time.perf_counter()
+                samples, queries, statuses = self.run(method, build, concurrency, options['requests'])
+                elapsed = time.perf_counter() - started
+                results.append(dict(
+                    summarize(samples), endpoint=name, method=method.upper(), concurrency=concurrency,
+                    rps=len(samples) / elapsed, errors=sum(n for code, n in statuses.items() if code >= 400),
+                    statuses={str(code): n for code, n in sorted(statuses.items())},
+                    queries_mean=sum(queries) / len(queries), queries_max=max(queries),
+                ))
+
+        return {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'commit': git_commit(),
+                'db_profile': getattr(settings, 'DB_PROFILE', None),
+                'db_vendor': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'cpus': os.cpu_count(),
+                'dataset': dataset or 'existing',
+                'requests': options['requests'],
+                'concurrency': levels,
+            },
+            'results': results,
+            'skipped': skipped,
+        }
+
+    def targets(self):
+        # the busiest project and proposal, which is where the load concentrates
+        funding = ProjectFunding.objects.order_by('-contribution_count').select_related('project').first()
+        project = funding.project if funding else Project.objects.first()
+        if project is None:
+            raise CommandError('The database has no projects, run seed_data first')
+        proposal = CommunityProposal.objects.order_by('-voter_count').first()
+        currency = project.currency.first() or Currency.objects.first()
+        users = list(User.objects.order_by('id').values_list('address', flat=True)[:200])
+        comment = Comment.objects.filter(project=project).order_by('id').first()
+        with open(os.path.join(settings.MEDIA_ROOT, 'user_upload', 'bench.jpg'), 'wb') as image:
+            image.write(os.urandom(64 * 1024))
+        return {
+            'project': project.project_address,
+            'category': project.category.name,
+            'word': project.title.split()[0],
+            'proposal': proposal.pk if proposal else None,
+            'currency': currency.address,
+            'network': (currency.network.name, currency.network.chainid),
+            'users': users,
+            'comment': comment.pk if comment else None,
+        }
+
+    def requests(self, t):
+        # url name -> (method, writes, build), build(i) returns (path, client kwargs)
+        serial = itertools.count()
+        project, users = t['project'], t['users']
+
+        def user(i):
+            return users[i % len(users)]
+
+        def unique(prefix):
+            # fits the 42 character address columns
+            return '0x%s%s%08x' % (prefix, os.urandom(12).hex(), next(serial))
+
+        def contribution(i):
+            return {'projectAddress': project, 'contributor': user(i), 'currencyAddress': t['currency'],
+                    'amount': '0.01', 'hsh': unique('c')}
+
+        def vote(i):
+            return {'user': user(i), 'proposal': t['proposal'], 'weight': '1', 'vote': i % 2 == 0, 'hsh': unique('v')}
+
+        def deletable(i):
+            # a fresh comment per request, created outside the timed call
+            comment = Comment.objects.create(project=Project.objects.get(project_address=project),
+                                             user=User.objects.get(address=user(i)), details='bench')
+            return reverse('delete_comment', args=[comment.pk]), {}
+
+        no_proposal = 'the database has no proposals'
+        return {
+            'initiate_project': ('post', True, lambda i: (reverse('initiate_project'), {'data': {
+                'title': 'bench project', 'description': 'bench', 'category': t['category'],
+                'walletAddress': user(i), 'currency': t['currency'], 'chain': t['network'][0],
+                'chainid': t['network'][1], 'projectAddress': unique('p'), 'releaseEpoch': 0,
+                'transactionHash': unique('h'),
+            }})),
+            'get_project_data': ('get', False, lambda i: (
+                reverse('get_project_data', args=[project]), {'data': {'expand': 'comments'}})),
+            'get_community_proposals': ('get', False, lambda i: (
+                reverse('get_community_proposals', args=[project]), {})),
+            'get_votes': ('get', False, lambda i: (reverse('get_votes', args=[t['proposal']]), {}))
+            if t['proposal'] else ('get', False, no_proposal),
+            'get_vote_tally': ('get', False, lambda i: (reverse('get_vote_tally', args=[t['proposal']]), {}))
+            if t['proposal'] else ('get', False, no_proposal),
+            'get_contribution_series': ('get', False, lambda i: (
+                reverse('get_contribution_series', args=[project]), {'data': {'interval': 'day'}})),
+            'get_top_contributors': ('get', False, lambda i: (reverse('get_top_contributors', args=[project]), {})),
+            'contribute_project': ('post', True, lambda i: (reverse('contribute_project'), {'data': contribution(i)})),
+            'add_currency': ('post', True, lambda i: (reverse('add_currency'), {'data': {
+                'projectAddress': project, 'currencyAddress': t['currency'], 'chain': t['network'][0],
+                'chainid': t['network'][1],
+            }})),
+            'add_project_comment': ('post', True, lambda i: (reverse('add_project_comment'), {'data': {
+                'projectAddress': project, 'user': user(i), 'details': 'bench comment %d' % i,
+            }})),
+            'delete_comment': ('delete', True, deletable),
+            'update_comment': ('put', True, lambda i: (reverse('update_comment', args=[t['comment']]), {
+                'data': {'details': 'edited %d' % i}, 'content_type': 'application/json'}))
+            if t['comment'] else ('put', True, 'the project has no comments'),
+            'propose_community_action': ('post', True, lambda i: (reverse('propose_community_action'), {'data': {
+                'projectAddress': project, 'title': 'bench proposal', 'description': 'bench',
+                'onchain_proposal_nonce': i,
+            }})),
+            'vote_community_action': ('post', True, lambda i: (reverse('vote_community_action'), {'data': vote(i)}))
+            if t['proposal'] else ('post', True, no_proposal),
+            'bulk_contribute': ('post', True, lambda i: (reverse('bulk_contribute'), {
+                'data': {'contributions': [contribution(i + n) for n in range(BULK_ITEMS)]},
+                'content_type': 'application/json'})),
+            'bulk_vote': ('post', True, lambda i: (reverse('bulk_vote'), {
+                'data': {'votes': [vote(i + n) for n in range(BULK_ITEMS)]}, 'content_type': 'application/json'}))
+            if t['proposal'] else ('post', True, no_proposal),
+            'search_projects': ('get', False, lambda i: (reverse('search_projects'), {
+                'data': {'q': t['word']} if i % 2 else {'field': 'category', 'value': t['category']}})),
+            'search_project_cards': ('get', False, lambda i: (reverse('search_projects'), {
+                'data': {'view': 'card', **({'q': t['word']} if i % 2 else {'field': 'category', 'value': t['category']})}})),
+            'async_get_project_data': ('get', False, lambda i: (
+                reverse('async_get_project_data', args=[project]), {'data': {'expand': 'comments'}})),
+            'async_get_community_proposals': ('get', False, lambda i: (
+                reverse('async_get_community_proposals', args=[project]), {})),
+            'async_get_votes': ('get', False, lambda i: (reverse('async_get_votes', args=[t['proposal']]), {}))
+            if t['proposal'] else ('get', False, no_proposal),
+            'async_search_projects': ('get', False, lambda i: (reverse('async_search_projects'), {
+                'data': {'q': t['word']} if i % 2 else {'field': 'category', 'value': t['category']}})),
+            'get_media': ('get', False, lambda i: (reverse('get_media', args=['bench.jpg']), {})),
+        }
+
+    def run(self, method, build, concurrency, total):
+        # (latencies, queries per request, status counts); queries the async
+        # views run on pool threads (ASYNC_READS PARALLEL_QUERIES) are not counted
+        samples, queries, statuses = [], [], Counter()
+        lock = threading.Lock()
+
+        def client(indexes):
+            http = bench_client()
+            executed = [0]
+
+            def count(execute, sql, params, many, context):
+                executed[0] += 1
+                return execute(sql, params, many, context)
+
+            try:
+                with connection.execute_wrapper(count):
+                    for i in indexes:
+                        path, kwargs = build(i)
+                        executed[0] = 0
+                        started = time.perf_counter()
+                        response = getattr(http, method)(path, **kwargs)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        response.close()
+                        elapsed = time.perf_counter() - started
+                        with lock:
+                            samples.append(elapsed)
+                            queries.append(executed[0])
+                            statuses[response.status_code] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=(range(start, total, concurrency),))
+                   for start in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, queries, statuses
+
+    def print_report(self, report, baseline, threshold):
+        self.stdout.write('%-30s %5s %9s %9s %9s %9s %8s %7s %6s  %s' % (
+            'endpoint', 'conc', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors', 'status',
+            'vs baseline' if baseline else ''))
+        for row in report['results']:
+            line = '%-30s %5d %9.1f %9.2f %9.2f %9.2f %8.1f %7d %6s' % (
+                row['endpoint'], row['concurrency'], row['rps'], row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                row['queries_mean'], row['errors'], ','.join(row['statuses']))
+            before = baseline.get((row['endpoint'], row['concurrency']))
+            if before:
+                p95 = (row['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0.0
+                line += '  p95 %+6.1f%% req/s %+6.1f%% queries %+.1f%s' % (
+                    p95, (row['rps'] / before['rps'] - 1) * 100 if before['rps'] else 0.0,
+                    row['queries_mean'] - before['queries_mean'], '  REGRESSION' if p95 > threshold else '')
+            self.stdout.write(line)
+        for name, reason in report['skipped'].items():
+            self.stdout.write('%-30s skipped: %s' % (name, reason))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
@@ -0,0 +1,82 @@
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.bench import scratch_database, summarize, time_calls
+from fundoorAPI.models import *
+
+
+class Command(BaseCommand):
+    help = 'Time the address and hash lookups every endpoint starts with as the tables grow'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                            help='comma separated row counts to grow each table to')
+        parser.add_argument('--lookups', type=int, default=2000, help='lookups timed per table and size')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        with scratch_database() as connection:
+            self.network = Network.objects.create(name='bench', chainid=1)
+            self.category = Category.objects.create(name='bench')
+            self.fundraiser = User.objects.create(address='0xbenchfundraiser')
+            self.currency = Currency.objects.create(address='0xbenchcurrency', network=self.network)
+            self.project = Project.objects.create(
+                fundraiser=self.fundraiser, title='bench', category=self.category,
+                project_address='0xbenchproject', release_epoch=0,
+            )
+            self.proposal = CommunityProposal.objects.create(project=self.project, title='bench', onchain_proposal_nonce=0)
+            self.show_plans(connection)
+
+            self.stdout.write('%10s %-28s %10s %10s %10s' % ('rows', 'lookup', 'p50 ms', 'p99 ms', 'mean ms'))
+            current = 0
+            for size in sizes:
+                self.grow(current, size, options['batch_size'])
+                current = size
+                keys = [random.randrange(size) for _ in range(options['lookups'])]
+                lookups = [
+                    ('User.address', lambda i: User.objects.get(address='0xu%d' % i)),
+                    ('Project.project_address', lambda i: Project.objects.get(project_address='0xp%d' % i)),
+                    ('Currency.(address,network)', lambda i: Currency.objects.get(address='0xc%d' % i, network=self.network)),
+                    ('Contribution.hsh', lambda i: Contribution.objects.get(hsh='0xh%d' % i)),
+                    ('Vote.hsh', lambda i: Vote.objects.get(hsh='0xv%d' % i)),
+                ]
+                for label, lookup in lookups:
+                    stats = summarize(time_calls(lookup, keys))
+                    self.stdout.write('%10d %-28s %10.3f %10.3f %10.3f' % (
+                        size, label, stats['p50_ms'], stats['p99_ms'], stats['mean_ms']))
+
+    def grow(self, start, stop, batch_size):
+        for low in range(start, stop, batch_size):
+            high = min(stop, low + batch_size)
+            users = User.objects.bulk_create([User(address='0xu%d' % i) for i in range(low, high)])
+            Project.objects.bulk_create([
+                Project(fundraiser=self.fundraiser, title='p%d' % i, category=self.category,
+                        project_address='0xp%d' % i, release_epoch=0)
+                for i in range(low, high)
+            ])
+            Currency.objects.bulk_create([Currency(address='0xc%d' % i, network=self.network) for i in range(low, high)])
+            Contribution.objects.bulk_create([
+                Contribution(project=self.project, usd_amount=Decimal('1'), user=self.fundraiser,
+                             currency=self.currency, amount=Decimal('1'), hsh='0xh%d' % i)
+                for i in range(low, high)
+            ])
+            Vote.objects.bulk_create([
+                Vote(voter=self.fundraiser, proposal=self.proposal, weight=Decimal('1'), vote=True, hsh='0xv%d' % i)
+                for i in range(low, high)
+            ])
+
+    def show_plans(self, connection):
+        if connection.vendor != 'sqlite':
+            return
+        queries = [
+            User.objects.filter(address='0x'),
+            Project.objects.filter(project_address='0x'),
+            Currency.objects.filter(address='0x', network=self.network),
+            Contribution.objects.filter(hsh='0x'),
+            Vote.objects.filter(hsh='0x'),
+        ]
+        for queryset in queries:
+            self.stdout.write('%s: %s' % (queryset.model.__name__, queryset.explain()))
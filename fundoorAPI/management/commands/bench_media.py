@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.http import FileResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from fundoorAPI.bench import scratch_database
+from fundoorAPI.models import *
+from fundoorAPI.views import get_media
+
+
+def legacy_get_media(request, filename):
+    # get_media as it was: a Media query per request and no validators
+    media = Media.objects.get(image='user_upload/' + filename)
+    return FileResponse(media.image)
+
+
+class Command(BaseCommand):
+    help = 'Requests per second of one worker serving media, before and after the get_media rework'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=1000, help='media rows and files to create')
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--size-kb', type=int, default=200)
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        try:
+            with scratch_database(), override_settings(MEDIA_ROOT=media_root):
+                names = self.seed(options['files'], options['size_kb'] * 1024)
+                factory = RequestFactory()
+                etags = {}
+
+                def full(view):
+                    def run(name):
+                        response = view(factory.get('/media/user_upload/' + name), name)
+                        for _ in response.streaming_content:
+                            pass
+                        response.close()
+                        etags[name] = response.get('ETag')
+                    return run
+
+                def revalidate(name):
+                    get_media(factory.get('/media/user_upload/' + name, HTTP_IF_NONE_MATCH=etags[name]), name)
+
+                def sendfile(name):
+                    get_media(factory.get('/media/user_upload/' + name), name)
+
+                cases = [
+                    ('before: lookup + stream', full(legacy_get_media), {}),
+                    ('after: stream', full(get_media), {}),
+                    ('after: 304 revalidation', revalidate, {}),
+                    ('after: x-accel-redirect', sendfile, {'MEDIA_SENDFILE': {'MODE': 'x-accel-redirect'}}),
+                ]
+                self.stdout.write('%-26s %12s' % ('case', 'req/s'))
+                for label, run, overrides in cases:
+                    with override_settings(**overrides):
+                        started = time.perf_counter()
+                        for index in range(options['requests']):
+                            run(names[index % len(names)])
+                        elapsed = time.perf_counter() - started
+                    self.stdout.write('%-26s %12.0f' % (label, options['requests'] / elapsed))
+        finally:
+            shutil.rmtree(media_root)
+
+    def seed(self, count, size):
+        fundraiser = User.objects.create(address='0xbench')
+        project = Project.objects.create(fundraiser=fundraiser, title='bench', release_epoch=0,
+                                         category=Category.objects.create(name='bench'), project_address='0xbench')
+        payload = os.urandom(size)
+        names = []
+        for index in range(count):
+            media = Media(project=project)
+            media.image.save('bench%d.jpg' % index, ContentFile(payload), save=True)
+            names.append(os.path.basename(media.image.name))
+        return names
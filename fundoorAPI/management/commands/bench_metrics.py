@@ -0,0 +1,96 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import resolve
+
+from fundoorAPI import metrics
+from fundoorAPI.bench import bench_client, scratch_database
+from fundoorAPI.models import *
+from fundoorAPI.seeding import Seeder
+
+MIDDLEWARE = 'fundoorAPI.metrics.metrics_middleware'
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of the metrics middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='per endpoint, round and configuration')
+        parser.add_argument('--rounds', type=int, default=5, help='alternating runs with and without metrics')
+
+    def handle(self, *args, **options):
+        with scratch_database(), override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost']):
+            Seeder({'users': 200, 'projects': 20, 'contributions': 2000, 'comments': 200, 'proposals': 5,
+                    'votes': 200}, seed=0).run()
+            project = Project.objects.order_by('id').first().project_address
+            proposal = CommunityProposal.objects.order_by('id').first().pk
+            endpoints = [
+                ('get_vote_tally', '/api/get_vote_tally/%d/' % proposal),
+                ('get_project_data', '/api/get_project_data/%s/' % project),
+                ('unmatched 404', '/api/no_such_route'),
+            ]
+            without = [name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+
+            self.stdout.write('%-18s %14s %14s %12s %10s' % (
+                'endpoint', 'without us', 'with us', 'cost us', 'overhead'))
+            for label, url in endpoints:
+                totals = {'without': [], 'with': []}
+                # interleaved, in alternating order, so drift in machine load
+                # and warm-up hit both alike
+                configurations = [('without', without), ('with', [MIDDLEWARE] + without)]
+                for round in range(options['rounds']):
+                    for name, middleware in configurations[::-1 if round % 2 else 1]:
+                        with override_settings(MIDDLEWARE=middleware):
+                            totals[name].append(self.time_requests(url, options['requests']))
+                # best round of each, the least disturbed by the rest of the machine
+                base, instrumented = min(totals['without']), min(totals['with'])
+                self.stdout.write('%-18s %14.1f %14.1f %12.1f %9.2f%%' % (
+                    label, base * 1e6, instrumented * 1e6, (instrumented - base) * 1e6,
+                    (instrumented / base - 1) * 100))
+
+            # the same costs without the noise of whole requests
+            self.stdout.write('middleware per request: %.2f us, per query: %.2f us' % self.isolated_costs(
+                '/api/get_vote_tally/%d/' % proposal, 100000))
+
+    def isolated_costs(self, path, count):
+        request = RequestFactory().get(path)
+        request.resolver_match = resolve(path)
+        response = HttpResponse(b'x' * 180)
+        bare = lambda request: response
+        instrumented = metrics.metrics_middleware(bare)
+        per_request = self.mean_seconds(instrumented, request, count) - self.mean_seconds(bare, request, count)
+
+        cursor = connection.cursor()
+        select = lambda request: cursor.execute('SELECT 1')
+        wrappers = connection.execute_wrappers
+        connection.execute_wrappers = [wrapper for wrapper in wrappers if wrapper is not metrics.count_query]
+        try:
+            plain = self.mean_seconds(select, request, count)
+        finally:
+            connection.execute_wrappers = wrappers
+        token = metrics.current_request.set([0, 0.0])
+        try:
+            counted = self.mean_seconds(select, request, count)
+        finally:
+            metrics.current_request.reset(token)
+        return per_request * 1e6, (counted - plain) * 1e6
+
+    def mean_seconds(self, fn, argument, count):
+        started = time.perf_counter()
+        for _ in range(count):
+            fn(argument)
+        return (time.perf_counter() - started) / count
+
+    def time_requests(self, url, count):
+        # mean seconds per request
+        client = bench_client()
+        client.get(url)
+        started = time.perf_counter()
+        for _ in range(count):
+            client.get(url)
+        return (time.perf_counter() - started) / count
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Count
+from django.test.utils import override_settings
+
+from fundoorAPI.aggregates import funding_drift, tally_drift
+from fundoorAPI.bench import bench_client, scratch_database
+from fundoorAPI.models import *
+
+STUB_ORACLE = {'PROVIDER': 'fundoorAPI.pricing.StubProvider', 'REFRESH_INTERVAL': None}
+
+
+class Command(BaseCommand):
+    help = ('Stress contribute_project and vote_community_action with concurrent retries of the same transaction '
+            'hashes and check that each is stored exactly once')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--hashes', type=int, default=200, help='per phase')
+        parser.add_argument('--retries', type=int, default=3, help='clients posting each hash at the same time')
+
+    def handle(self, *args, **options):
+        if options['retries'] > options['clients']:
+            raise CommandError('--retries cannot exceed --clients')
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # a file, the default in-memory test database is not shared the same way
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            with scratch_database(), override_settings(PRICE_ORACLE=STUB_ORACLE, ALLOWED_HOSTS=['localhost']):
+                network = Network.objects.create(name='bench', chainid=1)
+                category = Category.objects.create(name='bench')
+                fundraiser = User.objects.create(address='0xbenchfundraiser')
+                Currency.objects.create(address='0xbenchcurrency', network=network, name='WETH')
+                project = Project.objects.create(fundraiser=fundraiser, title='bench', category=category,
+                                                 project_address='0xbenchproject', release_epoch=0)
+                proposal = CommunityProposal.objects.create(project=project, title='bench', onchain_proposal_nonce=0)
+                connection.close()
+
+                self.stdout.write('%-10s %9s %9s %12s %14s %10s' % (
+                    'phase', 'requests', 'statuses', 'requests/s', 'transactions/s', 'rows/hash'))
+                for phase, retries in (('unique', 1), ('retried', options['retries'])):
+                    self.run_phase(phase, retries, options, proposal.pk)
+
+                problems = funding_drift() + tally_drift()
+                if problems:
+                    raise CommandError('aggregates drifted: %s' % problems)
+
+    def run_phase(self, phase, retries, options, proposal):
+        hashes = ['0x%s%d' % (phase, i) for i in range(options['hashes'])]
+        clients = options['clients']
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def client_loop(index):
+            # client index posts hash i when it is one of the `retries` clients after i % clients,
+            # so every hash is in flight on that many clients at about the same time
+            client = bench_client()
+            mine = [hsh for i, hsh in enumerate(hashes) if (index - i) % clients < retries]
+            try:
+                for hsh in mine:
+                    for url, data in (
+                        ('/api/contribute_project', {'projectAddress': '0xbenchproject', 'amount': '1', 'hsh': hsh,
+                                                     'contributor': '0xbenchfundraiser',
+                                                     'currencyAddress': '0xbenchcurrency'}),
+                        ('/api/vote_community_action', {'user': '0xbenchfundraiser', 'proposal': proposal,
+                                                        'weight': '1', 'vote': True, 'hsh': hsh,
+                                                        'chain': 'bench', 'chainid': 1}),
+                    ):
+                        try:
+                            status = client.post(url, data, content_type='application/json').status_code
+                        except OperationalError:
+                            status = 'locked'
+                        with lock:
+                            statuses[status] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        rows = Counter()
+        for model in (Contribution, Vote):
+            per_hash = model.objects.filter(hsh__in=hashes).values('hsh').order_by().annotate(rows=Count('id'))
+            rows.update(row['rows'] for row in per_hash)
+        requests = sum(statuses.values())
+        self.stdout.write('%-10s %9d %9s %12.1f %14.1f %10s' % (
+            phase, requests, ','.join('%s:%d' % item for item in sorted(statuses.items(), key=str)),
+            requests / seconds, 2 * len(hashes) / seconds,
+            ','.join('%d:%d' % item for item in sorted(rows.items()))))
+        if set(rows) != {1} or sum(rows.values()) != 2 * len(hashes):
+            raise CommandError('%s: expected exactly one row per hash, found %s' % (phase, dict(rows)))
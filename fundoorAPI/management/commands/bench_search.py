@@ -0,0 +1,61 @@
+import random
+import string
+
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.bench import bench_client, scratch_database, summarize, time_calls
+from fundoorAPI.models import *
+from fundoorAPI.search import rebuild_index, search_project_ids
+
+
+def make_words(count, rng):
+    return [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9))) for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = 'Compare search_projects full-text (q=) against the icontains title search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        vocabulary = make_words(5000, rng)
+        with scratch_database():
+            fundraiser = User.objects.create(address='0xbenchfundraiser')
+            categories = [Category.objects.create(name=name) for name in make_words(20, rng)]
+            total = options['projects']
+            for low in range(0, total, options['batch_size']):
+                Project.objects.bulk_create([
+                    Project(
+                        fundraiser=fundraiser,
+                        title=' '.join(rng.sample(vocabulary, 4)),
+                        description=' '.join(rng.sample(vocabulary, 30)),
+                        category=rng.choice(categories),
+                        project_address='0xp%d' % i,
+                        release_epoch=0,
+                    )
+                    for i in range(low, min(total, low + options['batch_size']))
+                ])
+            rebuild_index()
+
+            client = bench_client()
+            terms = [rng.choice(vocabulary) for _ in range(options['queries'])]
+            modes = [
+                # the lookup alone, without serializing the page
+                ('icontains query', lambda term: list(
+                    Project.objects.filter(title__icontains=term).order_by('-created_at', '-id').values_list('id')[:21])),
+                ('fts query', lambda term: search_project_ids(term, 21)),
+                # the whole endpoint
+                ('icontains title', lambda term: client.get('/api/search_projects', {'field': 'title', 'value': term})),
+                ('fts q', lambda term: client.get('/api/search_projects', {'q': term})),
+                ('fts q prefix', lambda term: client.get('/api/search_projects', {'q': term[:3]})),
+            ]
+            self.stdout.write('%d projects' % total)
+            self.stdout.write('%-16s %10s %10s %10s %10s' % ('mode', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms'))
+            for label, search in modes:
+                stats = summarize(time_calls(search, terms))
+                self.stdout.write('%-16s %10.3f %10.3f %10.3f %10.3f' % (
+                    label, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['mean_ms']))
@@ -0,0 +1,87 @@
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from fundoorAPI import renderers
+from fundoorAPI.aggregates import rebuild_funding, rebuild_tallies
+from fundoorAPI.bench import bench_client, scratch_database
+from fundoorAPI.cards import rebuild_cards
+from fundoorAPI.models import *
+
+
+class Command(BaseCommand):
+    help = 'Compare the serializer and fastread read paths, with the stock and the orjson renderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=200)
+        parser.add_argument('--contributions', type=int, default=10, help='per project')
+        parser.add_argument('--comments', type=int, default=5, help='per project')
+        parser.add_argument('--votes', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=200)
+
+    def seed(self, options):
+        network = Network.objects.create(name='bench', chainid=1)
+        category = Category.objects.create(name='bench')
+        currency = Currency.objects.create(address='0xbenchcurrency', network=network, name='WETH')
+        users = User.objects.bulk_create([User(address='0xu%d' % i) for i in range(100)])
+        projects = Project.objects.bulk_create([
+            Project(fundraiser=users[i % 100], title='bench %d' % i, description='project %d' % i,
+                    category=category, project_address='0xp%d' % i, release_epoch=0)
+            for i in range(options['projects'])
+        ])
+        Project.currency.through.objects.bulk_create([
+            Project.currency.through(project_id=project.pk, currency_id=currency.pk) for project in projects
+        ])
+        Contribution.objects.bulk_create([
+            Contribution(project=project, usd_amount=Decimal('12.34'), user=users[i % 100], currency=currency,
+                         amount=Decimal('0.005'), hsh='0x%d_%d' % (project.pk, i))
+            for project in projects for i in range(options['contributions'])
+        ], batch_size=1000)
+        Comment.objects.bulk_create([
+            Comment(project=project, details='comment %d' % i, user=users[i % 100])
+            for project in projects for i in range(options['comments'])
+        ], batch_size=1000)
+        proposal = CommunityProposal.objects.create(project=projects[0], title='bench', onchain_proposal_nonce=0)
+        Vote.objects.bulk_create([
+            Vote(voter=users[i % 100], proposal=proposal, weight=Decimal('1.25'), vote=bool(i % 2), hsh='0xv%d' % i)
+            for i in range(options['votes'])
+        ], batch_size=1000)
+        rebuild_funding()
+        rebuild_tallies()
+        rebuild_cards()
+        return proposal
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            proposal = self.seed(options)
+            client = bench_client()
+            endpoints = [
+                ('search_projects', '/api/search_projects?field=category&value=bench&limit=20'),
+                ('search cards', '/api/search_projects?view=card&field=category&value=bench&limit=20'),
+                ('get_votes', '/api/get_votes/%d/' % proposal.pk),
+            ]
+            paths = [
+                ('serializers', False, False),
+                ('serializers', False, True),
+                ('fastread', True, False),
+                ('fastread', True, True),
+            ]
+
+            self.stdout.write('%-16s %-12s %-8s %10s %14s %10s' % (
+                'endpoint', 'read path', 'json', 'req/s', 'cpu ms/req', 'bytes'))
+            for label, url in endpoints:
+                for path, fast, use_orjson in paths:
+                    # without orjson the renderer falls back to the stock JSONRenderer
+                    orjson = renderers.orjson if use_orjson else None
+                    with override_settings(FAST_READ_PATH=fast), mock.patch.object(renderers, 'orjson', orjson):
+                        size = len(client.get(url).content)
+                        wall, cpu = time.perf_counter(), time.process_time()
+                        for _ in range(options['requests']):
+                            client.get(url)
+                        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                    self.stdout.write('%-16s %-12s %-8s %10.1f %14.3f %10d' % (
+                        label, path, 'orjson' if use_orjson else 'stdlib',
+                        options['requests'] / wall, cpu / options['requests'] * 1000, size))
@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from fundoorAPI import refcache, writequeue
+from fundoorAPI.aggregates import tally_drift
+from fundoorAPI.bench import bench_client, scratch_database, summarize
+from fundoorAPI.models import *
+
+
+class Command(BaseCommand):
+    help = ('Compare vote_community_action latency under concurrent voters with and without the write queue, '
+            'one process per voter like separate server workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16, help='voter processes')
+        parser.add_argument('--votes', type=int, default=100, help='per client and mode')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # a file, the default in-memory test database is not shared the same way
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            with scratch_database(), override_settings(ALLOWED_HOSTS=['localhost']):
+                # created up front, the voter processes would each create it
+                Network.objects.create(name=refcache.DEFAULT_NETWORK[0], chainid=refcache.DEFAULT_NETWORK[1])
+                fundraiser = User.objects.create(address='0xbenchfundraiser')
+                project = Project.objects.create(fundraiser=fundraiser, title='bench',
+                                                 category=Category.objects.create(name='bench'),
+                                                 project_address='0xbenchproject', release_epoch=0)
+                proposal = CommunityProposal.objects.create(project=project, title='bench', onchain_proposal_nonce=0)
+                User.objects.bulk_create([User(address='0xvoter%d' % i) for i in range(options['clients'])])
+                connection.close()
+
+                self.stdout.write('%-8s %9s %16s %12s %9s %9s %9s %12s' % (
+                    'mode', 'requests', 'statuses', 'requests/s', 'p50 ms', 'p99 ms', 'max ms', 'applied in s'))
+                for mode in ('sync', 'queued'):
+                    queue = {'ENABLED': mode == 'queued', 'PATH': os.path.join(directory, 'queue.sqlite3'),
+                             'BATCH_SIZE': options['batch_size'], 'POLL_INTERVAL': 0.01}
+                    with override_settings(WRITE_QUEUE=queue):
+                        self.run_mode(mode, options, proposal.pk)
+
+                stored = Vote.objects.count()
+                if stored != 2 * options['clients'] * options['votes']:
+                    raise CommandError('expected %d votes, found %d' % (2 * options['clients'] * options['votes'], stored))
+                problems = tally_drift()
+                if problems:
+                    raise CommandError('tallies drifted: %s' % problems)
+
+    def run_mode(self, mode, options, proposal):
+        stop = threading.Event()
+
+        def worker_loop():
+            # drain_write_queue, running alongside the voters
+            try:
+                while True:
+                    if not writequeue.drain(options['batch_size']) and stop.is_set():
+                        return
+                    time.sleep(0.01)
+            finally:
+                connection.close()
+                writequeue.close()
+
+        # forked after connection.close() and before the worker thread opens
+        # any, SQLite connections and locks must not cross a fork
+        with multiprocessing.get_context('fork').Pool(options['clients']) as pool:
+            worker = threading.Thread(target=worker_loop) if mode == 'queued' else None
+            if worker:
+                worker.start()
+            started = time.perf_counter()
+            results = pool.starmap(vote_loop, [(mode, index, options['votes'], proposal)
+                                               for index in range(options['clients'])])
+            answered = time.perf_counter() - started
+            stop.set()
+            if worker:
+                worker.join()
+            applied = time.perf_counter() - started
+
+        samples = [sample for client_samples, _ in results for sample in client_samples]
+        statuses = sum((Counter(client_statuses) for _, client_statuses in results), Counter())
+        summary = summarize(samples)
+        requests = sum(statuses.values())
+        self.stdout.write('%-8s %9d %16s %12.1f %9.1f %9.1f %9.1f %12.2f' % (
+            mode, requests, ','.join('%s:%d' % item for item in sorted(statuses.items(), key=str)),
+            requests / answered, summary['p50_ms'], summary['p99_ms'], max(samples) * 1000, applied))
+
+
+def vote_loop(mode, index, votes, proposal):
+    # one voter process: (latencies in seconds, {status: count})
+    client = bench_client()
+    samples, statuses = [], Counter()
+    for i in range(votes):
+        data = {'user': '0xvoter%d' % index, 'proposal': proposal, 'weight': '1', 'vote': i % 2 == 0,
+                'hsh': '0x%s%d_%d' % (mode, index, i)}
+        started = time.perf_counter()
+        try:
+            status = client.post('/api/vote_community_action', data, content_type='application/json').status_code
+        except OperationalError:
+            status = 'locked'
+        samples.append(time.perf_counter() - started)
+        statuses[status] += 1
+    connection.close()
+    return samples, dict(statuses)
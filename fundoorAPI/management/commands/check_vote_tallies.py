@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.aggregates import rebuild_tallies, tally_drift
+
+
+class Command(BaseCommand):
+    help = 'Recompute proposal vote tallies from the Vote table and report (or --fix) any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('proposal_ids', nargs='*', type=int, help='limit to these proposals (default: all)')
+        parser.add_argument('--fix', action='store_true', help='write the recomputed tallies back')
+
+    def handle(self, *args, **options):
+        proposal_ids = options['proposal_ids'] or None
+        drifted = rebuild_tallies(proposal_ids) if options['fix'] else tally_drift(proposal_ids)
+        for pk, stored, expected in drifted:
+            self.stdout.write('proposal %d: stored yes=%s no=%s voters=%s, expected yes=%s no=%s voters=%s' % (
+                (pk,) + tuple(stored) + tuple(expected)))
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS('Fixed %d proposal(s)' % len(drifted)))
+        else:
+            self.stdout.write('%d proposal(s) drifted' % len(drifted))
@@ -0,0 +1,44 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+
+from fundoorAPI import writequeue
+
+
+class Command(BaseCommand):
+    help = 'Apply the comments and votes queued in write-behind mode, one transaction per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='drain the jobs queued so far and exit')
+        parser.add_argument('--batch-size', type=int, help='jobs per transaction (default: WRITE_QUEUE["BATCH_SIZE"])')
+
+    def handle(self, *args, **options):
+        settings = writequeue.queue_settings()
+        done = failed = 0
+        pruned_at = 0.0
+        while True:
+            try:
+                finished = writequeue.drain(options['batch_size'])
+            except (OperationalError, sqlite3.OperationalError) as error:
+                # nothing is lost, the batch is still pending or recorded on the checkpoint
+                if options['once']:
+                    raise
+                self.stderr.write('drain failed, retrying: %s' % error)
+                time.sleep(settings['POLL_INTERVAL'])
+                continue
+            statuses = [job['status'] for job in finished.values()]
+            done += statuses.count('done')
+            failed += statuses.count('failed')
+            if finished:
+                if not options['once']:
+                    self.stdout.write('Applied %d job(s), %d failed' % (statuses.count('done'), statuses.count('failed')))
+                continue
+            if options['once']:
+                break
+            if time.monotonic() - pruned_at > 60:
+                writequeue.prune()
+                pruned_at = time.monotonic()
+            time.sleep(settings['POLL_INTERVAL'])
+        self.stdout.write(self.style.SUCCESS('Applied %d job(s), %d failed' % (done, failed)))
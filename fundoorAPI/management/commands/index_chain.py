@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fundoorAPI.chain import RPCError, chain_settings, indexer
+from fundoorAPI.models import Network
+
+
+class Command(BaseCommand):
+    help = 'Index contributions and votes from the project contract logs of each configured network'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--network', action='append', help='network name, repeatable (default: every network '
+                                                               'in CHAIN_INDEXER with an RPC_URL)')
+        parser.add_argument('--rpc-url', help='override the RPC_URL of a single --network')
+        parser.add_argument('--once', action='store_true', help='index up to the current head and exit')
+        parser.add_argument('--from-block', type=int, help='rescan from this block; rows indexed after it are '
+                                                           'deleted and indexed again')
+
+    def handle(self, *args, **options):
+        settings = chain_settings()
+        names = options['network'] or [
+            name for name, network in settings['NETWORKS'].items() if network.get('RPC_URL')
+        ]
+        if not names:
+            raise CommandError('No network to index, configure CHAIN_INDEXER["NETWORKS"] or pass --network')
+        if options['rpc_url'] and len(names) != 1:
+            raise CommandError('--rpc-url needs exactly one --network')
+        try:
+            indexers = [indexer(name, options['rpc_url']) for name in names]
+        except (Network.DoesNotExist, ValueError) as error:
+            raise CommandError(error)
+
+        if options['from_block'] is not None:
+            for current in indexers:
+                current.rollback(options['from_block'] - 1)
+                self.stdout.write('%s: rescanning from block %d' % (current.network.name, options['from_block']))
+
+        while True:
+            for current in indexers:
+                try:
+                    summary = current.poll()
+                except RPCError as error:
+                    if options['once']:
+                        raise CommandError('%s: %s' % (current.network.name, error))
+                    self.stderr.write('%s: %s' % (current.network.name, error))
+                    continue
+                if summary['rewound_to'] is not None:
+                    self.stdout.write(self.style.WARNING('%s: reorg, rewound to block %d' % (
+                        current.network.name, summary['rewound_to'])))
+                if summary['to'] >= summary['from'] or options['once']:
+                    self.stdout.write('%s: blocks %d-%d of %d, %d contribution(s), %d vote(s), %d skipped' % (
+                        current.network.name, summary['from'], summary['to'], summary['head'],
+                        summary['contributions'], summary['votes'], summary['skipped']))
+            if options['once']:
+                return
+            time.sleep(settings['POLL_INTERVAL'])
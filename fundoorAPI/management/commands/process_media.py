@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.media import process_media
+from fundoorAPI.models import Media
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized variants for media the pipeline has not processed (or all with --all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='reprocess media that already has variants')
+
+    def handle(self, *args, **options):
+        media = Media.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            media = media.filter(variants={})
+        processed = failed = 0
+        for item in media.iterator():
+            try:
+                process_media(item)
+                processed += 1
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write('media %d (%s): %s' % (item.pk, item.image.name, e))
+        self.stdout.write(self.style.SUCCESS('Processed %d media, %d failed' % (processed, failed)))
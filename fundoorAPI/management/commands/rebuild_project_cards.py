@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.cards import card_drift, rebuild_cards
+from fundoorAPI.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the denormalized project cards from the project, media and funding tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_addresses', nargs='*', help='limit to these projects (default: all)')
+        parser.add_argument('--check', action='store_true', help='only report projects whose cards drifted')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        project_ids = None
+        if options['project_addresses']:
+            project_ids = list(Project.objects.filter(
+                project_address__in=options['project_addresses']
+            ).values_list('id', flat=True))
+
+        if options['check']:
+            drifted = card_drift(project_ids)
+            for project_id in drifted:
+                self.stdout.write('drift: project %d' % project_id)
+            self.stdout.write('%d project(s) drifted' % len(drifted))
+            return
+
+        rebuilt = rebuild_cards(project_ids, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt cards for %d project(s)' % rebuilt))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.aggregates import funding_drift, rebuild_funding
+from fundoorAPI.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-project funding aggregates from the Contribution table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_addresses', nargs='*', help='limit to these projects (default: all)')
+        parser.add_argument('--check', action='store_true', help='only report projects whose aggregates drifted')
+
+    def handle(self, *args, **options):
+        project_ids = None
+        if options['project_addresses']:
+            project_ids = list(Project.objects.filter(
+                project_address__in=options['project_addresses']
+            ).values_list('id', flat=True))
+
+        drifted = funding_drift(project_ids)
+        for project_id in drifted:
+            self.stdout.write('drift: project %d' % project_id)
+        if options['check']:
+            self.stdout.write('%d project(s) drifted' % len(drifted))
+            return
+
+        rebuilt = rebuild_funding(project_ids)
+        self.stdout.write(self.style.SUCCESS('Rebuilt funding for %d project(s)' % rebuilt))
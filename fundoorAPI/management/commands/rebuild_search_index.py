@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the full-text project search index (needed after bulk loads)'
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            self.stdout.write('Full-text index is only used on SQLite, nothing to do')
+            return
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
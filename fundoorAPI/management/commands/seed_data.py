@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fundoorAPI.seeding import SIZES, Seeder
+
+
+class Command(BaseCommand):
+    help = ('Seed the database with a synthetic dataset for load tests, e.g. --projects 50000 '
+            '--contributions 5000000 --votes 500000 --comments 1000000')
+
+    def add_arguments(self, parser):
+        for name, default in SIZES.items():
+            parser.add_argument('--' + name, type=int, default=default)
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows per bulk insert and transaction')
+        parser.add_argument('--days', type=int, default=365, help='history the activity is spread over')
+        parser.add_argument('--seed', type=int, help='random seed, for a reproducible dataset shape')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        last = {}
+
+        def progress(label, count):
+            # a line per tenth of each table
+            step = count * 10 // max(options.get(label, count), 1)
+            if label == 'aggregates':
+                self.stdout.write('rebuilding funding, tallies and search index')
+            elif last.get(label) != step:
+                last[label] = step
+                self.stdout.write('%-16s %10d  %6.1fs' % (label, count, time.perf_counter() - started))
+
+        seeder = Seeder({name: options[name] for name in SIZES}, batch_size=options['batch_size'],
+                        seed=options['seed'], days=options['days'], progress=progress)
+        counts = seeder.run()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS('Seeded %s in %.1fs (run tag %s)' % (
+            ', '.join('%d %s' % (count, name) for name, count in counts.items()), elapsed, seeder.tag)))
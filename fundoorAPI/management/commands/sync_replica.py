@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from fundoorAPI.routing import PRIMARY, replica_settings
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database into its read replicas, standing in for replication on local and '
+            'test setups')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', help='replica alias, repeatable (default: every alias '
+                                                                 'in READ_REPLICAS)')
+        parser.add_argument('--interval', type=float, help='keep copying every this many seconds')
+
+    def handle(self, *args, **options):
+        aliases = options['database'] or replica_settings()['ALIASES']
+        if not aliases:
+            raise CommandError('No replica to copy to, configure READ_REPLICAS["ALIASES"] or pass --database')
+        for alias in [PRIMARY] + aliases:
+            if alias not in connections:
+                raise CommandError('Unknown database %s' % alias)
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError('%s is not SQLite, use the database\'s own replication' % alias)
+
+        while True:
+            for alias in aliases:
+                started = time.perf_counter()
+                copy_database(connections[PRIMARY], connections[alias])
+                self.stdout.write('%s: copied in %.1f ms' % (alias, (time.perf_counter() - started) * 1000))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+
+def copy_database(source, target):
+    # SQLite's online backup: a consistent snapshot of the primary, which
+    # readers of the replica see all at once
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
@@ -0,0 +1,94 @@
+# Off-request media pipeline
+#
+# The request strips EXIF from an upload before storing it, so an original is
+# never stored or served with its metadata. Resizing to the thumb/card/full
+# WebP variants runs afterwards in a process pool and the result is recorded
+# on Media.variants. An empty variants dict means the image has not been
+# processed yet and readers fall back to the original.
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from .cards import refresh_cards
+from .imaging import render_variants, strip_stream
+from .models import Media, Project
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # worker processes, the request never waits for them
+    'WORKERS': 2,
+    # longest edge in pixels per variant
+    'VARIANTS': {'thumb': 160, 'card': 640, 'full': 1600},
+    'QUALITY': 80,
+    # process inside the calling thread instead (tests, management commands)
+    'SYNC': False,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pipeline_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_PIPELINE', {})}
+
+
+def get_pool(workers):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+
+def strip_upload(upload):
+    # the upload without its metadata, or as is when it carries none
+    data = strip_stream(upload)
+    upload.seek(0)
+    return upload if data is None else ContentFile(data, name=upload.name)
+
+
+def store_variants(media_id, variants):
+    with transaction.atomic():
+        Media.objects.filter(pk=media_id).update(variants=variants)
+        Project.bump_version(media=media_id)
+        refresh_cards(Project.objects.filter(media=media_id).values_list('id', flat=True))
+
+
+def process_media(media):
+    # synchronous processing, returns the variants
+    options = pipeline_settings()
+    variants = render_variants(settings.MEDIA_ROOT, media.image.name, options['VARIANTS'], options['QUALITY'])
+    store_variants(media.pk, variants)
+    media.variants = variants
+    return variants
+
+
+def schedule(media):
+    # queue processing once the upload's transaction has committed
+    transaction.on_commit(lambda: submit(media.pk, media.image.name))
+
+
+def submit(media_id, name):
+    options = pipeline_settings()
+    if options['SYNC']:
+        store_variants(media_id, render_variants(settings.MEDIA_ROOT, name, options['VARIANTS'], options['QUALITY']))
+        return
+    future = get_pool(options['WORKERS']).submit(
+        render_variants, settings.MEDIA_ROOT, name, options['VARIANTS'], options['QUALITY'])
+    future.add_done_callback(lambda done: finish(media_id, done))
+
+
+def finish(media_id, future):
+    # runs on the pool's result thread, which gets its own DB connection
+    try:
+        store_variants(media_id, future.result())
+    except Exception:
+        logger.exception('Processing media %s failed', media_id)
+    finally:
+        connection.close()
@@ -0,0 +1,304 @@
+# Per-endpoint request metrics in the Prometheus text format
+#
+# The middleware records, per URL name, the request count by status, latency,
+# SQL query count, time spent in the database and response size. Threads (and
+# so event loops) are spread over a fixed set of shards, each with its own
+# lock, so concurrent requests rarely wait on each other and the totals of
+# exited threads stay counted without the shards growing with thread churn;
+# /metrics merges the shards. With MULTIPROCESS_DIR set, each
+# worker process also writes its totals to <dir>/<pid>.json every
+# FLUSH_INTERVAL seconds, and /metrics sums the files of all workers. Clear
+# the directory when the service is redeployed, as counters only ever grow.
+import bisect
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+from django.views.decorators.http import require_GET
+
+DEFAULTS = {
+    'ENABLED': True,
+    # shared by the worker processes of one host; None reports this process only
+    'MULTIPROCESS_DIR': None,
+    # seconds between writes of this process's totals to MULTIPROCESS_DIR
+    'FLUSH_INTERVAL': 5,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SHARD_COUNT = 16
+
+# method labels; any other verb a client sends is counted as 'other'
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'])
+
+HISTOGRAMS = [
+    # (name, help, buckets)
+    ('fundoor_http_request_duration_seconds', 'Request latency.', LATENCY_BUCKETS),
+    ('fundoor_http_request_db_queries', 'SQL queries per request.', QUERY_BUCKETS),
+    ('fundoor_http_response_size_bytes', 'Response body size.', SIZE_BUCKETS),
+]
+
+# layout of a series: the bucket counts and sum of each histogram, then the
+# database seconds; the request count is the +Inf bucket
+OFFSETS = list(itertools.accumulate([0] + [len(buckets) + 2 for _, _, buckets in HISTOGRAMS]))
+DB_SECONDS = OFFSETS[-1]
+SERIES_LENGTH = DB_SECONDS + 1
+
+# [queries, seconds] of the request being handled, shared with the threads
+# sync_to_async runs its queries on
+current_request = ContextVar('current_request', default=None)
+
+
+def metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+class Shard:
+    # the totals of the threads sharing it: (endpoint, method, status) -> count
+    # and (endpoint, method) -> series
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.series = {}
+
+    def record(self, endpoint, method, status, seconds, queries, db_seconds, size):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            series = self.series.get((endpoint, method))
+            if series is None:
+                series = self.series[(endpoint, method)] = [0] * SERIES_LENGTH
+            for offset, value, (_, _, buckets) in zip(OFFSETS, (seconds, queries, size), HISTOGRAMS):
+                series[offset + bisect.bisect_left(buckets, value)] += 1
+                series[offset + len(buckets) + 1] += value
+            series[DB_SECONDS] += db_seconds
+
+_local = threading.local()
+_shards = [Shard() for _ in range(SHARD_COUNT)]
+# hands threads their shards round robin; next() on a count is atomic
+_thread_numbers = itertools.count()
+_flush_lock = threading.Lock()
+_next_flush = 0.0
+
+
+def shard():
+    index = getattr(_local, 'index', None)
+    if index is None:
+        index = _local.index = next(_thread_numbers) % SHARD_COUNT
+    return _shards[index]
+
+
+def reset():
+    global _shards, _local
+    _shards = [Shard() for _ in range(SHARD_COUNT)]
+    _local = threading.local()
+
+
+# a forked worker starts from zero rather than repeating its parent's totals
+os.register_at_fork(after_in_child=reset)
+
+
+def snapshot():
+    # this process's totals as {'requests': [[key, count]], 'series': [[key, series]]}
+    requests, series = {}, {}
+    for current in _shards:
+        with current.lock:
+            counts = list(current.requests.items())
+            rows = [(key, list(values)) for key, values in current.series.items()]
+        for key, count in counts:
+            requests[key] = requests.get(key, 0) + count
+        for key, values in rows:
+            merge(series, key, values)
+    return {'requests': [[list(key), count] for key, count in requests.items()],
+            'series': [[list(key), values] for key, values in series.items()]}
+
+
+def merge(totals, key, values):
+    if key in totals:
+        totals[key] = [a + b for a, b in zip(totals[key], values)]
+    else:
+        totals[key] = values
+
+
+def flush(directory):
+    # write this process's totals for the other workers' /metrics
+    path = os.path.join(directory, '%d.json' % os.getpid())
+    with open(path + '.tmp', 'w') as output:
+        json.dump(snapshot(), output)
+    os.replace(path + '.tmp', path)
+
+
+def maybe_flush(directory, interval):
+    # at most one thread flushes, the others carry on without waiting
+    global _next_flush
+    now = time.monotonic()
+    if now < _next_flush or not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        _next_flush = now + interval
+        flush(directory)
+    except OSError:
+        pass
+    finally:
+        _flush_lock.release()
+
+
+def collect(directory=None):
+    # totals of this process, plus those the other workers flushed
+    snapshots = [snapshot()]
+    if directory:
+        own = os.path.join(directory, '%d.json' % os.getpid())
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as stored:
+                    snapshots.append(json.load(stored))
+            except (OSError, ValueError):
+                pass
+    requests, series = {}, {}
+    for data in snapshots:
+        for key, count in data['requests']:
+            requests[tuple(key)] = requests.get(tuple(key), 0) + count
+        for key, values in data['series']:
+            merge(series, tuple(key), values)
+    return requests, series
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in values.items())
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(requests, series):
+    lines = [
+        '# HELP fundoor_http_requests_total Requests by endpoint, method and status.',
+        '# TYPE fundoor_http_requests_total counter',
+    ]
+    for (endpoint, method, status), count in sorted(requests.items()):
+        lines.append('fundoor_http_requests_total%s %d' % (
+            labels(endpoint=endpoint, method=method, status=status), count))
+
+    ordered = sorted(series.items())
+    for offset, (name, help_text, buckets) in zip(OFFSETS, HISTOGRAMS):
+        lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+        for (endpoint, method), values in ordered:
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), values[offset:offset + len(buckets) + 1]):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, labels(endpoint=endpoint, method=method, le=bound), cumulative))
+            lines.append('%s_sum%s %s' % (name, labels(endpoint=endpoint, method=method),
+                                         number(values[offset + len(buckets) + 1])))
+            lines.append('%s_count%s %d' % (name, labels(endpoint=endpoint, method=method), cumulative))
+
+    lines += [
+        '# HELP fundoor_http_request_db_seconds_total Time spent in SQL queries.',
+        '# TYPE fundoor_http_request_db_seconds_total counter',
+    ]
+    for (endpoint, method), values in ordered:
+        lines.append('fundoor_http_request_db_seconds_total%s %s' % (
+            labels(endpoint=endpoint, method=method), number(values[DB_SECONDS])))
+    return '\n'.join(lines) + '\n'
+
+
+def count_query(execute, sql, params, many, context):
+    totals = current_request.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # execute_wrappers outlive reconnects, add the counter once
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+def method_label(request):
+    return request.method if request.method in METHODS else 'other'
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name or 'unnamed'
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    options = metrics_settings()
+    if not options['ENABLED']:
+        return get_response
+    directory, interval = options['MULTIPROCESS_DIR'], options['FLUSH_INTERVAL']
+    for connection in connections.all(initialized_only=True):
+        instrument_connection(None, connection)
+
+    def record(request, response, started, totals):
+        shard().record(endpoint_name(request), method_label(request), response.status_code,
+                       time.perf_counter() - started, totals[0], totals[1], response_size(response))
+        if directory:
+            maybe_flush(directory, interval)
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started, totals = time.perf_counter(), [0, 0.0]
+            token = current_request.set(totals)
+            try:
+                response = await get_response(request)
+            finally:
+                current_request.reset(token)
+            record(request, response, started, totals)
+            return response
+    else:
+        def middleware(request):
+            started, totals = time.perf_counter(), [0, 0.0]
+            token = current_request.set(totals)
+            try:
+                response = get_response(request)
+            finally:
+                current_request.reset(token)
+            record(request, response, started, totals)
+            return response
+    return middleware
+
+
+@require_GET
+def metrics(request):
+    # this process's own totals are read live, not from its file
+    text = exposition(*collect(metrics_settings()['MULTIPROCESS_DIR']))
+    return HttpResponse(text, content_type=CONTENT_TYPE)
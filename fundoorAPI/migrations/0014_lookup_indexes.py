@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0013_vote_hsh'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contribution',
+            name='hsh',
+            field=models.CharField(db_index=True, default='0x', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='project_address',
+            field=models.CharField(max_length=42, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='address',
+            field=models.CharField(default='0x', max_length=42, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='hsh',
+            field=models.CharField(db_index=True, default='0x', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['project', 'created_at'], name='comment_project_created'),
+        ),
+        migrations.AddIndex(
+            model_name='contribution',
+            index=models.Index(fields=['project', 'created_at'], name='contribution_project_created'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['proposal', 'created_at'], name='vote_proposal_created'),
+        ),
+        migrations.AddConstraint(
+            model_name='currency',
+            constraint=models.UniqueConstraint(fields=('address', 'network'), name='unique_currency_address_network'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max, Sum
+
+
+def backfill_funding(apps, schema_editor):
+    Contribution = apps.get_model('fundoorAPI', 'Contribution')
+    ProjectFunding = apps.get_model('fundoorAPI', 'ProjectFunding')
+    ProjectCurrencyFunding = apps.get_model('fundoorAPI', 'ProjectCurrencyFunding')
+    totals = Contribution.objects.values('project_id').order_by().annotate(
+        total_usd=Sum('usd_amount'),
+        contribution_count=Count('id'),
+        contributor_count=Count('user_id', distinct=True),
+        last_contribution_at=Max('created_at'),
+    )
+    ProjectFunding.objects.bulk_create([ProjectFunding(**row) for row in totals])
+    per_currency = Contribution.objects.values('project_id', 'currency_id').order_by().annotate(total_amount=Sum('amount'))
+    ProjectCurrencyFunding.objects.bulk_create([ProjectCurrencyFunding(**row) for row in per_currency])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0015_project_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectCurrencyFunding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.DecimalField(decimal_places=18, default=0, max_digits=80)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjectFunding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_usd', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('contribution_count', models.PositiveIntegerField(default=0)),
+                ('contributor_count', models.PositiveIntegerField(default=0)),
+                ('last_contribution_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='contribution',
+            index=models.Index(fields=['project', 'user'], name='contribution_project_user'),
+        ),
+        migrations.AddField(
+            model_name='projectfunding',
+            name='project',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='funding', to='fundoorAPI.project'),
+        ),
+        migrations.AddField(
+            model_name='projectcurrencyfunding',
+            name='currency',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fundoorAPI.currency'),
+        ),
+        migrations.AddField(
+            model_name='projectcurrencyfunding',
+            name='project',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='currency_funding', to='fundoorAPI.project'),
+        ),
+        migrations.AddConstraint(
+            model_name='projectcurrencyfunding',
+            constraint=models.UniqueConstraint(fields=('project', 'currency'), name='unique_project_currency_funding'),
+        ),
+        migrations.RunPython(backfill_funding, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:11
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_tallies(apps, schema_editor):
+    Vote = apps.get_model('fundoorAPI', 'Vote')
+    CommunityProposal = apps.get_model('fundoorAPI', 'CommunityProposal')
+    rows = Vote.objects.values('proposal_id').order_by().annotate(
+        yes=Sum('weight', filter=Q(vote=True)),
+        no=Sum('weight', filter=Q(vote=False)),
+        voters=Count('voter_id', distinct=True),
+    )
+    CommunityProposal.objects.bulk_update([
+        CommunityProposal(pk=row['proposal_id'], yes_weight=row['yes'] or 0, no_weight=row['no'] or 0, voter_count=row['voters'])
+        for row in rows
+    ], ['yes_weight', 'no_weight', 'voter_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0016_project_funding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communityproposal',
+            name='no_weight',
+            field=models.DecimalField(decimal_places=18, default=0, max_digits=80),
+        ),
+        migrations.AddField(
+            model_name='communityproposal',
+            name='voter_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='communityproposal',
+            name='yes_weight',
+            field=models.DecimalField(decimal_places=18, default=0, max_digits=80),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['proposal', 'voter'], name='vote_proposal_voter'),
+        ),
+        migrations.RunPython(backfill_tallies, migrations.RunPython.noop),
+    ]
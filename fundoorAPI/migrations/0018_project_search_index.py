@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:16
+
+from django.db import migrations
+
+
+FTS_TABLE = 'fundoorAPI_project_fts'
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 only exists on SQLite, other backends use the icontains fallback
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+        "title, description, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % FTS_TABLE
+    )
+    schema_editor.execute(
+        'INSERT INTO %s (rowid, title, description, category) '
+        'SELECT p.id, p.title, COALESCE(p.description, \'\'), c.name '
+        'FROM "fundoorAPI_project" p JOIN "fundoorAPI_category" c ON c.id = p.category_id' % FTS_TABLE
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0017_proposal_vote_tallies'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
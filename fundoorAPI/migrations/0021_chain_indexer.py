@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0020_project_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contribution',
+            name='block_hash',
+            field=models.CharField(blank=True, max_length=66, null=True),
+        ),
+        migrations.AddField(
+            model_name='contribution',
+            name='block_number',
+            field=models.PositiveBigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='block_hash',
+            field=models.CharField(blank=True, max_length=66, null=True),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='block_number',
+            field=models.PositiveBigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ChainCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_number', models.BigIntegerField()),
+                ('block_hash', models.CharField(blank=True, max_length=66, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('network', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoint', to='fundoorAPI.network')),
+            ],
+        ),
+    ]
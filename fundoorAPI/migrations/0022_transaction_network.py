@@ -0,0 +1,81 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max, Min, Q, Sum
+
+
+def remove_repeats(model, parent):
+    # keep the first row of each (network, hash), returns the parents of the rows removed
+    repeated = model.objects.exclude(hsh='0x').exclude(network=None).values('network_id', 'hsh').order_by().annotate(
+        first=Min('id'), count=Count('id')).filter(count__gt=1)
+    parents = set()
+    for row in repeated:
+        extra = model.objects.filter(network_id=row['network_id'], hsh=row['hsh']).exclude(pk=row['first'])
+        parents.update(extra.values_list(parent, flat=True))
+        extra.delete()
+    return parents
+
+
+def backfill_network(apps, schema_editor):
+    Network = apps.get_model('fundoorAPI', 'Network')
+    Contribution = apps.get_model('fundoorAPI', 'Contribution')
+    Vote = apps.get_model('fundoorAPI', 'Vote')
+    CommunityProposal = apps.get_model('fundoorAPI', 'CommunityProposal')
+    ProjectFunding = apps.get_model('fundoorAPI', 'ProjectFunding')
+    ProjectCurrencyFunding = apps.get_model('fundoorAPI', 'ProjectCurrencyFunding')
+    for network_id in Network.objects.values_list('id', flat=True):
+        Contribution.objects.filter(currency__network_id=network_id).update(network_id=network_id)
+        # a vote takes the network of one of its project's currencies
+        Vote.objects.filter(network=None, proposal__project__currency__network_id=network_id).update(
+            network_id=network_id)
+
+    # retries stored twice before the unique index existed, and the aggregates they inflated
+    projects = list(remove_repeats(Contribution, 'project_id'))
+    contributions = Contribution.objects.filter(project_id__in=projects)
+    ProjectFunding.objects.filter(project_id__in=projects).delete()
+    ProjectCurrencyFunding.objects.filter(project_id__in=projects).delete()
+    ProjectFunding.objects.bulk_create([ProjectFunding(**row) for row in contributions.values('project_id').order_by()
+                                        .annotate(total_usd=Sum('usd_amount'), contribution_count=Count('id'),
+                                                  contributor_count=Count('user_id', distinct=True),
+                                                  last_contribution_at=Max('created_at'))])
+    ProjectCurrencyFunding.objects.bulk_create([
+        ProjectCurrencyFunding(**row)
+        for row in contributions.values('project_id', 'currency_id').order_by().annotate(total_amount=Sum('amount'))
+    ])
+
+    proposals = list(remove_repeats(Vote, 'proposal_id'))
+    for row in Vote.objects.filter(proposal_id__in=proposals).values('proposal_id').order_by().annotate(
+            yes=Sum('weight', filter=Q(vote=True)), no=Sum('weight', filter=Q(vote=False)),
+            voters=Count('voter_id', distinct=True)):
+        CommunityProposal.objects.filter(pk=row['proposal_id']).update(
+            yes_weight=row['yes'] or 0, no_weight=row['no'] or 0, voter_count=row['voters'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0021_chain_indexer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contribution',
+            name='network',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='fundoorAPI.network'),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='network',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='fundoorAPI.network'),
+        ),
+        migrations.RunPython(backfill_network, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='contribution',
+            constraint=models.UniqueConstraint(condition=models.Q(('hsh', '0x'), _negated=True), fields=('network', 'hsh'), name='unique_contribution_network_hsh'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(condition=models.Q(('hsh', '0x'), _negated=True), fields=('network', 'hsh'), name='unique_vote_network_hsh'),
+        ),
+    ]
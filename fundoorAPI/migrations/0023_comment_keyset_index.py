@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0022_transaction_network'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['project', 'created_at', 'id'], name='comment_project_created_id'),
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_project_created',
+        ),
+    ]
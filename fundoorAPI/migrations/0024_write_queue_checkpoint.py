@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0023_comment_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WriteQueueCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.CharField(max_length=32, unique=True)),
+                ('job_id', models.BigIntegerField(default=0)),
+                ('results', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_cards(apps, schema_editor):
+    Project = apps.get_model('fundoorAPI', 'Project')
+    Media = apps.get_model('fundoorAPI', 'Media')
+    ProjectCard = apps.get_model('fundoorAPI', 'ProjectCard')
+    images = {}
+    for project_id, image, variants in Media.objects.exclude(image='').exclude(image=None).order_by('id').values_list(
+            'project_id', 'image', 'variants'):
+        images.setdefault(project_id, (variants or {}).get('card') or image)
+    rows = Project.objects.values(
+        'id', 'project_address', 'title', 'category__name', 'fundraiser__address', 'created_at',
+        'funding__total_usd', 'funding__contributor_count')
+    ProjectCard.objects.bulk_create([ProjectCard(
+        project_id=row['id'], project_address=row['project_address'], title=row['title'],
+        category=row['category__name'], fundraiser=row['fundraiser__address'], image=images.get(row['id'], ''),
+        total_usd=row['funding__total_usd'] or 0, contributor_count=row['funding__contributor_count'] or 0,
+        created_at=row['created_at'],
+    ) for row in rows.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0024_write_queue_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectCard',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='fundoorAPI.project')),
+                ('project_address', models.CharField(max_length=42)),
+                ('title', models.CharField(max_length=100)),
+                ('category', models.CharField(max_length=100)),
+                ('fundraiser', models.CharField(max_length=42)),
+                ('image', models.CharField(blank=True, max_length=255)),
+                ('total_usd', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('contributor_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'project'], name='projectcard_created')],
+            },
+        ),
+        migrations.RunPython(backfill_cards, migrations.RunPython.noop),
+    ]
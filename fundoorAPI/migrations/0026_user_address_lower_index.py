@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:59
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundoorAPI', '0025_project_card'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('address'), name='user_address_lower'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Lower
 
 class Network(models.Model):
     # network deployed
@@ -16,7 +17,14 @@ class Category(models.Model):
 
 class User(models.Model):
     # user address
-    address = models.CharField(null=False, blank=False, default="0x", max_length=42)
+    address = models.CharField(null=False, blank=False, default="0x", max_length=42, unique=True)
+
+    class Meta:
+        indexes = [
+            # the chain indexer matches log addresses to users whatever their stored casing
+            models.Index(Lower('address'), name='user_address_lower'),
+        ]
+
     def __str__(self):
             return self.address
 
@@ -28,6 +36,11 @@ class Currency(models.Model):
     # name
     name = models.CharField(null=False, blank=False, default="ERC20", max_length=100)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['address', 'network'], name='unique_currency_address_network'),
+        ]
+
 class Project(models.Model):
     # fundraiser of the project
     fundraiser = models.ForeignKey(User, on_delete=models.PROTECT)
@@ -40,7 +53,7 @@ class Project(models.Model):
     # category of the project
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
     # project address
-    project_address = models.CharField(max_length=42)
+    project_address = models.CharField(max_length=42, unique=True)
     # community oversight
     community_oversight = models.BooleanField(default=False)
     # project creation time
@@ -49,12 +62,26 @@ class Project(models.Model):
     release_epoch = models.IntegerField()
     # The project creation transaction hash
     creation_hash = models.CharField(max_length=66, null=False, blank=False, default="0x")
+    # bumped by every write that changes the project payload, used as its ETag
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='project_created_id'),
+        ]
+
+    @classmethod
+    def bump_version(cls, **lookup):
+        # call inside the write's transaction so a version never names stale data
+        cls.objects.filter(**lookup).update(version=models.F('version') + 1)
 
 class Media(models.Model):
     # linking to project
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     # photo
     image = models.ImageField(upload_to='user_upload/', null=True)
+    # resized WebP variants by label, filled in by the media pipeline
+    variants = models.JSONField(default=dict, blank=True)
 
 class Contribution(models.Model):
     # project
@@ -70,7 +97,28 @@ class Contribution(models.Model):
     # amount
     amount = models.DecimalField(max_digits=80, decimal_places=18)
     # transaction hash
-    hsh = models.CharField(null=False, blank=False, default="0x", max_length=100)
+    hsh = models.CharField(null=False, blank=False, default="0x", max_length=100, db_index=True)
+    # network of the transaction, the currency's; a hash is stored once per network
+    network = models.ForeignKey(Network, on_delete=models.PROTECT, null=True, blank=True)
+    # block of the log it was indexed from, null when posted by a client
+    block_number = models.PositiveBigIntegerField(null=True, blank=True, db_index=True)
+    block_hash = models.CharField(max_length=66, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'created_at'], name='contribution_project_created'),
+            models.Index(fields=['project', 'user'], name='contribution_project_user'),
+        ]
+        constraints = [
+            # "0x" is the placeholder of rows stored without a hash
+            models.UniqueConstraint(fields=['network', 'hsh'], condition=~models.Q(hsh='0x'),
+                                    name='unique_contribution_network_hsh'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.network_id is None and self.currency_id is not None:
+            self.network_id = self.currency.network_id
+        super().save(*args, **kwargs)
 
 class CommunityProposal(models.Model):
     # link to project
@@ -81,6 +129,10 @@ class CommunityProposal(models.Model):
     description = models.TextField(null=True, blank=True)
     # proposal nonce
     onchain_proposal_nonce = models.IntegerField(null=False, blank=False)
+    # vote tallies, maintained by fundoorAPI.aggregates
+    yes_weight = models.DecimalField(max_digits=80, decimal_places=18, default=0)
+    no_weight = models.DecimalField(max_digits=80, decimal_places=18, default=0)
+    voter_count = models.PositiveIntegerField(default=0)
 
 class Comment(models.Model):
     # link to project
@@ -92,6 +144,12 @@ class Comment(models.Model):
     # initiation time
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # keyset pages of get_project_comments, (created_at, id) descending
+            models.Index(fields=['project', 'created_at', 'id'], name='comment_project_created_id'),
+        ]
+
 class Vote(models.Model):
     # voter
     voter = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -104,4 +162,93 @@ class Vote(models.Model):
     # vote
     vote = models.BooleanField()
     # transaction hash
-    hsh = models.CharField(null=False, blank=False, default="0x", max_length=100)
\ No newline at end of file
+    hsh = models.CharField(null=False, blank=False, default="0x", max_length=100, db_index=True)
+    # network of the transaction; a hash is stored once per network
+    network = models.ForeignKey(Network, on_delete=models.PROTECT, null=True, blank=True)
+    # block of the log it was indexed from, null when posted by a client
+    block_number = models.PositiveBigIntegerField(null=True, blank=True, db_index=True)
+    block_hash = models.CharField(max_length=66, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['proposal', 'created_at'], name='vote_proposal_created'),
+            models.Index(fields=['proposal', 'voter'], name='vote_proposal_voter'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['network', 'hsh'], condition=~models.Q(hsh='0x'),
+                                    name='unique_vote_network_hsh'),
+        ]
+
+class ProjectFunding(models.Model):
+    # running totals of a project's contributions, maintained by fundoorAPI.aggregates
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name='funding')
+    # total usd raised
+    total_usd = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    # number of contributions
+    contribution_count = models.PositiveIntegerField(default=0)
+    # number of distinct contributors
+    contributor_count = models.PositiveIntegerField(default=0)
+    # time of the latest contribution
+    last_contribution_at = models.DateTimeField(null=True)
+
+class ProjectCurrencyFunding(models.Model):
+    # project
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='currency_funding')
+    # currency
+    currency = models.ForeignKey(Currency, on_delete=models.CASCADE)
+    # total amount raised in this currency
+    total_amount = models.DecimalField(max_digits=80, decimal_places=18, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'currency'], name='unique_project_currency_funding'),
+        ]
+
+
+class ChainCheckpoint(models.Model):
+    # network indexed by fundoorAPI.chain
+    network = models.OneToOneField(Network, on_delete=models.CASCADE, related_name='checkpoint')
+    # last block whose logs are stored
+    block_number = models.BigIntegerField()
+    # its hash, compared with the chain's on every poll to detect reorgs
+    block_hash = models.CharField(max_length=66, null=True, blank=True)
+    # time of the last poll that moved the checkpoint
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class WriteQueueCheckpoint(models.Model):
+    # id of the queue file drained by fundoorAPI.writequeue
+    queue = models.CharField(max_length=32, unique=True)
+    # last job whose write is stored, committed with the write itself
+    job_id = models.BigIntegerField(default=0)
+    # {job id: status} of the last batch, for the jobs a crashed worker did not mark finished
+    results = models.JSONField(default=dict)
+    # time of the last drained batch
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProjectCard(models.Model):
+    # what a listing shows of a project, denormalized by fundoorAPI.cards; keyed
+    # by the project so listings page it by (created_at, project id) like projects
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    # project address
+    project_address = models.CharField(max_length=42)
+    # title of the project
+    title = models.CharField(max_length=100)
+    # category name
+    category = models.CharField(max_length=100)
+    # fundraiser address
+    fundraiser = models.CharField(max_length=42)
+    # storage name of the first image, its card variant once processed; empty without media
+    image = models.CharField(max_length=255, blank=True)
+    # total usd raised
+    total_usd = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    # number of distinct contributors
+    contributor_count = models.PositiveIntegerField(default=0)
+    # project creation time
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'project'], name='projectcard_created'),
+        ]
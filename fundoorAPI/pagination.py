@@ -0,0 +1,85 @@
+# Keyset (cursor) pagination over (created_at, id)
+#
+# A page is found by seeking past the last row of the previous page instead of
+# skipping OFFSET rows, so page 1000 costs the same index range scan as page 1.
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    # opaque to clients: base64 of the JSON encoded sort key of the last row
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        raise InvalidCursor('Invalid cursor')
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
+
+
+def sort_key(row):
+    # (created_at, id) of a model instance or a .values() row
+    if isinstance(row, dict):
+        return row['created_at'], row['id']
+    return row.created_at, row.id
+
+
+def paginate_by_created(queryset, cursor=None, limit=DEFAULT_LIMIT, descending=True):
+    # returns (rows, next_cursor); next_cursor is None on the last page.
+    # The queryset may be a .values() one as long as it has created_at and id
+    if descending:
+        queryset = queryset.order_by('-created_at', '-id')
+        before, tie = 'created_at__lt', 'id__lt'
+    else:
+        queryset = queryset.order_by('created_at', 'id')
+        before, tie = 'created_at__gt', 'id__gt'
+
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            created_at, pk = parse_datetime(values[0]), int(values[1])
+        except (TypeError, ValueError, IndexError, KeyError):
+            raise InvalidCursor('Invalid cursor')
+        if created_at is None:
+            raise InvalidCursor('Invalid cursor')
+        queryset = queryset.filter(Q(**{before: created_at}) | Q(created_at=created_at, **{tie: pk}))
+
+    # one extra row tells us whether another page exists
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        created_at, pk = sort_key(rows[-1])
+        next_cursor = encode_cursor([created_at.isoformat(), pk])
+    return rows, next_cursor
+
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
@@ -0,0 +1,212 @@
+# USD price oracle used to value contributions
+#
+# Rates are kept in an in-process TTL cache per currency symbol. Concurrent
+# misses for the same symbol share one upstream fetch, a fetch never holds a
+# request longer than TIMEOUT, and a stale rate is served (and refreshed in the
+# background) rather than blocking a write on the upstream.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'PROVIDER': 'fundoorAPI.pricing.CoinbaseProvider',
+    'PROVIDER_OPTIONS': {},
+    # disable to fetch synchronously on every contribution
+    'CACHE': True,
+    # seconds a rate is fresh
+    'TTL': 60,
+    # seconds past TTL a rate may still be served while it is refreshed
+    'MAX_STALE': 3600,
+    # hard limit on how long a request waits for the upstream
+    'TIMEOUT': 2.0,
+    # seconds between background refreshes of recently used symbols, None to disable
+    'REFRESH_INTERVAL': 30,
+    # seconds a symbol may go unused before the background refreshes drop it
+    'REFRESH_IDLE': 600,
+    # currency names priced as another symbol
+    'SYMBOL_ALIASES': {'WETH': 'ETH'},
+}
+
+
+class CoinbaseProvider:
+    url = 'https://api.coinbase.com/v2/exchange-rates?currency={symbol}'
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+
+    def fetch(self, symbol):
+        response = requests.get(self.url.format(symbol=symbol), timeout=self.timeout)
+        if response.status_code != 200: # usd source is down
+            return None
+        # usd rate may not be available
+        usd_rate = response.json().get('data', {}).get('rates', {}).get('USD')
+        return to_decimal(usd_rate)
+
+
+class StubProvider:
+    # offline provider for tests, benchmarks and local development
+    def __init__(self, rates=None, delay=0):
+        self.rates = {symbol: to_decimal(rate) for symbol, rate in (rates or {'ETH': '1800'}).items()}
+        self.delay = delay
+        self.calls = 0
+
+    def fetch(self, symbol):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.rates.get(symbol)
+
+
+def to_decimal(value):
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+class PriceOracle:
+
+    def __init__(self, provider, cache=True, ttl=60, max_stale=3600, timeout=2.0,
+                 refresh_interval=None, refresh_idle=600, symbol_aliases=None):
+        self.provider = provider
+        self.cache = cache
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval
+        self.refresh_idle = refresh_idle
+        self.symbol_aliases = symbol_aliases or {}
+        # symbol -> (rate, fetched_at)
+        self._rates = {}
+        # symbol -> when usd_rate last asked for it, the symbols refreshed in the background
+        self._used = {}
+        # symbol -> Future of the fetch currently running for it
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='price-oracle')
+        self._refresher = None
+        self._stopped = threading.Event()
+
+    def usd_rate(self, name):
+        # USD rate for a currency name, or None when no rate is known
+        symbol = self.symbol_aliases.get(name, name)
+        if not self.cache:
+            return self._wait(self._executor.submit(self.provider.fetch, symbol))
+
+        self._start_refresher()
+        now = time.monotonic()
+        self._used[symbol] = now
+        cached = self._rates.get(symbol)
+        if cached is not None:
+            rate, fetched_at = cached
+            if now - fetched_at < self.ttl:
+                return rate
+            if now - fetched_at < self.ttl + self.max_stale:
+                # stale while revalidate: answer now, refresh behind the request
+                self._fetch(symbol)
+                return rate
+
+        rate = self._wait(self._fetch(symbol))
+        if rate is None and cached is not None:
+            # upstream slow or down: fall back to the last known rate
+            return cached[0]
+        return rate
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except Exception: # timed out or the upstream failed
+            return None
+
+    def _fetch(self, symbol):
+        # coalesce: every caller asking for the same symbol shares one fetch
+        with self._lock:
+            future = self._inflight.get(symbol)
+            if future is None:
+                future = self._executor.submit(self._fetch_and_store, symbol)
+                self._inflight[symbol] = future
+            return future
+
+    def _fetch_and_store(self, symbol):
+        try:
+            rate = self.provider.fetch(symbol)
+            if rate is not None:
+                self._rates[symbol] = (rate, time.monotonic())
+            return rate
+        finally:
+            with self._lock:
+                self._inflight.pop(symbol, None)
+
+    def _start_refresher(self):
+        if self.refresh_interval is None or self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='price-oracle-refresher', daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh_interval):
+            self._refresh_used()
+
+    def _refresh_used(self):
+        # refetch the symbols used within refresh_idle; the others are
+        # forgotten, along with their rates once those can no longer be served
+        now = time.monotonic()
+        for symbol, used_at in list(self._used.items()):
+            if now - used_at < self.refresh_idle:
+                self._fetch(symbol)
+                continue
+            self._used.pop(symbol, None)
+            cached = self._rates.get(symbol)
+            if cached is not None and now - cached[1] >= self.ttl + self.max_stale:
+                self._rates.pop(symbol, None)
+
+    def close(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False)
+
+
+_oracle = None
+_oracle_lock = threading.Lock()
+
+
+def oracle_settings():
+    return {**DEFAULTS, **getattr(settings, 'PRICE_ORACLE', {})}
+
+
+def price_oracle():
+    global _oracle
+    if _oracle is None:
+        with _oracle_lock:
+            if _oracle is None:
+                options = oracle_settings()
+                provider = import_string(options['PROVIDER'])(**options['PROVIDER_OPTIONS'])
+                _oracle = PriceOracle(
+                    provider,
+                    cache=options['CACHE'],
+                    ttl=options['TTL'],
+                    max_stale=options['MAX_STALE'],
+                    timeout=options['TIMEOUT'],
+                    refresh_interval=options['REFRESH_INTERVAL'],
+                    refresh_idle=options['REFRESH_IDLE'],
+                    symbol_aliases=options['SYMBOL_ALIASES'],
+                )
+    return _oracle
+
+
+@receiver(setting_changed)
+def reset_price_oracle(*, setting, **kwargs):
+    global _oracle
+    if setting == 'PRICE_ORACLE' and _oracle is not None:
+        _oracle.close()
+        _oracle = None
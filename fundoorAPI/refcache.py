@@ -0,0 +1,158 @@
+# In-process cache of reference data
+#
+# Networks, currencies, categories and users are looked up by their natural
+# keys (name and chain id, address) on most write requests but almost never
+# change. The resolvers below turn those keys into primary keys from a bounded
+# LRU with a TTL. Only rows that exist are cached, never misses, and an entry
+# is stored once the transaction that saw the row commits, so a rolled back
+# insert cannot leave a dangling key behind. Saves and deletes in this process
+# drop the entries of their model (see signals.py); other processes pick the
+# change up when their entry expires.
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import *
+
+DEFAULTS = {
+    # disable to query the database on every lookup
+    'CACHE': True,
+    # entries across all models, least recently used go first
+    'MAX_ENTRIES': 10000,
+    # seconds an entry is trusted
+    'TTL': 300,
+}
+
+MISSING = object()
+
+
+class ReferenceCache:
+
+    def __init__(self, cache=True, max_entries=10000, ttl=300):
+        self.cache = cache
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # (model, *natural key) -> (value, stored_at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, key, lookup):
+        # lookup() returns the value for key, raising when there is none
+        if not self.cache:
+            return lookup()
+        value = self.get(key)
+        if value is MISSING:
+            value = lookup()
+            transaction.on_commit(lambda: self.set(key, value))
+        return value
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            if time.monotonic() - entry[1] >= self.ttl:
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model, *prefix):
+        # a changed row may sit under any key of its model (a rename moves it);
+        # prefix narrows it down to the keys starting with those values
+        with self._lock:
+            for key in [key for key in self._entries if key[0] is model and key[1:len(prefix) + 1] == prefix]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'REFERENCE_CACHE', {})}
+
+
+def reference_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                options = cache_settings()
+                _cache = ReferenceCache(
+                    cache=options['CACHE'],
+                    max_entries=options['MAX_ENTRIES'],
+                    ttl=options['TTL'],
+                )
+    return _cache
+
+
+@receiver(setting_changed)
+def reset_reference_cache(*, setting, **kwargs):
+    global _cache
+    if setting == 'REFERENCE_CACHE':
+        _cache = None
+
+
+def invalidate(model, *prefix):
+    if _cache is not None:
+        _cache.invalidate(model, *prefix)
+
+
+# network of requests that do not name one
+DEFAULT_NETWORK = ('Optimism Goerli Testnet', 420)
+
+
+def network_id(name, chainid):
+    return reference_cache().resolve((Network, name, str(chainid)), lambda: Network.objects.get_or_create(
+        name=name, chainid=chainid)[0].pk)
+
+
+def currency_id(address, network_id, name=None):
+    # name is only used when the currency is created
+    defaults = {} if name is None else {'name': name}
+    return reference_cache().resolve((Currency, address, network_id), lambda: Currency.objects.get_or_create(
+        address=address, network_id=network_id, defaults=defaults)[0].pk)
+
+
+def project_currencies(project_id, address):
+    # {(network name, chainid): (id, name, network id)} of the project's
+    # currencies at address, raising Currency.DoesNotExist when there is none
+    def lookup():
+        rows = Project.currency.through.objects.filter(project_id=project_id, currency__address=address).values_list(
+            'currency__network__name', 'currency__network__chainid', 'currency_id', 'currency__name',
+            'currency__network_id')
+        currencies = {(name, chainid): (pk, currency_name, network_id)
+                      for name, chainid, pk, currency_name, network_id in rows}
+        if not currencies:
+            raise Currency.DoesNotExist
+        return currencies
+    return reference_cache().resolve((Currency, project_id, address), lookup)
+
+
+def category_id(name):
+    return reference_cache().resolve((Category, name), lambda: Category.objects.get_or_create(name=name)[0].pk)
+
+
+def user_id(address, create=False):
+    # raises User.DoesNotExist for an unknown address unless create is set
+    if create:
+        return reference_cache().resolve((User, address), lambda: User.objects.get_or_create(address=address)[0].pk)
+    return reference_cache().resolve((User, address), lambda: User.objects.values_list(
+        'id', flat=True).get(address=address))
@@ -0,0 +1,126 @@
+# Read replica routing
+#
+# ReplicaRouter sends the reads of GET and HEAD requests to one of the
+# READ_REPLICAS aliases, picked once per request so all of its queries see
+# the same snapshot. Everything else reads from the primary: writes, any
+# request that may write, management commands and other code outside a
+# request. After a successful write, replica_middleware keeps the client's
+# reads on the primary for STICKY_SECONDS, so authors see their own comments
+# and contributions before the replicas catch up. The deadline goes out as a
+# cookie for same-origin clients and in the HEADER response header, which
+# cross-origin frontends (whose fetches carry no cookies) send back as a
+# request header.
+#
+# For the SQLite profiles, `manage.py sync_replica` stands in for
+# replication by copying the primary into each replica file.
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.utils.decorators import sync_and_async_middleware
+
+DEFAULTS = {
+    # database aliases serving reads, empty to read from the primary only
+    'ALIASES': [],
+    # seconds a client reads from the primary after writing
+    'STICKY_SECONDS': 10,
+    'COOKIE': 'fundoor_primary',
+    'HEADER': 'X-Fundoor-Primary',
+}
+
+PRIMARY = 'default'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# replica alias the current request reads from, None for the primary
+read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_settings():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        return db not in replica_settings()['ALIASES']
+
+
+def pinned(request, options):
+    # whether the client wrote within the last STICKY_SECONDS
+    now = time.time()
+    for deadline in (request.COOKIES.get(options['COOKIE']), request.headers.get(options['HEADER'])):
+        try:
+            if deadline and float(deadline) > now:
+                return True
+        except ValueError:
+            pass
+    return False
+
+
+def replica_aliases(options):
+    # a replica configured as the primary's own database, as a test mirror is,
+    # is read through the primary's connection, which sees its transaction
+    primary = connections[PRIMARY].settings_dict
+    return [alias for alias in options['ALIASES'] if not same_database(connections[alias].settings_dict, primary)]
+
+
+def same_database(settings_dict, primary):
+    return all(settings_dict.get(key) == primary.get(key) for key in ('ENGINE', 'NAME', 'HOST', 'PORT'))
+
+
+def choose_alias(request, options):
+    if not options['ALIASES'] or request.method not in SAFE_METHODS or pinned(request, options):
+        return None
+    aliases = replica_aliases(options)
+    return random.choice(aliases) if aliases else None
+
+
+def pin(response, options):
+    # the expiry is in the value too, clients may keep cookies past max-age
+    if options['ALIASES'] and response.status_code < 400:
+        deadline = '%.3f' % (time.time() + options['STICKY_SECONDS'])
+        response.set_cookie(options['COOKIE'], deadline, max_age=options['STICKY_SECONDS'], httponly=True,
+                            samesite='Lax')
+        response[options['HEADER']] = deadline
+
+
+@sync_and_async_middleware
+def replica_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            options = replica_settings()
+            token = read_alias.set(choose_alias(request, options))
+            try:
+                response = await get_response(request)
+            finally:
+                read_alias.reset(token)
+            if request.method not in SAFE_METHODS:
+                pin(response, options)
+            return response
+    else:
+        def middleware(request):
+            options = replica_settings()
+            token = read_alias.set(choose_alias(request, options))
+            try:
+                response = get_response(request)
+            finally:
+                read_alias.reset(token)
+            if request.method not in SAFE_METHODS:
+                pin(response, options)
+            return response
+    return middleware
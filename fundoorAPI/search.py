@@ -0,0 +1,138 @@
+# Full-text project search
+#
+# On SQLite, Project title/description and the category name are indexed in an
+# FTS5 table keyed by project id and ranked with bm25. The index is kept in sync
+# by the signal receivers in fundoorAPI/signals.py; rebuild_index() regenerates
+# it after bulk loads, which bypass signals. Other backends fall back to
+# icontains so the q= search mode keeps working everywhere.
+import re
+
+from django.db import connection, connections, router
+from django.db.models import Q
+
+from .models import Project
+from .pagination import DEFAULT_LIMIT, InvalidCursor, decode_cursor, encode_cursor, paginate_by_created
+
+FTS_TABLE = 'fundoorAPI_project_fts'
+
+# bm25 column weights for (title, description, category)
+BM25_WEIGHTS = (10.0, 1.0, 5.0)
+
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+    "title, description, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % FTS_TABLE
+)
+
+POPULATE_SQL = (
+    'INSERT INTO %s (rowid, title, description, category) '
+    'SELECT p.id, p.title, COALESCE(p.description, \'\'), c.name '
+    'FROM "fundoorAPI_project" p JOIN "fundoorAPI_category" c ON c.id = p.category_id' % FTS_TABLE
+)
+
+
+def fts_enabled(using=None):
+    return (using or connection).vendor == 'sqlite'
+
+
+def create_index(using):
+    with using.cursor() as cursor:
+        cursor.execute(CREATE_SQL)
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute(POPULATE_SQL)
+
+
+def drop_index(using):
+    with using.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+def rebuild_index():
+    if fts_enabled():
+        create_index(connection)
+
+
+def index_projects(project_ids):
+    if not fts_enabled() or not project_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(project_ids))
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE, placeholders), list(project_ids))
+        cursor.execute(POPULATE_SQL + ' WHERE p.id IN (%s)' % placeholders, list(project_ids))
+
+
+def unindex_project(project_id):
+    if fts_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [project_id])
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text or '', re.UNICODE)
+
+
+def match_expression(text):
+    # every term must match, the last one as a prefix so search-as-you-type works
+    terms = tokenize(text)
+    if not terms:
+        return None
+    quoted = ['"%s"' % term for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_project_ids(text, limit, after=None):
+    # one ranked page of (project id, score) rows, best match first;
+    # after is the (score, id) of the last row of the previous page
+    expression = match_expression(text)
+    if expression is None:
+        return []
+
+    score = 'bm25(%s, %s)' % (FTS_TABLE, ', '.join(str(weight) for weight in BM25_WEIGHTS))
+    sql = 'SELECT rowid, %s FROM %s WHERE %s MATCH %%s' % (score, FTS_TABLE, FTS_TABLE)
+    params = [expression]
+    if after is not None:
+        sql += ' AND (%s > %%s OR (%s = %%s AND rowid > %%s))' % (score, score)
+        params += [after[0], after[0], after[1]]
+    sql += ' ORDER BY 2, rowid LIMIT %s'
+    params.append(limit)
+
+    # raw SQL bypasses the router, ask it which database this request reads
+    with connections[router.db_for_read(Project)].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_page(queryset, text, cursor=None, limit=DEFAULT_LIMIT):
+    # (projects, next_cursor) for the q= mode of search_projects
+    if not fts_enabled():
+        return paginate_by_created(fallback_queryset(queryset, text), cursor, limit)
+
+    after = None
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            after = (float(values[0]), int(values[1]))
+        except (TypeError, ValueError, IndexError, KeyError):
+            raise InvalidCursor('Invalid cursor')
+
+    rows = search_project_ids(text, limit + 1, after)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][1], rows[-1][0]])
+
+    # queryset may be a .values() one, which in_bulk() does not accept
+    projects = {row['id'] if isinstance(row, dict) else row.pk: row for row in queryset.filter(pk__in=[pk for pk, _ in rows])}
+    return [projects[pk] for pk, _ in rows if pk in projects], next_cursor
+
+
+def fallback_queryset(queryset, text):
+    # LIKE based search for backends without FTS5
+    terms = tokenize(text)
+    if not terms:
+        return queryset.none()
+    for term in terms:
+        queryset = queryset.filter(
+            Q(title__icontains=term) | Q(description__icontains=term) | Q(category__name__icontains=term)
+        )
+    return queryset
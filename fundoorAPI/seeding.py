@@ -0,0 +1,228 @@
+# Synthetic datasets for load testing
+#
+# Seeds networks, currencies, categories, users and projects, then
+# contributions, comments, proposals and votes. Activity is skewed toward
+# popular projects and users (Zipf-like weights) and spread over the past DAYS
+# days, after the project it belongs to was created. Rows are generated lazily
+# and written with bulk_create one batch per transaction, so millions of
+# contributions never sit in memory at once. bulk_create sends no signals, so
+# the funding totals, vote tallies, project cards and search index are rebuilt
+# at the end.
+# Every address and hash carries a random run tag, so a database can be seeded
+# more than once.
+import itertools
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .aggregates import rebuild_funding, rebuild_tallies
+from .cards import rebuild_cards
+from .models import *
+from .search import fts_enabled, rebuild_index
+
+SIZES = {
+    'users': 10000,
+    'projects': 1000,
+    'contributions': 100000,
+    'comments': 20000,
+    'proposals': 2000,
+    'votes': 20000,
+}
+
+NETWORKS = [('Optimism', 10), ('Optimism Goerli Testnet', 420)]
+
+# (name, usd rate) of the currencies seeded on every network
+CURRENCIES = [('WETH', Decimal('1800')), ('USDC', Decimal('1')), ('DAI', Decimal('1')), ('OP', Decimal('1.5'))]
+
+CATEGORIES = ['Art', 'Music', 'Film', 'Games', 'Technology', 'Publishing', 'Food', 'Charity', 'Education', 'Open Source']
+
+WORDS = (
+    'solar garden album studio open source library community kitchen festival documentary mural '
+    'bridge school robot game console river cleanup podcast novel camera theatre orchestra clinic '
+    'harvest workshop archive protocol wallet market bakery cycling museum village'
+).split()
+
+# exponent of the popularity curve, higher concentrates activity on fewer projects
+SKEW = 0.8
+
+TIMESTAMPED = [Project, Contribution, Comment, Vote]
+
+
+@contextmanager
+def explicit_timestamps():
+    # let bulk_create store the generated created_at instead of now()
+    fields = [model._meta.get_field('created_at') for model in TIMESTAMPED]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def popularity(count, rng):
+    # cumulative weights for rng.choices, ranks shuffled so ids carry no signal
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return list(itertools.accumulate(1.0 / rank ** SKEW for rank in ranks))
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def after(rng, start, now):
+    return start + (now - start) * rng.random()
+
+
+def amount(rng, median):
+    return (Decimal(rng.lognormvariate(0, 1.5)) * median).quantize(Decimal('0.000001'))
+
+
+class Seeder:
+
+    def __init__(self, sizes=None, batch_size=5000, seed=None, days=365, progress=None):
+        self.sizes = {**SIZES, **(sizes or {})}
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.days = days
+        self.progress = progress or (lambda label, count: None)
+        self.tag = '%08x' % self.rng.getrandbits(32)
+        self.now = timezone.now()
+
+    def address(self, kind, index):
+        # 42 characters like an EVM address; kind is a hex digit per table
+        return '0x%s%s%031x' % (self.tag, kind, index)
+
+    def hash(self, kind, index):
+        return '0x%s%s%055x' % (self.tag, kind, index)
+
+    def insert(self, name, model, rows):
+        count = 0
+        for batch in batches(rows, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+            count += len(batch)
+            self.progress(name, count)
+        return count
+
+    def tagged(self, queryset, field, *values):
+        return list(queryset.filter(**{field + '__startswith': '0x' + self.tag}).order_by('id').values_list(*values))
+
+    def run(self):
+        rng, sizes = self.rng, self.sizes
+        counts = {}
+        with explicit_timestamps():
+            networks = [Network.objects.get_or_create(name=name, chainid=chainid)[0] for name, chainid in NETWORKS]
+            categories = [Category.objects.get_or_create(name=name)[0].pk for name in CATEGORIES]
+            Currency.objects.bulk_create([
+                Currency(address=self.address('0', index), network=network, name=name)
+                for index, (network, (name, _)) in enumerate(itertools.product(networks, CURRENCIES))
+            ])
+            rates = dict(CURRENCIES)
+            currencies = [
+                (pk, rates[name], network_id)
+                for pk, name, network_id in self.tagged(Currency.objects, 'address', 'id', 'name', 'network_id')
+            ]
+
+            counts['users'] = self.insert('users', User, (
+                User(address=self.address('1', i)) for i in range(sizes['users'])
+            ))
+            users = [pk for pk, in self.tagged(User.objects, 'address', 'id')]
+            user_weights = popularity(len(users), rng)
+
+            start = self.now - timedelta(days=self.days)
+            counts['projects'] = self.insert('projects', Project, (
+                Project(
+                    fundraiser_id=rng.choices(users, cum_weights=user_weights)[0],
+                    title=sentence(rng, 3).title(), description=sentence(rng, 30),
+                    category_id=rng.choice(categories), project_address=self.address('2', i),
+                    community_oversight=rng.random() < 0.3, created_at=after(rng, start, self.now),
+                    release_epoch=0, creation_hash=self.hash('2', i),
+                )
+                for i in range(sizes['projects'])
+            ))
+            projects = self.tagged(Project.objects, 'project_address', 'id', 'created_at', 'community_oversight')
+            project_weights = popularity(len(projects), rng)
+            project_currencies = {
+                pk: rng.sample(currencies, 2 if rng.random() < 0.3 else 1) for pk, _, _ in projects
+            }
+            self.insert('project currencies', Project.currency.through, (
+                Project.currency.through(project_id=pk, currency_id=currency_id)
+                for pk, chosen in project_currencies.items() for currency_id, _, _ in chosen
+            ))
+
+            def contribution(i):
+                pk, created_at, _ = rng.choices(projects, cum_weights=project_weights)[0]
+                currency_id, rate, network_id = rng.choice(project_currencies[pk])
+                value = amount(rng, 50 / rate)
+                return Contribution(
+                    project_id=pk, user_id=rng.choices(users, cum_weights=user_weights)[0], currency_id=currency_id,
+                    network_id=network_id, amount=value, usd_amount=(value * rate).quantize(Decimal('0.01')),
+                    hsh=self.hash('3', i), created_at=after(rng, created_at, self.now),
+                )
+
+            counts['contributions'] = self.insert(
+                'contributions', Contribution, map(contribution, range(sizes['contributions'])))
+
+            def comment(i):
+                pk, created_at, _ = rng.choices(projects, cum_weights=project_weights)[0]
+                return Comment(
+                    project_id=pk, user_id=rng.choices(users, cum_weights=user_weights)[0],
+                    details=sentence(rng, rng.randint(3, 40)), created_at=after(rng, created_at, self.now),
+                )
+
+            counts['comments'] = self.insert('comments', Comment, map(comment, range(sizes['comments'])))
+
+            overseen = [row for row in projects if row[2]] or projects
+            overseen_weights = popularity(len(overseen), rng)
+            nonces = {}
+
+            def proposal(i):
+                pk, created_at, _ = rng.choices(overseen, cum_weights=overseen_weights)[0]
+                nonces[pk] = nonces.get(pk, -1) + 1
+                return CommunityProposal(
+                    project_id=pk, title=sentence(rng, 4).capitalize(), description=sentence(rng, 20),
+                    onchain_proposal_nonce=nonces[pk],
+                )
+
+            counts['proposals'] = self.insert(
+                'proposals', CommunityProposal, map(proposal, range(sizes['proposals'])))
+            proposals = [pk for pk, in self.tagged(CommunityProposal.objects, 'project__project_address', 'id')]
+            proposal_weights = popularity(len(proposals), rng)
+
+            def vote(i):
+                return Vote(
+                    proposal_id=rng.choices(proposals, cum_weights=proposal_weights)[0],
+                    voter_id=rng.choice(users), weight=amount(rng, 100), vote=rng.random() < 0.6,
+                    hsh=self.hash('4', i), network=networks[-1], created_at=after(rng, start, self.now),
+                )
+
+            counts['votes'] = self.insert('votes', Vote, map(vote, range(sizes['votes'] if proposals else 0)))
+
+        self.progress('aggregates', 0)
+        rebuild_funding()
+        rebuild_tallies()
+        rebuild_cards()
+        if fts_enabled():
+            rebuild_index()
+        return counts
+
+
+def seed(sizes=None, **options):
+    # {model: rows inserted}
+    return Seeder(sizes, **options).run()
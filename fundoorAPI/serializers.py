@@ -1,6 +1,12 @@
 from rest_framework import serializers
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from .models import *
-import requests
+from . import refcache
+from .bulk import pick_network, project_networks
+from .media import strip_upload
+from .pricing import price_oracle
+from decimal import Decimal
 
 class CategoryReadSerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,9 +24,27 @@ class CurrencyReadSerializer(serializers.ModelSerializer):
         fields = ['address', 'name']
 
 class MediaSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Media
-        fields = ['project', 'image']
+        fields = ['project', 'image', 'variants']
+
+    def validate_image(self, value):
+        # a privacy step, so it runs before the original is stored and served
+        try:
+            return strip_upload(value)
+        except (OSError, ValueError):
+            raise serializers.ValidationError('Unreadable image')
+
+    def get_variants(self, obj):
+        # {label: url}; empty until the media pipeline has processed the upload
+        request = self.context.get('request')
+        urls = {}
+        for label, name in obj.variants.items():
+            url = obj.image.storage.url(name)
+            urls[label] = request.build_absolute_uri(url) if request is not None else url
+        return urls
 
 class ContributionReadSerializer(serializers.ModelSerializer):
     class Meta:
@@ -31,43 +55,50 @@ class ContributionReadSerializer(serializers.ModelSerializer):
 class ContributionWriteSerializer(serializers.ModelSerializer):
     contributor = serializers.CharField(write_only=True)
     currencyAddress = serializers.CharField(write_only=True)
+    # the currency is the project's at currencyAddress, see bulk.pick_network
+    chain = serializers.CharField(max_length=100, required=False, allow_null=True, default=None, write_only=True)
+    chainid = serializers.IntegerField(required=False, allow_null=True, default=None, write_only=True)
 
     class Meta:
         model = Contribution
-        fields = ['contributor', 'currencyAddress', 'amount', 'hsh']
+        fields = ['contributor', 'currencyAddress', 'amount', 'hsh', 'chain', 'chainid']
+
+    def validate(self, data):
+        try:
+            currencies = refcache.project_currencies(self.context['project'].pk, data['currencyAddress'])
+        except Currency.DoesNotExist:
+            currencies = {}
+        try:
+            data['currency'] = currencies[pick_network(
+                currencies, data['chain'], data['chainid'], missing='Currency not found')]
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        return data
 
     # override to retrieve
     def create(self, validated_data):
         contributor = validated_data['contributor']
-        currencyAddress = validated_data['currencyAddress']
         amount = validated_data['amount']
         hsh = validated_data['hsh']
 
-        user = User.objects.get(address=contributor)
-        currency = Currency.objects.get(address=currencyAddress)
+        user_id = refcache.user_id(contributor)
+        currency_id, currency_name, network_id = validated_data['currency']
 
-        # Fetch USD amount using external API (Coinbase)
-        if currency.name == 'WETH':
-            response = requests.get(f"https://api.coinbase.com/v2/exchange-rates?currency=ETH")
+        # USD amount from the cached price oracle, 0 when no rate is available
+        usd_rate = price_oracle().usd_rate(currency_name)
+        if usd_rate is not None:
+            usd_amount = (usd_rate * amount).quantize(Decimal('0.01'))
         else:
-            response = requests.get(f"https://api.coinbase.com/v2/exchange-rates?currency={currency.name}")
-
-        if response.status_code == 200:
-            try: # usd rate may not be available
-                usd_rate = response.json().get('data', {}).get('rates', {}).get('USD')
-                usd_amount = float(usd_rate) * float(amount)
-            except:
-                usd_amount = 0
-        else: # usd source is down
             usd_amount = 0
 
         contribution = Contribution.objects.create(
             project=self.context['project'],
             usd_amount=usd_amount,
-            user=user,
-            currency=currency,
+            user_id=user_id,
+            currency_id=currency_id,
             amount=amount,
-            hsh=hsh
+            hsh=hsh,
+            network_id=network_id
         )
 
         return contribution
@@ -75,7 +106,12 @@ class ContributionWriteSerializer(serializers.ModelSerializer):
 class CommunityProposalReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = CommunityProposal
-        fields = ['id', 'title', 'description', 'onchain_proposal_nonce']
+        fields = ['id', 'title', 'description', 'onchain_proposal_nonce', 'yes_weight', 'no_weight', 'voter_count']
+
+class VoteTallyReadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CommunityProposal
+        fields = ['id', 'yes_weight', 'no_weight', 'voter_count']
 
 class CommunityProposalWriteSerializer(serializers.ModelSerializer):
     class Meta:
@@ -93,6 +129,31 @@ class CommentWriteSerializer(serializers.ModelSerializer):
         model = Comment
         fields = ['project', 'details', 'user']
 
+class CurrencyFundingReadSerializer(serializers.ModelSerializer):
+    address = serializers.CharField(source='currency.address')
+    name = serializers.CharField(source='currency.name')
+
+    class Meta:
+        model = ProjectCurrencyFunding
+        fields = ['address', 'name', 'total_amount']
+
+class ProjectFundingReadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProjectFunding
+        fields = ['total_usd', 'contribution_count', 'contributor_count', 'last_contribution_at']
+
+class ContributionBucketReadSerializer(serializers.Serializer):
+    bucket = serializers.DateTimeField()
+    usd_amount = serializers.DecimalField(max_digits=20, decimal_places=2)
+    contribution_count = serializers.IntegerField()
+    cumulative_usd = serializers.DecimalField(max_digits=20, decimal_places=2)
+    cumulative_count = serializers.IntegerField()
+
+class TopContributorReadSerializer(serializers.Serializer):
+    address = serializers.CharField(source='user__address')
+    total_usd = serializers.DecimalField(max_digits=20, decimal_places=2)
+    contribution_count = serializers.IntegerField()
+
 class ProjectReadSerializer(serializers.ModelSerializer):
     fundraiser = UserReadSerializer()
     currencies = CurrencyReadSerializer(many=True, read_only=True, source='currency.all')
@@ -101,6 +162,8 @@ class ProjectReadSerializer(serializers.ModelSerializer):
     contribution = ContributionReadSerializer(many=True, read_only=True, source='contribution_set')
     community_proposals = CommunityProposalReadSerializer(many=True, read_only=True, source='communityproposal_set')
     comments = CommentReadSerializer(many=True, read_only=True, source='comment_set')
+    comment_count = serializers.SerializerMethodField()
+    funding = serializers.SerializerMethodField()
 
     class Meta:
         model = Project
@@ -120,8 +183,116 @@ class ProjectReadSerializer(serializers.ModelSerializer):
             'contribution', # FK
             'community_proposals', # FK
             'comments', # FK
+            'comment_count', # aggregate
+            'funding', # aggregate
         ]
 
+    # nested relations that each cost a join or a prefetch query; a request
+    # names the ones it wants with expand= (or fields=) once it narrows the payload
+    EXPANDABLE_FIELDS = ['currencies', 'media', 'contribution', 'community_proposals', 'comments', 'comment_count',
+                         'funding']
+
+    # left out of the default payload, busy projects have thousands of
+    # contributions and comments; get_project_comments pages through comments,
+    # get_top_contributors and get_contribution_series summarize contributions
+    OPT_IN_FIELDS = ['contribution', 'comments', 'comment_count']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in set(self.fields) - set(self.resolve_fields(fields)):
+            self.fields.pop(name)
+
+    @classmethod
+    def resolve_fields(cls, fields=None):
+        # the fields rendered for a select_fields result, None being the default payload
+        if fields is None:
+            return [name for name in cls.Meta.fields if name not in cls.OPT_IN_FIELDS]
+        return fields
+
+    @classmethod
+    def select_fields(cls, fields=None, expand=None):
+        # the field names to render from the comma separated fields= and expand=
+        # parameters, or None for the default payload; ValueError on unknown names
+        if not fields and not expand:
+            return None
+        requested = [name for name in (fields or '').split(',') if name]
+        expanded = [name for name in (expand or '').split(',') if name]
+        unknown = set(requested) - set(cls.Meta.fields) | set(expanded) - set(cls.EXPANDABLE_FIELDS)
+        if unknown:
+            raise ValueError('Unknown fields: %s' % ', '.join(sorted(unknown)))
+        if not requested:
+            requested = [name for name in cls.Meta.fields if name not in cls.EXPANDABLE_FIELDS]
+        selected = set(requested) | set(expanded)
+        return [name for name in cls.Meta.fields if name in selected]
+
+    def get_comment_count(self, obj):
+        # annotated by the querysets of annotations(), counted here otherwise
+        count = getattr(obj, 'comment_count', None)
+        return obj.comment_set.count() if count is None else count
+
+    def get_funding(self, obj):
+        # projects without contributions have no funding row yet
+        funding = getattr(obj, 'funding', None) or ProjectFunding(project=obj)
+        data = ProjectFundingReadSerializer(funding).data
+        data['currencies'] = CurrencyFundingReadSerializer(obj.currency_funding.all(), many=True).data
+        return data
+
+    # plan every nested serializer up front so a page of projects costs a
+    # fixed number of queries instead of one per project and per row;
+    # fields narrows the plan to the selected fields
+    @staticmethod
+    def related_lookups(fields=None):
+        fields = ProjectReadSerializer.resolve_fields(fields)
+        return [name for name in ('fundraiser', 'category', 'funding') if name in fields]
+
+    @staticmethod
+    def annotations(fields=None):
+        if 'comment_count' not in ProjectReadSerializer.resolve_fields(fields):
+            return {}
+        # a count over the (project, created_at, id) index per project
+        counts = Comment.objects.filter(project=OuterRef('pk')).order_by().values('project').annotate(
+            count=Count('*')).values('count')
+        return {'comment_count': Coalesce(Subquery(counts), 0)}
+
+    @staticmethod
+    def prefetch_lookups(fields=None):
+        fields = ProjectReadSerializer.resolve_fields(fields)
+        lookups = {
+            'currencies': ['currency'],
+            'media': ['media_set'],
+            'contribution': [Prefetch('contribution_set', queryset=Contribution.objects.select_related('user', 'currency'))],
+            'community_proposals': ['communityproposal_set'],
+            'comments': [Prefetch('comment_set', queryset=Comment.objects.select_related('user'))],
+            'funding': [Prefetch('currency_funding', queryset=ProjectCurrencyFunding.objects.select_related('currency'))],
+        }
+        return [lookup for name, field_lookups in lookups.items() if name in fields for lookup in field_lookups]
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        return queryset.select_related(*ProjectReadSerializer.related_lookups(fields)).annotate(
+            **ProjectReadSerializer.annotations(fields)
+        ).prefetch_related(
+            *ProjectReadSerializer.prefetch_lookups(fields)
+        )
+
+class ProjectCardReadSerializer(serializers.ModelSerializer):
+    # the project id, annotated as id by fundoorAPI.cards.card_queryset
+    id = serializers.IntegerField(read_only=True)
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProjectCard
+        fields = ['id', 'project_address', 'title', 'category', 'fundraiser', 'image', 'total_usd', 'contributor_count',
+                  'created_at']
+
+    def get_image(self, obj):
+        # url of the first image, None for projects without media
+        if not obj.image:
+            return None
+        request = self.context.get('request')
+        url = Media._meta.get_field('image').storage.url(obj.image)
+        return request.build_absolute_uri(url) if request is not None else url
+
 class ProjectWriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
@@ -135,6 +306,27 @@ class VoteReadSerializer(serializers.ModelSerializer):
         depth = 1
 
 class VoteWriteSerializer(serializers.ModelSerializer):
+    # the network is one of the proposal's project's, see bulk.pick_network
+    chain = serializers.CharField(max_length=100, required=False, allow_null=True, default=None, write_only=True)
+    chainid = serializers.IntegerField(required=False, allow_null=True, default=None, write_only=True)
+
     class Meta:
         model = Vote
-        fields = ['voter', 'proposal', 'weight', 'vote', 'hsh']
\ No newline at end of file
+        fields = ['voter', 'proposal', 'weight', 'vote', 'hsh', 'chain', 'chainid']
+        # a repeated (network, hsh) is a retry, answered by the view from the unique index
+        validators = []
+
+    def validate(self, data):
+        project_id = data['proposal'].project_id
+        networks = project_networks([project_id]).get(project_id, {})
+        try:
+            data['chain'], data['chainid'] = pick_network(networks, data['chain'], data['chainid'])
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        data['network_id'] = networks[(data['chain'], data['chainid'])]
+        return data
+
+    def create(self, validated_data):
+        validated_data.pop('chain')
+        validated_data.pop('chainid')
+        return super().create(validated_data)
\ No newline at end of file
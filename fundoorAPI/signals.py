@@ -0,0 +1,92 @@
+# Signal receivers that keep derived read structures in sync with writes
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import cards, refcache, search
+from .models import *
+
+
+@receiver(post_save, sender=Project)
+def index_saved_project(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_projects([instance.pk])
+
+
+@receiver(post_delete, sender=Project)
+def unindex_deleted_project(sender, instance, **kwargs):
+    search.unindex_project(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_renamed_category(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_projects(list(Project.objects.filter(category=instance).values_list('id', flat=True)))
+
+
+@receiver(post_save, sender=Project)
+def refresh_saved_project_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cards.refresh_cards([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def refresh_renamed_category_cards(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        cards.refresh_cards(Project.objects.filter(category=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def refresh_fundraiser_cards(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        cards.refresh_cards(Project.objects.filter(fundraiser=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Category)
+def bump_renamed_category_projects(sender, instance, created=False, raw=False, **kwargs):
+    # the category name is part of the project payload its ETag stands for
+    if not created and not raw:
+        Project.bump_version(category=instance)
+
+
+@receiver(post_save, sender=User)
+def bump_renamed_user_projects(sender, instance, created=False, raw=False, **kwargs):
+    # so is the address of the fundraiser, contributors and commenters
+    if not created and not raw:
+        projects = Project.objects.filter(
+            Q(fundraiser=instance) | Q(contribution__user=instance) | Q(comment__user=instance))
+        Project.bump_version(pk__in=projects.values('pk'))
+
+
+@receiver(post_save, sender=Media)
+def refresh_saved_media_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cards.refresh_cards([instance.project_id])
+
+
+@receiver(post_delete, sender=Media)
+def refresh_deleted_media_card(sender, instance, origin=None, **kwargs):
+    # media deleted along with its project goes with the card, which must not come back
+    if isinstance(origin, Media) or getattr(origin, 'model', None) is Media:
+        cards.refresh_cards([instance.project_id])
+
+
+def invalidate_reference(sender, created=False, **kwargs):
+    # a new row cannot make a cached key stale, misses are never cached
+    if not created:
+        refcache.invalidate(sender)
+
+
+for model in (Network, Currency, Category, User):
+    post_save.connect(invalidate_reference, sender=model)
+    post_delete.connect(invalidate_reference, sender=model)
+
+
+@receiver(m2m_changed, sender=Project.currency.through)
+def invalidate_project_currencies(sender, instance, action, reverse, **kwargs):
+    # currencies are cached per project, see refcache.project_currencies
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            refcache.invalidate(Currency)
+        else:
+            refcache.invalidate(Currency, instance.pk)
@@ -1,3 +1,1791 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from asgiref.sync import async_to_sync
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics, refcache, renderers, routing, writequeue
+from .aggregates import funding_drift, rebuild_funding, tally_drift
+from .bulk import MAX_BATCH_SIZE, existing_keys
+from .cards import card_drift
+from .chain import CONTRIBUTED, VOTED, Indexer, RPCClient, RPCError
+from .media import store_variants
+from .models import *
+from .pricing import PriceOracle, StubProvider
+from .refcache import MISSING, ReferenceCache, reference_cache
+from .serializers import ProjectReadSerializer
+
+
+def make_project(index, contributions=0, comments=0, proposals=0, media=0):
+    network, _ = Network.objects.get_or_create(name='Optimism Goerli Testnet', chainid=420)
+    currency, _ = Currency.objects.get_or_create(address='0xcurrency', network=network, defaults={'name': 'WETH'})
+    category, _ = Category.objects.get_or_create(name='Art')
+    fundraiser, _ = User.objects.get_or_create(address='0xfundraiser%d' % index)
+    project = Project.objects.create(
+        fundraiser=fundraiser,
+        title='Project %d' % index,
+        description='Description %d' % index,
+        category=category,
+        project_address='0xproject%d' % index,
+        release_epoch=0,
+    )
+    project.currency.add(currency)
+    for i in range(contributions):
+        user, _ = User.objects.get_or_create(address='0xcontributor%d' % i)
+        Contribution.objects.create(
+            project=project, usd_amount=Decimal('1.00'), user=user,
+            currency=currency, amount=Decimal('1'), hsh='0xc%d_%d' % (index, i),
+        )
+    for i in range(comments):
+        Comment.objects.create(project=project, details='comment %d' % i, user=fundraiser)
+    for i in range(proposals):
+        CommunityProposal.objects.create(project=project, title='proposal %d' % i, onchain_proposal_nonce=i)
+    for i in range(media):
+        Media.objects.create(project=project, image='user_upload/%d_%d.jpg' % (index, i))
+    return project
+
+
+class ProjectReadQueryCountTests(TestCase):
+    # get_project_data and search_projects must not scale their query count
+    # with the number of projects or the number of related rows
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_get_project_data_query_count_is_constant(self):
+        make_project(1, contributions=1, comments=1, proposals=1, media=1)
+        make_project(2, contributions=20, comments=20, proposals=5, media=3)
+        small = self.count_queries('/api/get_project_data/0xproject1/')
+        large = self.count_queries('/api/get_project_data/0xproject2/')
+        self.assertEqual(small, large)
+        self.assertEqual(large, 6)
+        # contributions are opt-in: version, project with joins, contributions
+        small = self.count_queries('/api/get_project_data/0xproject1/?expand=contribution')
+        large = self.count_queries('/api/get_project_data/0xproject2/?expand=contribution')
+        self.assertEqual(small, large)
+        self.assertEqual(large, 3)
+
+    def test_search_projects_query_count_is_constant(self):
+        make_project(1, contributions=1, comments=1)
+        small = self.count_queries('/api/search_projects?field=category&value=art')
+        for index in range(2, 8):
+            make_project(index, contributions=10, comments=10, proposals=2, media=2)
+        large = self.count_queries('/api/search_projects?field=category&value=art')
+        self.assertEqual(small, large)
+
+    def test_search_by_contributor_query_count_is_constant(self):
+        make_project(1, contributions=1)
+        small = self.count_queries('/api/search_projects?field=contributor&value=0xcontributor0')
+        for index in range(2, 6):
+            make_project(index, contributions=5)
+        large = self.count_queries('/api/search_projects?field=contributor&value=0xcontributor0')
+        self.assertEqual(small, large)
+
+
+class SearchProjectsPaginationTests(TestCase):
+
+    def setUp(self):
+        for index in range(7):
+            make_project(index)
+        # force ties on created_at so the id tiebreaker is exercised
+        Project.objects.filter(id__in=Project.objects.values('id')[:4]).update(
+            created_at=Project.objects.order_by('id').first().created_at
+        )
+
+    def test_walks_every_project_once_newest_first(self):
+        seen = []
+        url = '/api/search_projects?field=category&value=art&limit=3'
+        cursor = None
+        while True:
+            response = self.client.get(url + ('&cursor=' + cursor if cursor else ''))
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertLessEqual(len(body['data']), 3)
+            seen.extend(project['id'] for project in body['data'])
+            cursor = body['next']
+            if cursor is None:
+                break
+        expected = list(Project.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_and_limit(self):
+        response = self.client.get('/api/search_projects?field=category&value=art&cursor=notacursor')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/search_projects?field=category&value=art&limit=0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_limit_is_capped(self):
+        response = self.client.get('/api/search_projects?field=category&value=art&limit=100000')
+        self.assertEqual(len(response.json()['data']), 7)
+        self.assertIsNone(response.json()['next'])
+
+
+STUB_ORACLE = {
+    'PROVIDER': 'fundoorAPI.pricing.StubProvider',
+    'PROVIDER_OPTIONS': {'rates': {'ETH': '2000'}},
+    'REFRESH_INTERVAL': None,
+}
+
+
+class PriceOracleTests(TestCase):
+
+    def make_oracle(self, **kwargs):
+        provider = StubProvider({'ETH': '2000'}, delay=kwargs.pop('delay', 0))
+        oracle = PriceOracle(provider, symbol_aliases={'WETH': 'ETH'}, **kwargs)
+        self.addCleanup(oracle.close)
+        return oracle, provider
+
+    def test_rates_are_cached_per_symbol(self):
+        oracle, provider = self.make_oracle()
+        self.assertEqual(oracle.usd_rate('WETH'), Decimal('2000'))
+        self.assertEqual(oracle.usd_rate('ETH'), Decimal('2000'))
+        self.assertEqual(provider.calls, 1)
+        self.assertIsNone(oracle.usd_rate('DOGE'))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        oracle, provider = self.make_oracle(delay=0.2)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            rates = list(pool.map(oracle.usd_rate, ['ETH'] * 8))
+        self.assertEqual(rates, [Decimal('2000')] * 8)
+        self.assertEqual(provider.calls, 1)
+
+    def test_slow_upstream_times_out_and_serves_stale_rate(self):
+        oracle, provider = self.make_oracle(ttl=0, max_stale=0, timeout=0.05, delay=0.5)
+        # cold cache and an upstream slower than the timeout
+        started = time.monotonic()
+        self.assertIsNone(oracle.usd_rate('ETH'))
+        self.assertLess(time.monotonic() - started, 0.4)
+        time.sleep(0.5)
+        # the abandoned fetch still filled the cache; expired entries are served
+        # when the refetch times out
+        started = time.monotonic()
+        self.assertEqual(oracle.usd_rate('ETH'), Decimal('2000'))
+        self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_background_refresh_drops_idle_symbols(self):
+        oracle, provider = self.make_oracle(ttl=0, max_stale=0, refresh_interval=0.05, refresh_idle=0.3)
+        oracle.usd_rate('ETH')
+        time.sleep(0.2)
+        self.assertGreater(provider.calls, 1)
+        time.sleep(0.3)
+        calls = provider.calls
+        time.sleep(0.2)
+        self.assertEqual(provider.calls, calls)
+        self.assertEqual((oracle._used, oracle._rates), ({}, {}))
+
+    @override_settings(PRICE_ORACLE=STUB_ORACLE)
+    def test_contribution_is_valued_through_the_oracle(self):
+        project = make_project(1)
+        User.objects.create(address='0xalice')
+        response = self.client.post('/api/contribute_project', {
+            'projectAddress': project.project_address,
+            'contributor': '0xalice',
+            'currencyAddress': '0xcurrency',
+            'amount': '1.5',
+            'hsh': '0xhash',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Contribution.objects.get(hsh='0xhash').usd_amount, Decimal('3000.00'))
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class ProjectFundingTests(TestCase):
+
+    def contribute(self, project, contributor, amount, hsh):
+        User.objects.get_or_create(address=contributor)
+        return self.client.post('/api/contribute_project', {
+            'projectAddress': project.project_address,
+            'contributor': contributor,
+            'currencyAddress': '0xcurrency',
+            'amount': amount,
+            'hsh': hsh,
+        })
+
+    def test_contributions_maintain_funding(self):
+        project = make_project(1)
+        self.contribute(project, '0xalice', '1', '0x1')
+        self.contribute(project, '0xalice', '0.5', '0x2')
+        self.contribute(project, '0xbob', '2', '0x3')
+
+        funding = self.client.get('/api/get_project_data/0xproject1/').json()['data']['funding']
+        self.assertEqual(funding['total_usd'], '7000.00')
+        self.assertEqual(funding['contribution_count'], 3)
+        self.assertEqual(funding['contributor_count'], 2)
+        self.assertEqual(funding['currencies'], [
+            {'address': '0xcurrency', 'name': 'WETH', 'total_amount': '3.500000000000000000'},
+        ])
+        self.assertIsNotNone(funding['last_contribution_at'])
+
+        self.assertEqual(funding_drift(), [])
+
+    def test_project_without_contributions_reports_zero(self):
+        make_project(1)
+        funding = self.client.get('/api/get_project_data/0xproject1/').json()['data']['funding']
+        self.assertEqual(funding['total_usd'], '0.00')
+        self.assertEqual(funding['contributor_count'], 0)
+        self.assertEqual(funding['currencies'], [])
+
+    def test_rebuild_repairs_drift(self):
+        project = make_project(1, contributions=3)
+        self.assertEqual(funding_drift(), [project.id])
+        call_command('rebuild_project_funding', stdout=StringIO())
+        self.assertEqual(funding_drift(), [])
+        self.assertEqual(project.funding.contributor_count, 3)
+        self.assertEqual(project.funding.total_usd, Decimal('3.00'))
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class ProjectCardTests(TestCase):
+
+    def card(self, address='0xproject1'):
+        return ProjectCard.objects.get(project_address=address)
+
+    def test_writes_maintain_the_card(self):
+        project = make_project(1, media=2)
+        card = self.card()
+        self.assertEqual((card.title, card.category, card.fundraiser, card.image, card.total_usd),
+                         ('Project 1', 'Art', '0xfundraiser1', 'user_upload/1_0.jpg', Decimal('0.00')))
+
+        for hsh, contributor in [('0x1', '0xalice'), ('0x2', '0xalice'), ('0x3', '0xbob')]:
+            User.objects.get_or_create(address=contributor)
+            self.client.post('/api/contribute_project', {'projectAddress': '0xproject1', 'contributor': contributor,
+                                                         'currencyAddress': '0xcurrency', 'amount': '1', 'hsh': hsh})
+        project.title = 'Renamed'
+        project.save()
+        category = project.category
+        category.name = 'Photography'
+        category.save()
+        first = Media.objects.order_by('id').first()
+        store_variants(first.pk, {'card': 'user_upload/1_0.card.webp'})
+        card = self.card()
+        self.assertEqual((card.title, card.category, card.image, card.total_usd, card.contributor_count),
+                         ('Renamed', 'Photography', 'user_upload/1_0.card.webp', Decimal('6000.00'), 2))
+
+        first.delete()
+        self.assertEqual(self.card().image, 'user_upload/1_1.jpg')
+        self.assertEqual(card_drift(), [])
+        project.delete()
+        self.assertFalse(ProjectCard.objects.exists())
+
+    def test_card_listing(self):
+        for index in range(3):
+            make_project(index, media=1)
+        make_project(3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/search_projects?view=card&field=category&value=art&limit=2')
+        body = response.json()
+        self.assertEqual([card['id'] for card in body['data']], list(
+            Project.objects.filter(project_address__in=['0xproject3', '0xproject2']).order_by('-id')
+            .values_list('id', flat=True)))
+        self.assertEqual(body['data'][0], {
+            'id': body['data'][0]['id'], 'project_address': '0xproject3', 'title': 'Project 3', 'category': 'Art',
+            'fundraiser': '0xfundraiser3', 'image': None, 'total_usd': '0.00', 'contributor_count': 0,
+            'created_at': body['data'][0]['created_at'],
+        })
+        self.assertEqual(body['data'][1]['image'], 'http://testserver/media/user_upload/2_0.jpg')
+
+        rest = self.client.get('/api/search_projects?view=card&field=category&value=art&limit=2&cursor=%s'
+                               % body['next']).json()
+        self.assertEqual([card['project_address'] for card in rest['data']], ['0xproject1', '0xproject0'])
+        self.assertIsNone(rest['next'])
+
+        for query in ['view=grid&field=title&value=x', 'view=card&field=title&value=x&fields=title',
+                      'view=card&field=title&value=x&expand=media', 'view=card&field=secret&value=x']:
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get('/api/search_projects?' + query).status_code, 400)
+
+    def test_rebuild_repairs_drift(self):
+        make_project(1, contributions=2, media=1)
+        # bulk loads and direct updates bypass the card
+        Project.objects.update(title='Bulk loaded')
+        ProjectFunding.objects.bulk_create([ProjectFunding(project=Project.objects.get(), total_usd=2,
+                                                           contributor_count=2)])
+        make_project(2)
+        ProjectCard.objects.filter(project_address='0xproject2').delete()
+        drifted = sorted(Project.objects.values_list('id', flat=True))
+        self.assertEqual(card_drift(), drifted)
+
+        out = StringIO()
+        call_command('rebuild_project_cards', check=True, stdout=out)
+        self.assertIn('2 project(s) drifted', out.getvalue())
+        call_command('rebuild_project_cards', stdout=StringIO())
+        self.assertEqual(card_drift(), [])
+        card = self.card()
+        self.assertEqual((card.title, card.total_usd, card.contributor_count), ('Bulk loaded', Decimal('2.00'), 2))
+
+
+class VoteTallyTests(TestCase):
+
+    def setUp(self):
+        self.project = make_project(1, proposals=1)
+        self.proposal = CommunityProposal.objects.get(project=self.project)
+        for address in ('0xalice', '0xbob'):
+            User.objects.create(address=address)
+
+    def vote(self, user, weight, vote, hsh):
+        return self.client.post('/api/vote_community_action', {
+            'user': user, 'proposal': self.proposal.id, 'weight': weight, 'vote': vote, 'hsh': hsh,
+        })
+
+    def test_votes_maintain_tally(self):
+        self.assertEqual(self.vote('0xalice', '3', 'true', '0x1').status_code, 201)
+        self.vote('0xalice', '1', 'true', '0x2')
+        self.vote('0xbob', '2.5', 'false', '0x3')
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/get_vote_tally/%d/' % self.proposal.id)
+        self.assertEqual(response.json()['data'], {
+            'id': self.proposal.id,
+            'yes_weight': '4.000000000000000000',
+            'no_weight': '2.500000000000000000',
+            'voter_count': 2,
+        })
+
+        proposals = self.client.get('/api/get_community_proposals/0xproject1/').json()['data']
+        self.assertEqual(proposals[0]['voter_count'], 2)
+        self.assertEqual(proposals[0]['yes_weight'], '4.000000000000000000')
+
+    def test_unknown_proposal_tally(self):
+        self.assertEqual(self.client.get('/api/get_vote_tally/999/').status_code, 404)
+
+    def test_voter_count_is_recounted(self):
+        self.vote('0xalice', '1', 'true', '0x1')
+        # a count left behind by a concurrent writer is not carried forward
+        CommunityProposal.objects.filter(pk=self.proposal.pk).update(voter_count=5)
+        self.vote('0xalice', '1', 'true', '0x2')
+        self.assertEqual(CommunityProposal.objects.get(pk=self.proposal.pk).voter_count, 1)
+
+    def test_checker_reports_and_fixes_drift(self):
+        self.vote('0xalice', '3', 'true', '0x1')
+        self.assertEqual(tally_drift(), [])
+
+        Vote.objects.create(voter=User.objects.get(address='0xbob'), proposal=self.proposal,
+                            weight=Decimal('1'), vote=False, hsh='0x2')
+        self.assertEqual([pk for pk, _, _ in tally_drift()], [self.proposal.id])
+
+        out = StringIO()
+        call_command('check_vote_tallies', '--fix', stdout=out)
+        self.assertIn('Fixed 1 proposal(s)', out.getvalue())
+        self.assertEqual(tally_drift(), [])
+        self.proposal.refresh_from_db()
+        self.assertEqual(self.proposal.voter_count, 2)
+        self.assertEqual(self.proposal.no_weight, Decimal('1'))
+
+
+class FullTextSearchTests(TestCase):
+
+    def setUp(self):
+        self.solar = make_project(1)
+        self.solar.title = 'Solar panels for schools'
+        self.solar.save()
+        self.water = make_project(2)
+        self.water.title = 'Clean water wells'
+        self.water.description = 'Solar powered pumps'
+        self.water.save()
+        make_project(3)
+
+    def search(self, text, **params):
+        params['q'] = text
+        response = self.client.get('/api/search_projects', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranked_prefix_search(self):
+        # a title hit outranks a description hit, and the last term is a prefix
+        ids = [project['id'] for project in self.search('sol')['data']]
+        self.assertEqual(ids, [self.solar.id, self.water.id])
+        self.assertEqual([project['id'] for project in self.search('solar pump')['data']], [self.water.id])
+        self.assertEqual(self.search('')['data'], [])
+
+    def test_index_follows_updates_and_category_renames(self):
+        self.water.title = 'Rainwater harvesting'
+        self.water.save()
+        self.assertEqual([project['id'] for project in self.search('rainwat')['data']], [self.water.id])
+        category = Category.objects.get(name='Art')
+        category.name = 'Energy'
+        category.save()
+        self.assertEqual(len(self.search('energy')['data']), 3)
+
+    def test_ranked_pages(self):
+        first = self.search('art', limit=2)
+        second = self.search('art', limit=2, cursor=first['next'])
+        self.assertIsNone(second['next'])
+        ids = [project['id'] for project in first['data'] + second['data']]
+        self.assertEqual(sorted(ids), sorted(Project.objects.values_list('id', flat=True)))
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class BulkIngestionTests(TestCase):
+
+    def test_bulk_contribute(self):
+        project = make_project(1, contributions=1)
+        call_command('rebuild_project_funding', stdout=StringIO())
+        items = [
+            {'projectAddress': '0xproject1', 'contributor': '0xnew%d' % i, 'currencyAddress': '0xcurrency',
+             'amount': '1', 'hsh': '0xbulk%d' % i}
+            for i in range(20)
+        ]
+        items.append(dict(items[0])) # repeated within the batch
+        items.append({'projectAddress': '0xproject1', 'contributor': '0xcontributor0', 'currencyAddress': '0xcurrency',
+                      'amount': '1', 'hsh': '0xc1_0'}) # already stored
+        items.append(dict(items[-1], amount='2')) # the stored hash for another contribution
+        items.append({'projectAddress': '0xmissing', 'contributor': '0xa', 'currencyAddress': '0xcurrency',
+                      'amount': '1', 'hsh': '0xmissing'})
+        items.append({'projectAddress': '0xproject1', 'amount': 'x'})
+
+        # including the savepoint the insert retries from when a concurrent batch stored a hash first,
+        # the lock on the funding rows and the copy of the new totals onto the project card
+        with self.assertNumQueries(19):
+            response = self.client.post('/api/bulk_contribute', {'contributions': items}, content_type='application/json')
+        body = response.json()
+        self.assertEqual(body['created'], 20)
+        self.assertEqual([result['status'] for result in body['data'][20:]],
+                         ['duplicate', 'duplicate', 'error', 'error', 'error'])
+        self.assertEqual(body['data'][22]['error'], 'Transaction hash already recorded')
+        self.assertEqual(body['data'][23]['error'], 'Project not found')
+        self.assertEqual(Contribution.objects.filter(project=project).count(), 21)
+        self.assertEqual(Contribution.objects.get(hsh='0xbulk3').usd_amount, Decimal('2000.00'))
+        self.assertEqual(funding_drift(), [])
+
+    def test_bulk_vote(self):
+        project = make_project(1, proposals=2)
+        proposals = list(CommunityProposal.objects.filter(project=project).values_list('id', flat=True))
+        items = [
+            {'user': '0xvoter%d' % (i % 3), 'proposal': proposals[i % 2], 'weight': '1.5', 'vote': i % 4 != 0,
+             'hsh': '0xvote%d' % i}
+            for i in range(12)
+        ]
+        items[0].update(chain=None, chainid=None) # like omitting them
+        items.append({'user': '0xvoter0', 'proposal': 999, 'weight': '1', 'vote': True, 'hsh': '0xnope'})
+        response = self.client.post('/api/bulk_vote', {'votes': items}, content_type='application/json')
+        self.assertEqual(response.json()['created'], 12)
+        self.assertEqual(response.json()['data'][12]['error'], 'Proposal not found')
+        self.assertEqual(tally_drift(), [])
+
+        response = self.client.post('/api/bulk_vote', {'votes': items}, content_type='application/json')
+        self.assertEqual(response.json()['created'], 0)
+        self.assertEqual(Vote.objects.count(), 12)
+
+    def test_rejects_oversized_batches(self):
+        response = self.client.post('/api/bulk_vote', {'votes': [{}] * (MAX_BATCH_SIZE + 1)}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/bulk_vote', {'votes': 'nope'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        for url in ('/api/bulk_vote', '/api/bulk_contribute'):
+            response = self.client.post(url, [{}], content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+
+def make_jpeg(size=(1200, 900)):
+    image = Image.new('RGB', size, (200, 120, 40))
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker' # Make
+    exif[0x0112] = 6 # Orientation: rotate 90 degrees
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif.tobytes())
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class MediaPipelineTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_PIPELINE={'SYNC': True})
+        override.enable()
+        self.addCleanup(override.disable)
+        # committed uploads cache reference ids that the test rollback removes
+        self.addCleanup(reference_cache().clear)
+
+    def test_upload_produces_stripped_variants(self):
+        # processing is queued for after the upload's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/initiate_project', {
+                'title': 'Pictures', 'description': 'Photos', 'category': 'Art', 'walletAddress': '0xfundraiser',
+                'currency': '0xcurrency', 'projectAddress': '0xproject', 'releaseEpoch': 0,
+                'transactionHash': '0xhash', 'images': [make_jpeg()],
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+
+        media = Media.objects.get()
+        self.assertEqual(set(media.variants), {'thumb', 'card', 'full'})
+        with Image.open(os.path.join(self.media_root, media.variants['thumb'])) as thumb:
+            self.assertEqual(thumb.format, 'WEBP')
+            # orientation applied: the 1200x900 landscape is stored upright as portrait
+            self.assertEqual(thumb.size, (120, 160))
+            self.assertFalse(thumb.getexif())
+        with Image.open(media.image.path) as original:
+            self.assertFalse(original.getexif())
+
+        data = self.client.get('/api/get_project_data/0xproject/').json()['data']
+        self.assertEqual(data['media'][0]['variants']['card'], 'http://testserver/media/' + media.variants['card'])
+
+    def test_original_is_stripped_before_processing(self):
+        # the pool has not run: no on-commit callbacks executed
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.client.post('/api/initiate_project', {
+                'title': 'Pictures', 'description': 'Photos', 'category': 'Art', 'walletAddress': '0xfundraiser',
+                'currency': '0xcurrency', 'projectAddress': '0xproject', 'releaseEpoch': 0,
+                'transactionHash': '0xhash', 'images': [make_jpeg()],
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        media = Media.objects.get()
+        self.assertEqual(media.variants, {})
+
+        response = self.client.get('/media/' + media.image.name)
+        self.assertEqual(response.status_code, 200)
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as original:
+            self.assertFalse(original.getexif())
+            # orientation baked in
+            self.assertEqual(original.size, (900, 1200))
+
+    def test_process_media_command_backfills(self):
+        project = make_project(1)
+        upload = make_jpeg((400, 300))
+        media = Media.objects.create(project=project, image=upload)
+        self.assertEqual(media.variants, {})
+        call_command('process_media', stdout=StringIO())
+        media.refresh_from_db()
+        self.assertEqual(set(media.variants), {'thumb', 'card', 'full'})
+
+
+class MediaServingTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.mkdir(os.path.join(self.media_root, 'user_upload'))
+        self.body = bytes(range(256)) * 40
+        with open(os.path.join(self.media_root, 'user_upload', 'photo.jpg'), 'wb') as handle:
+            handle.write(self.body)
+
+    def test_serves_file_with_validators_and_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/media/user_upload/photo.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        # originals are rewritten when their metadata is stripped, variants never change
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+        revalidated = self.client.get('/media/user_upload/photo.jpg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+        revalidated = self.client.get('/media/user_upload/photo.jpg', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(self.client.get('/media/user_upload/photo.jpg', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_variants_are_immutable(self):
+        for name in ['photo.thumb.webp', 'photo.webp']:
+            with open(os.path.join(self.media_root, 'user_upload', name), 'wb') as handle:
+                handle.write(self.body)
+        self.assertIn('immutable', self.client.get('/media/user_upload/photo.thumb.webp')['Cache-Control'])
+        self.assertEqual(self.client.get('/media/user_upload/photo.webp')['Cache-Control'], 'no-cache')
+
+    def test_range_requests(self):
+        response = self.client.get('/media/user_upload/photo.jpg', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.body[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(self.body))
+
+        response = self.client.get('/media/user_upload/photo.jpg', HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.body[-5:])
+
+        response = self.client.get('/media/user_upload/photo.jpg', HTTP_RANGE='bytes=999999-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % len(self.body))
+
+        # a stale If-Range validator gets the whole, current file
+        response = self.client.get('/media/user_upload/photo.jpg', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_and_hidden_files(self):
+        self.assertEqual(self.client.get('/media/user_upload/nope.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/user_upload/..').status_code, 404)
+        self.assertEqual(self.client.post('/media/user_upload/photo.jpg').status_code, 405)
+
+    def test_sendfile_mode(self):
+        with override_settings(MEDIA_SENDFILE={'MODE': 'x-accel-redirect', 'INTERNAL_PREFIX': '/internal/'}):
+            response = self.client.get('/media/user_upload/photo.jpg')
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/user_upload/photo.jpg')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class ProjectVersionTests(TestCase):
+
+    def setUp(self):
+        self.project = make_project(1, proposals=1)
+        self.proposal = CommunityProposal.objects.get()
+        User.objects.create(address='0xalice')
+
+    def etag(self):
+        response = self.client.get('/api/get_project_data/0xproject1/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_unchanged_project_answers_304_from_one_query(self):
+        etag = self.etag()
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/get_project_data/0xproject1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get('/api/get_project_data/0xmissing/', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_every_write_path_changes_the_etag(self):
+        writes = [
+            lambda: self.client.post('/api/contribute_project', {
+                'projectAddress': '0xproject1', 'contributor': '0xalice', 'currencyAddress': '0xcurrency',
+                'amount': '1', 'hsh': '0x1'}),
+            lambda: self.client.post('/api/bulk_contribute', {'contributions': [{
+                'projectAddress': '0xproject1', 'contributor': '0xalice', 'currencyAddress': '0xcurrency',
+                'amount': '1', 'hsh': '0x2'}]}, content_type='application/json'),
+            lambda: self.client.post('/api/add_project_comment', {
+                'projectAddress': '0xproject1', 'user': '0xalice', 'details': 'hi'}),
+            lambda: self.client.put('/api/update_comment/%d/' % Comment.objects.get().pk, {'details': 'edited'},
+                                    content_type='application/json'),
+            lambda: self.client.delete('/api/delete_comment/%d/' % Comment.objects.get().pk),
+            lambda: self.client.post('/api/propose_community_action', {
+                'projectAddress': '0xproject1', 'title': 'spend', 'description': 'on things', 'onchain_proposal_nonce': 7}),
+            lambda: self.client.post('/api/vote_community_action', {
+                'user': '0xalice', 'proposal': self.proposal.pk, 'weight': '1', 'vote': True, 'hsh': '0x3'}),
+            lambda: self.client.post('/api/bulk_vote', {'votes': [{
+                'user': '0xalice', 'proposal': self.proposal.pk, 'weight': '1', 'vote': False, 'hsh': '0x4'}]},
+                content_type='application/json'),
+            lambda: self.client.post('/api/add_currency', {'projectAddress': '0xproject1', 'currencyAddress': '0xdai'}),
+        ]
+        etag = self.etag()
+        for write in writes:
+            self.assertLess(write().status_code, 300)
+            changed = self.etag()
+            self.assertNotEqual(changed, etag)
+            etag = changed
+
+
+    def test_renames_of_related_rows_change_the_etag(self):
+        make_project(2)
+        other = Project.objects.get(project_address='0xproject2')
+        Comment.objects.create(project=self.project, details='hi', user=User.objects.get(address='0xalice'))
+        renames = [
+            (Category.objects.get(name='Art'), 'name', 'Fine art'),
+            (User.objects.get(address='0xfundraiser1'), 'address', '0xfounder'),
+            (User.objects.get(address='0xalice'), 'address', '0xalicia'), # a commenter
+        ]
+        etag = self.etag()
+        for row, field, value in renames:
+            setattr(row, field, value)
+            row.save()
+            changed = self.etag()
+            self.assertNotEqual(changed, etag)
+            etag = changed
+        # of the renames, only the shared category's reaches the other project
+        self.assertEqual(Project.objects.get(pk=other.pk).version, 1)
+
+
+class ProjectCommentsTests(TestCase):
+
+    def setUp(self):
+        self.project = make_project(1, comments=7)
+        make_project(2, comments=2)
+        # ties on created_at exercise the id tiebreaker
+        Comment.objects.filter(project=self.project, id__in=Comment.objects.order_by('id').values('id')[:4]).update(
+            created_at=Comment.objects.order_by('id').first().created_at)
+
+    def test_walks_every_comment_once_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            url = '/api/get_project_comments/0xproject1/?limit=3' + ('&cursor=' + cursor if cursor else '')
+            with self.assertNumQueries(2): # project id, page
+                body = self.client.get(url).json()
+            self.assertLessEqual(len(body['data']), 3)
+            seen.extend(comment['id'] for comment in body['data'])
+            cursor = body['next']
+            if cursor is None:
+                break
+        expected = Comment.objects.filter(project=self.project).order_by('-created_at', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+        self.assertEqual(body['data'][-1]['user'], {'id': self.project.fundraiser_id, 'address': '0xfundraiser1'})
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/get_project_comments/0xmissing/').status_code, 404)
+        self.assertEqual(self.client.get('/api/get_project_comments/0xproject1/?cursor=nope').status_code, 400)
+        self.assertEqual(self.client.get('/api/get_project_comments/0xproject1/?limit=0').status_code, 400)
+
+
+class SparseFieldsetTests(TestCase):
+
+    def setUp(self):
+        for index in range(3):
+            make_project(index, contributions=3, comments=3, proposals=1, media=1)
+
+    def test_card_listing_is_one_query(self):
+        url = '/api/search_projects?field=category&value=art&fields=title,category,fundraiser'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['data'][0], {
+            'fundraiser': {'address': '0xfundraiser2'}, 'title': 'Project 2', 'category': {'name': 'Art'},
+        })
+
+    def test_expand_adds_relations_to_the_base_fields(self):
+        url = '/api/get_project_data/0xproject1/?expand=funding,comments'
+        with self.assertNumQueries(4): # version, project with joins, comments, per-currency funding
+            data = self.client.get(url).json()['data']
+        self.assertIn('title', data)
+        self.assertEqual(len(data['comments']), 3)
+        self.assertIn('funding', data)
+        self.assertNotIn('contribution', data)
+        self.assertNotIn('media', data)
+
+    def test_default_payload_and_etags_per_selection(self):
+        full = self.client.get('/api/get_project_data/0xproject1/')
+        self.assertEqual(set(full.json()['data']),
+                         set(ProjectReadSerializer.Meta.fields) - {'contribution', 'comments', 'comment_count'})
+        narrow = self.client.get('/api/get_project_data/0xproject1/?fields=title')
+        self.assertEqual(narrow.json()['data'], {'title': 'Project 1'})
+        self.assertNotEqual(full['ETag'], narrow['ETag'])
+
+    def test_comments_are_opt_in(self):
+        data = self.client.get('/api/get_project_data/0xproject1/?expand=comment_count').json()['data']
+        self.assertEqual(data['comment_count'], 3)
+        self.assertNotIn('comments', data)
+        data = self.client.get('/api/search_projects?field=category&value=art&fields=title,comment_count').json()['data']
+        self.assertEqual(data[0], {'title': 'Project 2', 'comment_count': 3})
+
+    def test_contributions_are_opt_in(self):
+        self.assertNotIn('contribution', self.client.get('/api/search_projects?field=category&value=art').json()['data'][0])
+        data = self.client.get('/api/get_project_data/0xproject1/?expand=contribution').json()['data']
+        self.assertEqual(len(data['contribution']), 3)
+        self.assertIn('title', data)
+
+    def test_unknown_fields_are_rejected(self):
+        self.assertEqual(self.client.get('/api/get_project_data/0xproject1/?fields=secret').status_code, 400)
+        self.assertEqual(self.client.get('/api/search_projects?field=title&value=p&expand=title').status_code, 400)
+
+
+class FastReadPathTests(TestCase):
+    # the .values() read path must render exactly what the serializers render
+
+    def setUp(self):
+        make_project(1, contributions=3, comments=2, proposals=2, media=2)
+        make_project(2)
+        Project.objects.filter(project_address='0xproject2').update(description=None)
+        Media.objects.filter(pk=Media.objects.first().pk).update(variants={'thumb': 'user_upload/1_0.thumb.webp'})
+        proposal = CommunityProposal.objects.first()
+        for i in range(3):
+            Vote.objects.create(voter=User.objects.get(address='0xcontributor%d' % i), proposal=proposal,
+                                weight=Decimal('0.5'), vote=bool(i % 2), hsh='0xv%d' % i)
+        rebuild_funding()
+        self.proposal = proposal
+
+    def assertSameResponse(self, url):
+        with override_settings(FAST_READ_PATH=False):
+            slow = self.client.get(url)
+        with override_settings(FAST_READ_PATH=True):
+            with CaptureQueriesContext(connection) as fast_queries:
+                fast = self.client.get(url)
+        with override_settings(FAST_READ_PATH=False):
+            with CaptureQueriesContext(connection) as slow_queries:
+                self.client.get(url)
+        self.assertEqual(fast.status_code, slow.status_code)
+        self.assertEqual(fast.content, slow.content)
+        self.assertLessEqual(len(fast_queries), len(slow_queries))
+        return fast
+
+    def test_project_reads_are_identical(self):
+        for url in [
+            '/api/get_project_data/0xproject1/',
+            '/api/get_project_data/0xproject2/',
+            '/api/get_project_data/0xproject1/?fields=title,funding',
+            '/api/get_project_data/0xproject1/?expand=media,comments,comment_count',
+            '/api/get_project_data/0xproject1/?expand=contribution',
+            '/api/get_project_data/0xproject2/?fields=title,contribution',
+            '/api/get_project_data/0xproject2/?fields=title,comment_count',
+            '/api/search_projects?field=category&value=art',
+            '/api/search_projects?field=category&value=art&expand=comment_count',
+            '/api/search_projects?field=category&value=art&expand=contribution',
+            '/api/search_projects?field=contributor&value=0xcontributor0&fields=id,contribution',
+            '/api/search_projects?field=contributor&value=0xcontributor0',
+            '/api/search_projects?q=project&fields=id,title,category',
+            '/api/search_projects?field=title&value=nothing',
+            '/api/search_projects?view=card&field=category&value=art',
+            '/api/search_projects?view=card&field=contributor&value=0xcontributor0',
+            '/api/search_projects?view=card&q=project',
+        ]:
+            with self.subTest(url=url):
+                self.assertSameResponse(url)
+
+    def test_cursors_are_identical(self):
+        response = self.assertSameResponse('/api/search_projects?field=category&value=art&limit=1')
+        self.assertSameResponse('/api/search_projects?field=category&value=art&limit=1&cursor=%s' % response.json()['next'])
+
+    def test_vote_and_proposal_reads_are_identical(self):
+        self.assertSameResponse('/api/get_project_comments/0xproject1/?limit=1')
+        self.assertSameResponse('/api/get_votes/%d/' % self.proposal.pk)
+        self.assertSameResponse('/api/get_community_proposals/0xproject1/')
+        self.assertSameResponse('/api/get_votes/0/')
+
+
+class ORJSONRendererTests(TestCase):
+    data = {
+        'response': 1,
+        'data': [{
+            'amount': Decimal('1.500000000000000000'),
+            'created_at': datetime(2023, 8, 1, 12, 30, 5, 123456, tzinfo=timezone.utc),
+            'day': datetime(2023, 8, 1).date(),
+            'title': 'caf\u00e9 \u2028 \U0001f680',
+            7: None,
+            'nested': {'ok': True, 'ratio': 0.25, 'items': [1, 2, 3]},
+        }],
+    }
+
+    def test_matches_the_stock_renderer(self):
+        self.assertEqual(renderers.ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertEqual(renderers.ORJSONRenderer().render(None), b'')
+
+    def test_falls_back_without_orjson_and_for_indented_output(self):
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        indented = 'application/json; indent=2'
+        self.assertEqual(renderers.ORJSONRenderer().render(self.data, indented),
+                         JSONRenderer().render(self.data, indented))
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class ContributionStatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_project(1)
+        self.currency = Currency.objects.get()
+        for address in ('0xalice', '0xbob', '0xcarol'):
+            User.objects.create(address=address)
+        # (contributor, usd, time)
+        for i, (address, usd, day, hour) in enumerate([
+            ('0xalice', '10.00', 1, 9), ('0xbob', '5.00', 1, 17), ('0xalice', '2.50', 2, 9),
+            ('0xcarol', '20.00', 9, 12),
+        ]):
+            contribution = Contribution.objects.create(
+                project=Project.objects.get(), usd_amount=Decimal(usd), user=User.objects.get(address=address),
+                currency=self.currency, amount=Decimal('1'), hsh='0xs%d' % i)
+            Contribution.objects.filter(pk=contribution.pk).update(
+                created_at=datetime(2023, 8, day, hour, tzinfo=timezone.utc))
+        rebuild_funding()
+
+    def series(self, interval):
+        response = self.client.get('/api/get_contribution_series/0xproject1/?interval=%s' % interval)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_daily_and_weekly_buckets_are_cumulative(self):
+        self.assertEqual(self.series('day'), [
+            {'bucket': '2023-08-01T00:00:00Z', 'usd_amount': '15.00', 'contribution_count': 2,
+             'cumulative_usd': '15.00', 'cumulative_count': 2},
+            {'bucket': '2023-08-02T00:00:00Z', 'usd_amount': '2.50', 'contribution_count': 1,
+             'cumulative_usd': '17.50', 'cumulative_count': 3},
+            {'bucket': '2023-08-09T00:00:00Z', 'usd_amount': '20.00', 'contribution_count': 1,
+             'cumulative_usd': '37.50', 'cumulative_count': 4},
+        ])
+        weekly = self.series('week')
+        self.assertEqual([row['bucket'] for row in weekly], ['2023-07-31T00:00:00Z', '2023-08-07T00:00:00Z'])
+        self.assertEqual([row['cumulative_usd'] for row in weekly], ['17.50', '37.50'])
+        self.assertEqual(len(self.series('hour')), 4)
+
+    def test_top_contributors(self):
+        response = self.client.get('/api/get_top_contributors/0xproject1/?limit=2')
+        self.assertEqual(response.json()['data'], [
+            {'address': '0xcarol', 'total_usd': '20.00', 'contribution_count': 1},
+            {'address': '0xalice', 'total_usd': '12.50', 'contribution_count': 2},
+        ])
+
+    def test_cached_until_the_next_contribution(self):
+        self.series('day')
+        with self.assertNumQueries(1):
+            self.series('day')
+        self.client.post('/api/contribute_project', {
+            'projectAddress': '0xproject1', 'contributor': '0xbob', 'currencyAddress': '0xcurrency',
+            'amount': '1', 'hsh': '0xnew'})
+        self.assertEqual(self.series('day')[-1]['cumulative_count'], 5)
+        leaders = self.client.get('/api/get_top_contributors/0xproject1/').json()['data']
+        self.assertEqual(leaders[0]['address'], '0xbob')
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get('/api/get_contribution_series/0xproject1/?interval=month').status_code, 400)
+        self.assertEqual(self.client.get('/api/get_top_contributors/0xproject1/?limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/get_contribution_series/0xmissing/').status_code, 404)
+        self.assertEqual(self.client.get('/api/get_top_contributors/0xmissing/').status_code, 404)
+
+
+@skipUnless(settings.DATABASES['default']['ENGINE'] == 'fundoor.db.sqlite3', 'tuned SQLite profile only')
+class DatabaseProfileTests(TestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied_on_connect(self):
+        self.assertEqual(self.pragma('busy_timeout'), 20000)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+        self.assertEqual(self.pragma('synchronous'), 1) # NORMAL
+        self.assertEqual(self.pragma('foreign_keys'), 1)
+
+    def test_unknown_transaction_mode_is_rejected(self):
+        wrapper = connections.create_connection('default')
+        wrapper.settings_dict = dict(wrapper.settings_dict, OPTIONS={'transaction_mode': 'LAZY'})
+        with self.assertRaises(ImproperlyConfigured):
+            wrapper.get_connection_params()
+
+
+class AsyncReadParity:
+    # the /api/async/ routes answer exactly like their synchronous twins
+
+    urls = [
+        'get_project_data/0xproject1/',
+        'get_project_data/0xproject1/?fields=title,funding',
+        'get_project_data/0xmissing/',
+        'get_community_proposals/0xproject1/',
+        'get_community_proposals/0xmissing/',
+        'get_votes/%(proposal)d/',
+        'search_projects?field=category&value=art&limit=1',
+        'search_projects?q=project&expand=media',
+        'search_projects?view=card&field=category&value=art&limit=1',
+        'search_projects?view=card&q=project',
+        'search_projects?field=secret&value=x',
+    ]
+
+    def setUp(self):
+        make_project(1, contributions=3, comments=2, proposals=2, media=1)
+        make_project(2, contributions=1)
+        rebuild_funding()
+        self.proposal = CommunityProposal.objects.first()
+        Vote.objects.create(voter=User.objects.get(address='0xcontributor0'), proposal=self.proposal,
+                            weight=Decimal('2'), vote=True, hsh='0xv')
+
+    async def request(self, method, url, **kwargs):
+        return await getattr(self.async_client, method)(url, **kwargs)
+
+    def async_request(self, method, url, **kwargs):
+        return async_to_sync(self.request)(method, url, **kwargs)
+
+    def assertSameResponses(self):
+        for url in self.urls:
+            url = url % {'proposal': self.proposal.pk}
+            with self.subTest(url=url):
+                expected = self.client.get('/api/' + url)
+                response = self.async_request('get', '/api/async/' + url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+
+
+@override_settings(ASYNC_READS={'PARALLEL_QUERIES': False})
+class AsyncReadEndpointTests(AsyncReadParity, TestCase):
+
+    def test_responses_match_the_sync_endpoints(self):
+        self.assertSameResponses()
+
+    def test_conditional_get_and_methods(self):
+        etag = self.client.get('/api/get_project_data/0xproject1/')['ETag']
+        response = self.async_request('get', '/api/async/get_project_data/0xproject1/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.async_request('post', '/api/async/get_votes/1/').status_code, 405)
+
+
+class ParallelAsyncReadTests(AsyncReadParity, TransactionTestCase):
+    # nested queries on pool threads only see committed rows, hence no TestCase
+
+    def test_parallel_queries_match_the_sync_endpoints(self):
+        self.assertSameResponses()
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class ReferenceCacheTests(TestCase):
+
+    def setUp(self):
+        self.project = make_project(1)
+        User.objects.create(address='0xalice')
+        reference_cache().clear()
+        self.addCleanup(reference_cache().clear)
+
+    def post(self, url, data):
+        # entries are stored when the request's transaction commits
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertLess(response.status_code, 300, response.content)
+        return len(queries)
+
+    def contribute(self, hsh):
+        return self.post('/api/contribute_project', {
+            'projectAddress': '0xproject1', 'contributor': '0xalice',
+            'currencyAddress': '0xcurrency', 'amount': '1', 'hsh': hsh,
+        })
+
+    def initiate(self, project_address):
+        return self.post('/api/initiate_project', {
+            'title': 'Cached', 'description': 'Cached', 'category': 'Art', 'walletAddress': '0xfundraiser1',
+            'currency': '0xcurrency', 'transactionHash': '0xhash',
+            'projectAddress': project_address, 'releaseEpoch': 0,
+        })
+
+    def test_warm_writes_skip_reference_lookups(self):
+        # first writes create the funding rows, compare the ones after them
+        self.contribute('0x1')
+        self.initiate('0xcached1')
+        reference_cache().clear()
+        cold = self.contribute('0x2'), self.initiate('0xcached2')
+        warm = self.contribute('0x3'), self.initiate('0xcached3')
+        # user and currency; network, currency, category and fundraiser
+        self.assertEqual((cold[0] - warm[0], cold[1] - warm[1]), (2, 4))
+
+    def test_writes_invalidate_entries(self):
+        project_id = Project.objects.get().pk
+        key = ('Optimism Goerli Testnet', 420)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(refcache.project_currencies(project_id, '0xcurrency')[key][1], 'WETH')
+        with self.assertNumQueries(0):
+            refcache.project_currencies(project_id, '0xcurrency')
+        currency = Currency.objects.get(address='0xcurrency')
+        currency.name = 'USDC'
+        currency.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(refcache.project_currencies(project_id, '0xcurrency')[key][1], 'USDC')
+
+    def test_misses_and_rolled_back_rows_are_not_cached(self):
+        with self.assertRaises(User.DoesNotExist):
+            refcache.user_id('0xbob')
+        bob = User.objects.create(address='0xbob')
+        self.assertEqual(refcache.user_id('0xbob'), bob.pk)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    refcache.category_id('Music')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertIs(reference_cache().get((Category, 'Music')), MISSING)
+
+    def test_lru_and_ttl(self):
+        lru = ReferenceCache(max_entries=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIs(lru.get('b'), MISSING)
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+
+        expired = ReferenceCache(ttl=0)
+        expired.set('a', 1)
+        self.assertIs(expired.get('a'), MISSING)
+
+
+class SeedDataTests(TestCase):
+
+    def test_seeds_a_consistent_dataset(self):
+        out = StringIO()
+        call_command('seed_data', users=50, projects=20, contributions=500, comments=100, proposals=10, votes=200,
+                     batch_size=64, seed=1, stdout=out)
+        self.assertIn('Seeded 50 users, 20 projects, 500 contributions', out.getvalue())
+        self.assertEqual((Project.objects.count(), Contribution.objects.count(), Vote.objects.count()), (20, 500, 200))
+        # bulk inserts bypass the aggregates, which are rebuilt afterwards
+        self.assertEqual(funding_drift(), [])
+        self.assertEqual(tally_drift(), [])
+        self.assertEqual(card_drift(), [])
+        # contributions are spread over time, after their project, in one of its currencies
+        self.assertGreater(Contribution.objects.values('created_at__date').distinct().count(), 100)
+        self.assertFalse(Contribution.objects.filter(created_at__lt=F('project__created_at')).exists())
+        self.assertFalse(Contribution.objects.exclude(currency__project=F('project')).exists())
+        # and a second run adds to the same database
+        call_command('seed_data', users=5, projects=2, contributions=5, comments=0, proposals=0, votes=0,
+                     stdout=StringIO())
+        self.assertEqual(Project.objects.count(), 22)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.project = make_project(1, comments=2)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_records_per_endpoint_metrics(self):
+        sizes = [len(self.client.get('/api/get_project_data/0xproject1/').content) for _ in range(2)]
+        self.client.get('/api/get_project_data/0xmissing/')
+        self.client.get('/api/no_such_route')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/get_project_data/0xproject1/')
+        # the next request resets the query log
+        query_count = len(queries)
+
+        samples = self.scrape()
+        labels = '{endpoint="get_project_data",method="GET"}'
+        self.assertEqual(samples['fundoor_http_requests_total{endpoint="get_project_data",method="GET",status="200"}'], 3)
+        self.assertEqual(samples['fundoor_http_requests_total{endpoint="get_project_data",method="GET",status="404"}'], 1)
+        self.assertEqual(samples['fundoor_http_requests_total{endpoint="unmatched",method="GET",status="404"}'], 1)
+        self.assertEqual(samples['fundoor_http_request_duration_seconds_count' + labels], 4)
+        self.assertEqual(samples['fundoor_http_request_duration_seconds_bucket{endpoint="get_project_data",'
+                                 'method="GET",le="+Inf"}'], 4)
+        self.assertEqual(samples['fundoor_http_request_db_queries_sum' + labels], 3 * query_count + 1)
+        self.assertGreater(samples['fundoor_http_request_db_seconds_total' + labels], 0)
+        self.assertGreaterEqual(samples['fundoor_http_response_size_bytes_sum' + labels], sum(sizes) * 1.5)
+
+    def test_unknown_methods_share_a_label(self):
+        for method in ('BREW', 'PROPFIND'):
+            self.client.generic(method, '/api/get_project_data/0xproject1/')
+        samples = self.scrape()
+        self.assertEqual(samples['fundoor_http_requests_total{endpoint="get_project_data",method="other",'
+                                 'status="405"}'], 2)
+        self.assertFalse([name for name in samples if 'BREW' in name])
+
+    def test_exited_threads_keep_their_totals(self):
+        for _ in range(3 * metrics.SHARD_COUNT):
+            thread = threading.Thread(
+                target=lambda: metrics.shard().record('get_votes', 'GET', 200, 0.01, 1, 0.001, 100))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(metrics._shards), metrics.SHARD_COUNT)
+        samples = self.scrape()
+        self.assertEqual(samples['fundoor_http_requests_total{endpoint="get_votes",method="GET",status="200"}'],
+                         3 * metrics.SHARD_COUNT)
+
+    def test_shards_and_worker_files_are_summed(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda i: metrics.shard().record('get_votes', 'GET', 200, 0.01, 1, 0.001, 100), range(40)))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # these totals now belong to another worker process
+        metrics.flush(directory)
+        os.rename(os.path.join(directory, '%d.json' % os.getpid()), os.path.join(directory, '1.json'))
+        metrics.reset()
+        metrics.shard().record('get_votes', 'GET', 500, 0.3, 2, 0.001, 100)
+
+        with override_settings(METRICS={'MULTIPROCESS_DIR': directory}):
+            samples = self.scrape()
+        self.assertEqual(samples['fundoor_http_requests_total{endpoint="get_votes",method="GET",status="200"}'], 40)
+        self.assertEqual(samples['fundoor_http_requests_total{endpoint="get_votes",method="GET",status="500"}'], 1)
+        self.assertEqual(samples['fundoor_http_request_db_queries_sum{endpoint="get_votes",method="GET"}'], 42)
+        self.assertEqual(samples['fundoor_http_request_duration_seconds_bucket{endpoint="get_votes",method="GET",'
+                                 'le="0.01"}'], 40)
+
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class IdempotentWriteTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(reference_cache().clear)
+        self.project = make_project(1, proposals=1)
+        self.proposal = CommunityProposal.objects.get()
+        self.contribution = {'projectAddress': '0xproject1', 'contributor': '0xfundraiser1',
+                             'currencyAddress': '0xcurrency', 'amount': '1.5', 'hsh': '0xretried'}
+        self.vote = {'user': '0xfundraiser1', 'proposal': self.proposal.pk, 'weight': '2', 'vote': True,
+                     'hsh': '0xretried'}
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def test_retried_contribution_returns_the_original_result(self):
+        first = self.post('/api/contribute_project', self.contribution)
+        with self.assertNumQueries(8):
+            # the insert the unique index rejects, then one read of the original
+            retry = self.post('/api/contribute_project', self.contribution)
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+        self.assertEqual(Contribution.objects.filter(hsh='0xretried').count(), 1)
+        self.assertEqual(self.project.funding.contribution_count, 1)
+        self.assertEqual(funding_drift(), [])
+
+        # the same hash for a different contribution
+        conflict = self.post('/api/contribute_project', dict(self.contribution, amount='9'))
+        self.assertEqual(conflict.status_code, 409)
+        # and the same hash on another network
+        mainnet = Network.objects.create(name='Optimism', chainid=10)
+        self.project.currency.add(Currency.objects.create(address='0xmainnetcurrency', network=mainnet, name='WETH'))
+        other = self.post('/api/contribute_project', dict(self.contribution, currencyAddress='0xmainnetcurrency'))
+        self.assertEqual(other.status_code, 201)
+        self.assertEqual(Contribution.objects.filter(hsh='0xretried').count(), 2)
+
+    def test_currency_address_on_several_networks(self):
+        mainnet = Network.objects.create(name='Optimism', chainid=10)
+        Currency.objects.create(address='0xcurrency', network=mainnet, name='WETH')
+        # the project only accepts the testnet one
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post('/api/contribute_project', self.contribution).status_code, 201)
+        self.assertEqual(Contribution.objects.get().network.chainid, 420)
+
+        self.project.currency.add(Currency.objects.get(network=mainnet))
+        for data in ({'hsh': '0xambiguous'}, {'hsh': '0xelsewhere', 'chain': 'Base', 'chainid': 8453}):
+            response = self.post('/api/contribute_project', dict(self.contribution, **data))
+            self.assertEqual(response.status_code, 400)
+        named = self.post('/api/contribute_project', dict(self.contribution, chain='Optimism', chainid=10))
+        self.assertEqual(named.status_code, 201)
+        self.assertEqual(Contribution.objects.get(network=mainnet).hsh, '0xretried')
+
+        item = {key: self.contribution[key] for key in ('projectAddress', 'contributor', 'currencyAddress', 'amount')}
+        body = self.post('/api/bulk_contribute', {'contributions': [
+            dict(item, hsh='0xambiguous'), dict(item, hsh='0xnamed', chain='Optimism', chainid=10),
+        ]}).json()
+        self.assertEqual([result['status'] for result in body['data']], ['error', 'created'])
+        self.assertEqual(body['data'][0]['error'], 'chain and chainid are required')
+
+    def test_retried_vote_returns_the_original_result(self):
+        first = self.post('/api/vote_community_action', self.vote)
+        retry = self.post('/api/vote_community_action', self.vote)
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+        self.assertEqual(Vote.objects.filter(hsh='0xretried').count(), 1)
+        self.assertEqual(tally_drift(), [])
+        self.assertEqual(self.post('/api/vote_community_action', dict(self.vote, vote=False)).status_code, 409)
+
+    def test_vote_network_comes_from_the_project(self):
+        named = dict(self.vote, chain='Optimism Goerli Testnet', chainid=420)
+        self.assertEqual(self.post('/api/vote_community_action', self.vote).status_code, 201)
+        self.assertEqual(self.post('/api/vote_community_action', named).status_code, 201)
+        self.assertEqual(Vote.objects.filter(hsh='0xretried').count(), 1)
+
+        # networks are looked up, never created
+        for chain, chainid in (('Optimism', 10), ('Optimism Goerli Testnet', 'goerli')):
+            response = self.post('/api/vote_community_action', dict(self.vote, chain=chain, chainid=chainid))
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Network.objects.count(), 1)
+
+        # a project on several networks needs the vote to name one
+        mainnet = Network.objects.create(name='Optimism', chainid=10)
+        self.project.currency.add(Currency.objects.create(address='0xmainnetcurrency', network=mainnet, name='WETH'))
+        self.assertEqual(self.post('/api/vote_community_action', dict(self.vote, hsh='0xother')).status_code, 400)
+        other = self.post('/api/vote_community_action', dict(self.vote, chain='Optimism', chainid=10))
+        self.assertEqual(other.status_code, 201)
+        self.assertEqual(Vote.objects.filter(hsh='0xretried').count(), 2)
+
+        item = {key: self.vote[key] for key in ('user', 'proposal', 'weight', 'vote', 'hsh')}
+        body = self.post('/api/bulk_vote', {'votes': [
+            dict(item, chain='Optimism', chainid=10), dict(item, hsh='0xnamed', chain='Base', chainid=8453), item,
+        ]}).json()
+        self.assertEqual([result['status'] for result in body['data']], ['duplicate', 'error', 'error'])
+        self.assertEqual(Network.objects.count(), 2)
+
+    def test_bulk_writes_share_the_index(self):
+        self.post('/api/contribute_project', self.contribution)
+        item = {key: self.contribution[key] for key in ('projectAddress', 'contributor', 'currencyAddress', 'amount')}
+        body = self.post('/api/bulk_contribute', {'contributions': [
+            dict(item, hsh='0xretried'), dict(item, hsh='0xfresh'),
+        ]}).json()
+        self.assertEqual([result['status'] for result in body['data']], ['duplicate', 'created'])
+        self.assertEqual(funding_drift(), [])
+
+    def test_bulk_insert_after_a_concurrent_writer(self):
+        # another request stores the hash between the duplicate check and the insert
+        checks = []
+
+        def check_misses_once(model, keys):
+            checks.append(model)
+            return {} if len(checks) == 1 else existing_keys(model, keys)
+
+        self.post('/api/contribute_project', self.contribution)
+        item = {key: self.contribution[key] for key in ('projectAddress', 'contributor', 'currencyAddress', 'amount')}
+        with mock.patch('fundoorAPI.bulk.existing_keys', check_misses_once):
+            body = self.post('/api/bulk_contribute', {'contributions': [
+                dict(item, hsh='0xfresh'), dict(item, hsh='0xretried'),
+            ]}).json()
+        self.assertEqual(len(checks), 2)
+        self.assertEqual([result['status'] for result in body['data']], ['created', 'duplicate'])
+        self.assertEqual(Contribution.objects.filter(hsh__in=['0xfresh', '0xretried']).count(), 2)
+        self.assertEqual(funding_drift(), [])
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class WriteQueueTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = override_settings(WRITE_QUEUE={
+            'ENABLED': True, 'PATH': os.path.join(directory, 'queue.sqlite3'), 'MAX_PENDING': 3,
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(writequeue.close)
+        self.addCleanup(reference_cache().clear)
+        self.project = make_project(1, proposals=1)
+        self.proposal = CommunityProposal.objects.get()
+        self.comment = {'projectAddress': '0xproject1', 'user': '0xfundraiser1', 'details': 'queued'}
+        self.vote = {'user': '0xfundraiser1', 'proposal': self.proposal.pk, 'weight': '2', 'vote': True,
+                     'hsh': '0xqueued'}
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def job(self, response):
+        return self.client.get(response['Location']).json()['data']
+
+    def test_writes_are_acknowledged_then_applied_in_one_batch(self):
+        comment = self.post('/api/add_project_comment', self.comment)
+        vote = self.post('/api/vote_community_action', self.vote)
+        self.assertEqual((comment.status_code, vote.status_code), (202, 202))
+        self.assertEqual(self.job(vote), {'id': vote.json()['job'], 'kind': 'vote', 'status': 'pending', 'result': None})
+        self.assertFalse(Comment.objects.exists() or Vote.objects.exists())
+        version = Project.objects.get().version
+
+        self.assertEqual(len(writequeue.drain()), 2)
+        self.assertEqual(self.job(comment)['result'], {'status': 'created', 'id': Comment.objects.get().pk})
+        self.assertEqual(self.job(vote)['status'], 'done')
+        self.assertEqual(CommunityProposal.objects.get().yes_weight, Decimal(2))
+        self.assertEqual(tally_drift(), [])
+        self.assertGreater(Project.objects.get().version, version)
+        self.assertEqual(writequeue.drain(), {})
+        self.assertEqual(self.client.get('/api/get_write_status/999/').status_code, 404)
+
+    def test_retried_votes_are_stored_once(self):
+        first = self.post('/api/vote_community_action', self.vote)
+        retry = self.post('/api/vote_community_action', self.vote)
+        writequeue.drain()
+        self.assertEqual(self.job(first)['result'], {'hsh': '0xqueued', 'status': 'created'})
+        self.assertEqual(self.job(retry)['result'], {'hsh': '0xqueued', 'status': 'duplicate'})
+        # once applied, retries are answered without queueing
+        self.assertEqual(self.post('/api/vote_community_action', self.vote).status_code, 201)
+        self.assertEqual(self.post('/api/vote_community_action', dict(self.vote, vote=False)).status_code, 409)
+        self.assertEqual(writequeue.drain(), {})
+        self.assertEqual(Vote.objects.count(), 1)
+        # nothing left to replay, the vote is queued again
+        Vote.objects.all().delete()
+        self.assertEqual(self.post('/api/vote_community_action', self.vote).status_code, 202)
+
+    def test_conflicting_queued_writes_fail(self):
+        first = self.post('/api/vote_community_action', self.vote)
+        conflict = self.post('/api/vote_community_action', dict(self.vote, vote=False))
+        self.assertEqual((first.status_code, conflict.status_code), (202, 202))
+        writequeue.drain()
+        self.assertEqual(self.job(first)['status'], 'done')
+        self.assertEqual(self.job(conflict)['status'], 'failed')
+        self.assertEqual(self.job(conflict)['result'],
+                         {'hsh': '0xqueued', 'status': 'error', 'error': 'Transaction hash already recorded'})
+        self.assertTrue(Vote.objects.get().vote)
+
+    def test_invalid_writes_are_not_queued(self):
+        self.assertEqual(self.post('/api/add_project_comment', dict(self.comment, details='')).status_code, 400)
+        self.assertEqual(self.post('/api/add_project_comment', dict(self.comment, user='0xnobody')).status_code, 404)
+        self.assertEqual(self.post('/api/vote_community_action', dict(self.vote, weight='x')).status_code, 400)
+        self.assertEqual(writequeue.drain(), {})
+
+    def test_full_queue_answers_503(self):
+        for _ in range(3):
+            self.assertEqual(self.post('/api/add_project_comment', self.comment).status_code, 202)
+        full = self.post('/api/add_project_comment', self.comment)
+        self.assertEqual(full.status_code, 503)
+        self.assertEqual(full['Retry-After'], '1')
+        writequeue.drain()
+        self.assertEqual(self.post('/api/add_project_comment', self.comment).status_code, 202)
+
+    def test_a_failing_job_does_not_hold_up_the_batch(self):
+        def ingest(payloads):
+            if any(payload['details'] == 'poison' for payload in payloads):
+                raise ValueError('poison')
+            return writequeue.ingest_comments(payloads)
+
+        good = self.post('/api/add_project_comment', self.comment)
+        bad = self.post('/api/add_project_comment', dict(self.comment, details='poison'))
+        with mock.patch.dict(writequeue.INGEST, {'comment': ingest}):
+            writequeue.drain()
+        self.assertEqual(self.job(good)['status'], 'done')
+        self.assertEqual(self.job(bad), {'id': bad.json()['job'], 'kind': 'comment', 'status': 'failed',
+                                         'result': {'status': 'error', 'error': 'poison'}})
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_worker_stopping_after_commit_applies_nothing_twice(self):
+        queued = self.post('/api/add_project_comment', self.comment)
+        with mock.patch('fundoorAPI.writequeue.mark_finished', side_effect=sqlite3.OperationalError('disk I/O error')):
+            with self.assertRaises(sqlite3.OperationalError):
+                writequeue.drain()
+        self.assertEqual(self.job(queued)['status'], 'pending')
+
+        out = StringIO()
+        call_command('drain_write_queue', '--once', stdout=out)
+        self.assertIn('Applied 0 job(s), 0 failed', out.getvalue())
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(self.job(queued)['result'], {'status': 'created', 'id': Comment.objects.get().pk})
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['test_replica'], 'STICKY_SECONDS': 10})
+class ReplicaRoutingTests(TransactionTestCase):
+    # a second SQLite file the primary is copied into; committed rows only,
+    # as the copy cannot see the transaction of a TestCase. The alias is
+    # added after the test runner has set the databases up, so it is left
+    # alone by their setup and flushes.
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        connections.settings['test_replica'] = dict(
+            connections['default'].settings_dict, NAME=os.path.join(cls.directory, 'replica.sqlite3'), TEST={})
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['test_replica'].close()
+        del connections['test_replica']
+        del connections.settings['test_replica']
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.addCleanup(reference_cache().clear)
+        self.project = make_project(1)
+        self.sync()
+
+    def sync(self):
+        call_command('sync_replica', stdout=StringIO())
+
+    def comments(self, client):
+        return [comment['details'] for comment in client.get('/api/get_project_comments/0xproject1/').json()['data']]
+
+    def test_reads_come_from_the_replica(self):
+        Comment.objects.create(project=self.project, details='direct', user=self.project.fundraiser)
+        # outside a request everything reads from the primary
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(self.comments(self.client), [])
+        make_project(2)
+        self.assertEqual(self.client.get('/api/async/get_project_data/0xproject2/').status_code, 404)
+        self.sync()
+        self.assertEqual(self.comments(self.client), ['direct'])
+        self.assertEqual(self.client.get('/api/async/get_project_data/0xproject2/').status_code, 200)
+
+    def test_writers_read_their_own_writes(self):
+        author, other = Client(), Client()
+        # a project the replica has not seen yet, writes read from the primary
+        make_project(2)
+        posted = author.post('/api/add_project_comment', {'projectAddress': '0xproject2', 'user': '0xfundraiser1',
+                                                          'details': 'mine'}, content_type='application/json')
+        self.assertEqual(posted.status_code, 201)
+        self.assertIn('fundoor_primary', posted.cookies)
+        author.post('/api/add_project_comment', {'projectAddress': '0xproject1', 'user': '0xfundraiser1',
+                                                 'details': 'mine'}, content_type='application/json')
+        self.assertEqual(self.comments(author), ['mine'])
+        self.assertEqual(self.comments(other), [])
+
+        self.sync()
+        self.assertEqual(self.comments(other), ['mine'])
+        Comment.objects.create(project=self.project, details='later', user=self.project.fundraiser)
+        self.assertEqual(self.comments(author), ['later', 'mine'])
+        # the window is over, even if the client still sends the cookie
+        with mock.patch('fundoorAPI.routing.time.time', return_value=time.time() + 11):
+            self.assertEqual(self.comments(author), ['mine'])
+
+    def test_cross_origin_clients_pin_with_the_header(self):
+        # a cross-origin fetch carries no cookies, the frontend echoes the header instead
+        posted = self.client.post('/api/add_project_comment', {'projectAddress': '0xproject1', 'user': '0xfundraiser1',
+                                                               'details': 'mine'}, content_type='application/json',
+                                  headers={'Origin': 'https://app.example'})
+        deadline = posted['X-Fundoor-Primary']
+        self.assertIn('X-Fundoor-Primary', posted['Access-Control-Expose-Headers'])
+        fresh = Client()
+        self.assertEqual(self.comments(fresh), [])
+        response = fresh.get('/api/get_project_comments/0xproject1/', headers={'X-Fundoor-Primary': deadline})
+        self.assertEqual([comment['details'] for comment in response.json()['data']], ['mine'])
+
+    def test_search_reads_the_replica(self):
+        # the ranked ids come from the replica's full-text index too, not the primary's
+        project = make_project(2)
+        self.sync()
+        project.title = 'Renamed'
+        project.description = 'Renamed'
+        project.save()
+        search = lambda: sorted(project['project_address'] for project in self.client.get(
+            '/api/search_projects', {'q': 'project', 'fields': 'project_address'}).json()['data'])
+        self.assertEqual(search(), ['0xproject1', '0xproject2'])
+        self.sync()
+        self.assertEqual(search(), ['0xproject1'])
+
+    def test_failed_writes_do_not_pin(self):
+        rejected = self.client.post('/api/add_project_comment', {'projectAddress': '0xproject1', 'user': '0xnobody',
+                                                                 'details': 'x'}, content_type='application/json')
+        self.assertEqual(rejected.status_code, 404)
+        self.assertNotIn('fundoor_primary', rejected.cookies)
+
+    def test_router(self):
+        router = routing.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Project), 'default')
+        token = routing.read_alias.set('test_replica')
+        try:
+            self.assertEqual((router.db_for_read(Project), router.db_for_write(Project)), ('test_replica', 'default'))
+        finally:
+            routing.read_alias.reset(token)
+        self.assertFalse(router.allow_migrate('test_replica', 'fundoorAPI'))
+        # a replica that is the primary's own database, as a test mirror is, reads through the primary
+        self.assertEqual(routing.replica_aliases({'ALIASES': ['test_replica', 'default']}), ['test_replica'])
+        with override_settings(READ_REPLICAS={'ALIASES': []}):
+            with self.assertRaisesMessage(CommandError, 'No replica'):
+                self.sync()
+
+
+class FakeChain:
+    # an in-memory chain served over JSON-RPC, enough of it for the indexer
+
+    def __init__(self, chainid=420, max_range=None):
+        self.chainid = chainid
+        self.max_range = max_range
+        # HTTP status answered to eth_getLogs batches instead of a JSON-RPC reply
+        self.failing = None
+        # [(hash, [log])] by block number
+        self.blocks = []
+        self.forks = 0
+        self.calls = []
+
+    def mine(self, count=1, logs=None):
+        # logs: {offset from the first new block: [log]}
+        for offset in range(count):
+            number = len(self.blocks)
+            block_hash = '0x%032x%032x' % (self.forks, number)
+            entries = [
+                {**log, 'blockNumber': hex(number), 'blockHash': block_hash, 'logIndex': hex(index), 'removed': False}
+                for index, log in enumerate((logs or {}).get(offset, []))
+            ]
+            self.blocks.append((block_hash, entries))
+
+    def reorg(self, depth):
+        del self.blocks[-depth:]
+        self.forks += 1
+
+    def get_logs(self, query):
+        first, last = int(query['fromBlock'], 16), int(query['toBlock'], 16)
+        if self.max_range and last - first + 1 > self.max_range:
+            raise ValueError('block range too large')
+        addresses = {address.lower() for address in query['address']}
+        return [
+            log for block_hash, logs in self.blocks[first:last + 1] for log in logs
+            if log['address'].lower() in addresses and log['topics'][0] in query['topics'][0]
+        ]
+
+    def answer(self, request):
+        method, params = request['method'], request['params']
+        self.calls.append(method)
+        try:
+            if method == 'eth_chainId':
+                result = hex(self.chainid)
+            elif method == 'eth_blockNumber':
+                result = hex(len(self.blocks) - 1)
+            elif method == 'eth_getBlockByNumber':
+                number = int(params[0], 16)
+                result = {'number': params[0], 'hash': self.blocks[number][0]} if number < len(self.blocks) else None
+            elif method == 'eth_getLogs':
+                result = self.get_logs(params[0])
+            else:
+                return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32601, 'message': method}}
+        except ValueError as error:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32005, 'message': str(error)}}
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+    def serve(self, test):
+        chain = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if chain.failing and 'eth_getLogs' in json.dumps(payload):
+                    self.send_response(chain.failing)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                reply = [chain.answer(item) for item in payload] if isinstance(payload, list) else chain.answer(payload)
+                body = json.dumps(reply).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        test.addCleanup(server.server_close)
+        test.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:%d' % server.server_port
+
+
+PROJECT = '0x' + 'ab' * 20
+CURRENCY = '0x' + 'cD' * 20
+
+
+def word(value):
+    return '0x%064x' % value if isinstance(value, int) else '0x' + value[2:].lower().rjust(64, '0')
+
+
+def contributed(contributor, amount, tx, project=PROJECT, currency=CURRENCY):
+    return {'address': project, 'topics': [CONTRIBUTED, word(contributor), word(currency)],
+            'data': word(amount), 'transactionHash': tx}
+
+
+def voted(voter, nonce, support, weight, tx):
+    return {'address': PROJECT, 'topics': [VOTED, word(voter), word(nonce)],
+            'data': word(int(support)) + word(weight)[2:], 'transactionHash': tx}
+
+
+@override_settings(PRICE_ORACLE=STUB_ORACLE)
+class ChainIndexerTests(TestCase):
+
+    def setUp(self):
+        self.project = make_project(1, proposals=1)
+        Project.objects.filter(pk=self.project.pk).update(project_address=PROJECT)
+        Currency.objects.filter(address='0xcurrency').update(address=CURRENCY)
+        self.network = Network.objects.get(chainid=420)
+        self.chain = FakeChain()
+        self.url = self.chain.serve(self)
+
+    def indexer(self, **options):
+        options = {'confirmations': 5, 'block_range': 4, 'batch_requests': 2, **options}
+        return Indexer(self.network, RPCClient(self.url), **options)
+
+    def test_indexes_logs_in_batches(self):
+        # stored checksummed by a client, logs carry lower-case addresses
+        known = '0x' + 'eE' * 20
+        User.objects.create(address=known)
+        newcomer = '0x' + '12' * 20
+        self.chain.mine(30, logs={
+            3: [contributed(known, 2 * 10 ** 18, '0xt1')],
+            7: [contributed(newcomer, 5 * 10 ** 17, '0xt2')],
+            10: [contributed(known, 10 ** 18, '0xt3', project='0x' + '99' * 20)], # not a project of ours
+            15: [contributed(newcomer, 10 ** 18, '0xt4'), voted(known, 0, True, 3 * 10 ** 18, '0xt5')],
+            22: [contributed(known, 2 * 10 ** 18, '0xt1')], # a hash that is already stored
+            24: [contributed(known, 10 ** 18, '0xt6', currency='0x' + '77' * 20)], # unknown currency
+        })
+        with self.assertLogs('fundoorAPI.chain', 'WARNING') as logs:
+            summary = self.indexer().poll()
+        self.assertIn('skipped 0xt6: Currency not found', logs.output[0])
+        self.assertEqual((summary['from'], summary['to'], summary['head']), (0, 29, 29))
+        self.assertEqual((summary['contributions'], summary['votes'], summary['skipped']), (3, 1, 1))
+        # 8 ranges of 4 blocks, two per batch
+        self.assertEqual(self.chain.calls.count('eth_getLogs'), 8)
+
+        checkpoint = ChainCheckpoint.objects.get(network=self.network)
+        self.assertEqual((checkpoint.block_number, checkpoint.block_hash), (29, self.chain.blocks[29][0]))
+        first = Contribution.objects.get(hsh='0xt1')
+        self.assertEqual((first.amount, first.usd_amount, first.block_number), (Decimal('2'), Decimal('4000.00'), 3))
+        # stored casing of a known user, lower-case for a new one
+        self.assertEqual(first.user.address, known)
+        self.assertEqual(Contribution.objects.get(hsh='0xt2').user.address, newcomer)
+        vote = Vote.objects.get(hsh='0xt5')
+        self.assertEqual((vote.weight, vote.vote, vote.proposal.project_id), (Decimal('3'), True, self.project.pk))
+        self.assertEqual(funding_drift(), [])
+        self.assertEqual(tally_drift(), [])
+
+        # nothing new, nothing fetched
+        summary = self.indexer().poll()
+        self.assertEqual((summary['contributions'], summary['to']), (0, 29))
+        self.assertEqual(self.chain.calls.count('eth_getLogs'), 8)
+
+    def test_rolls_back_a_reorg(self):
+        self.chain.mine(30, logs={10: [contributed(PROJECT, 10 ** 18, '0xkept')],
+                                  27: [contributed(PROJECT, 10 ** 18, '0xorphaned')]})
+        self.indexer().poll()
+        posted = self.client.post('/api/contribute_project', {
+            'projectAddress': PROJECT, 'contributor': '0xfundraiser1', 'currencyAddress': CURRENCY,
+            'amount': '1', 'hsh': '0xposted',
+        }, content_type='application/json')
+        self.assertEqual(posted.status_code, 201)
+        version = Project.objects.get(pk=self.project.pk).version
+
+        self.chain.reorg(4)
+        self.chain.mine(6, logs={2: [contributed(PROJECT, 3 * 10 ** 18, '0xreplacement')]})
+        with self.assertLogs('fundoorAPI.chain', 'WARNING'):
+            summary = self.indexer().poll()
+        self.assertEqual(summary['rewound_to'], 24)
+        self.assertEqual((summary['from'], summary['to'], summary['contributions']), (25, 31, 1))
+        self.assertEqual(set(Contribution.objects.values_list('hsh', flat=True)),
+                         {'0xkept', '0xposted', '0xreplacement'})
+        self.assertEqual(Contribution.objects.get(hsh='0xreplacement').block_number, 28)
+        self.assertEqual(ProjectFunding.objects.get(project=self.project).total_usd, Decimal('10000.00'))
+        self.assertEqual(funding_drift(), [])
+        self.assertGreater(Project.objects.get(pk=self.project.pk).version, version)
+        self.assertEqual(ChainCheckpoint.objects.get(network=self.network).block_hash, self.chain.blocks[31][0])
+
+    def test_rollback_keeps_other_networks(self):
+        self.chain.mine(30, logs={20: [contributed(PROJECT, 10 ** 18, '0xorphaned')]})
+        self.indexer().poll()
+        mainnet = Network.objects.create(name='Optimism', chainid=10)
+        currency = Currency.objects.create(address=CURRENCY, network=mainnet, name='WETH')
+        self.project.currency.add(currency)
+        user = User.objects.get(address='0xfundraiser1')
+        Contribution.objects.create(project=self.project, user=user, currency=currency, amount=1, usd_amount=0,
+                                    hsh='0xmainnet', block_number=100000)
+        Vote.objects.create(voter=user, proposal=CommunityProposal.objects.get(), weight=1, vote=True,
+                            hsh='0xmainnet', network=mainnet, block_number=100000)
+
+        self.indexer().rollback(10)
+        self.assertEqual(list(Contribution.objects.values_list('hsh', flat=True)), ['0xmainnet'])
+        self.assertEqual(Vote.objects.get().network, mainnet)
+
+    def test_narrows_ranges_the_node_rejects(self):
+        self.chain.max_range = 3
+        self.chain.mine(20, logs={i: [contributed(PROJECT, 10 ** 18, '0xt%d' % i)] for i in range(0, 20, 3)})
+        indexer = self.indexer(block_range=8)
+        self.assertEqual(indexer.poll()['contributions'], 7)
+        self.assertLess(indexer.block_range, 8)
+        self.assertEqual(ChainCheckpoint.objects.get(network=self.network).block_number, 19)
+
+        # the configured range comes back once the node accepts it
+        self.chain.max_range = None
+        self.chain.mine(40)
+        indexer.poll()
+        self.assertEqual(indexer.block_range, 8)
+
+    def test_transport_errors_keep_the_range(self):
+        self.chain.mine(20)
+        indexer = self.indexer(block_range=8)
+        self.chain.failing = 502
+        with self.assertRaises(RPCError):
+            indexer.poll()
+        self.assertEqual(indexer.block_range, 8)
+        self.chain.failing = None
+        self.assertEqual(indexer.poll()['to'], 19)
+        self.assertEqual(indexer.block_range, 8)
+
+    def test_command(self):
+        self.chain.mine(5, logs={1: [contributed(PROJECT, 10 ** 18, '0xt1')]})
+        out = StringIO()
+        call_command('index_chain', network=['Optimism Goerli Testnet'], rpc_url=self.url, once=True, stdout=out)
+        self.assertIn('blocks 0-4 of 4, 1 contribution(s)', out.getvalue())
+
+        call_command('index_chain', network=['Optimism Goerli Testnet'], rpc_url=self.url, once=True,
+                     from_block=1, stdout=out)
+        self.assertIn('blocks 1-4 of 4, 1 contribution(s)', out.getvalue())
+        self.assertEqual(Contribution.objects.get().block_number, 1)
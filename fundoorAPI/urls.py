@@ -1,5 +1,5 @@
 from django.urls import include, path
-from . import views, api
+from . import views, api, async_api, metrics
 
 urlpatterns = [
     ## initiate project
@@ -8,8 +8,16 @@ urlpatterns = [
     path('api/get_project_data/<str:project_address>/', api.get_project_data, name='get_project_data'),
     ## get proposal details
     path('api/get_community_proposals/<str:project_address>/', api.get_community_proposals, name='get_community_proposals'),
+    ## get a page of project comments, newest first
+    path('api/get_project_comments/<str:project_address>/', api.get_project_comments, name='get_project_comments'),
     ## get voting details
     path('api/get_votes/<int:proposal_id>/', api.get_votes, name='get_votes'),
+    ## get vote tally
+    path('api/get_vote_tally/<int:proposal_id>/', api.get_vote_tally, name='get_vote_tally'),
+    ## get contributions bucketed by hour, day or week
+    path('api/get_contribution_series/<str:project_address>/', api.get_contribution_series, name='get_contribution_series'),
+    ## get top contributors
+    path('api/get_top_contributors/<str:project_address>/', api.get_top_contributors, name='get_top_contributors'),
     ## contribute project
     path('api/contribute_project', api.contribute_project, name='contribute_project'),
     ## add currency to project
@@ -24,8 +32,21 @@ urlpatterns = [
     path('api/propose_community_action', api.propose_community_action, name='propose_community_action'),
     ## vote commmunity action
     path('api/vote_community_action', api.vote_community_action, name='vote_community_action'),
+    ## status of a queued comment or vote
+    path('api/get_write_status/<int:job_id>/', api.get_write_status, name='get_write_status'),
+    ## batch contributions
+    path('api/bulk_contribute', api.bulk_contribute, name='bulk_contribute'),
+    ## batch votes
+    path('api/bulk_vote', api.bulk_vote, name='bulk_vote'),
     ## search for a list of projects
     path('api/search_projects', api.search_projects, name='search_projects'),
+    ## async reads for ASGI deployments, same responses as the routes above
+    path('api/async/get_project_data/<str:project_address>/', async_api.get_project_data, name='async_get_project_data'),
+    path('api/async/get_community_proposals/<str:project_address>/', async_api.get_community_proposals, name='async_get_community_proposals'),
+    path('api/async/get_votes/<int:proposal_id>/', async_api.get_votes, name='async_get_votes'),
+    path('api/async/search_projects', async_api.search_projects, name='async_search_projects'),
+    ## Prometheus metrics of this deployment's requests
+    path('metrics', metrics.metrics, name='metrics'),
     ## retrieve image by filename
     path('media/user_upload/<str:filename>', views.get_media, name='get_media'),
 ]
\ No newline at end of file
@@ -1,6 +1,16 @@
+import mimetypes
+import os
+from stat import S_ISREG
+
+from django.conf import settings
 from django.shortcuts import render
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from .media import pipeline_settings
 from .models import *
-from django.http import JsonResponse, FileResponse
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse,
+)
 
 # Create your views here.
 def test1(request):
@@ -24,16 +34,126 @@ def test6(request):
 def test7(request):
     return render(request, 'test7.html')
 
+@require_safe
 def get_media(request, filename):
+    # The file itself is the source of truth: no Media lookup, and one stat()
+    # gives a strong validator. Variants are written once and cached for a
+    # year; an original can still be rewritten in place when the media
+    # pipeline strips its metadata, so caches revalidate it on every use
+    path = media_path(filename)
     try:
-        image_path = 'user_upload/' + filename
+        stat = os.stat(path) if path else None
+    except OSError:
+        stat = None
+    if stat is None or not S_ISREG(stat.st_mode):
+        return JsonResponse({'error': 'Image not found'}, status=404)
+
+    etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+    last_modified = int(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': VARIANT_CACHE_CONTROL if is_variant(filename) else ORIGINAL_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if not_modified(request, etag, last_modified):
+        return with_headers(HttpResponseNotModified(), headers)
+
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', {})
+    if sendfile.get('MODE'):
+        # the front proxy streams the bytes (and answers Range) from its internal location
+        response = HttpResponse(content_type=content_type(filename))
+        internal = sendfile.get('INTERNAL_PREFIX', '/protected-media/') + 'user_upload/' + filename
+        response[SENDFILE_HEADERS[sendfile['MODE']]] = internal if sendfile['MODE'] == 'x-accel-redirect' else path
+        return with_headers(response, headers)
+
+    byte_range = requested_range(request, etag, stat.st_size)
+    if byte_range is None:
+        return with_headers(FileResponse(open(path, 'rb'), content_type=content_type(filename)), headers)
+    if byte_range is UNSATISFIABLE:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % stat.st_size
+        return with_headers(response, headers)
+
+    start, end = byte_range
+    response = StreamingHttpResponse(read_range(path, start, end), status=206, content_type=content_type(filename))
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+    return with_headers(response, headers)
+
+
+VARIANT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+ORIGINAL_CACHE_CONTROL = 'no-cache'
+SENDFILE_HEADERS = {'x-accel-redirect': 'X-Accel-Redirect', 'x-sendfile': 'X-Sendfile'}
+UNSATISFIABLE = object()
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def media_path(filename):
+    # the route only matches a single path segment; refuse anything that could escape the upload dir
+    if not filename or filename.startswith('.') or '/' in filename or '\\' in filename:
+        return None
+    return os.path.join(settings.MEDIA_ROOT, 'user_upload', filename)
 
-        # Find the media object by filename
-        media = Media.objects.get(image=image_path)
 
-        # Get the image
-        image_file = media.image
+def is_variant(filename):
+    # photo.thumb.webp for the labels of MEDIA_PIPELINE['VARIANTS']
+    stem, extension = os.path.splitext(filename)
+    return extension == '.webp' and os.path.splitext(stem)[1][1:] in pipeline_settings()['VARIANTS']
+
+
+def content_type(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def with_headers(response, headers):
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # weak comparison, as RFC 9110 requires for If-None-Match
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def requested_range(request, etag, size):
+    # (start, end) of a single satisfiable byte range, UNSATISFIABLE, or None for the whole file
+    header = request.META.get('HTTP_RANGE', '')
+    if not header.startswith('bytes=') or ',' in header:
+        return None # absent, another unit, or multiple ranges: serve everything
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range.strip() != etag:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # suffix range: the last N bytes
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return UNSATISFIABLE
+    return start, end
+
 
-        return FileResponse(image_file)
-    except Media.DoesNotExist:
-        return Response({'error': 'Image not found'}, status=404)
\ No newline at end of file
+def read_range(path, start, end):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
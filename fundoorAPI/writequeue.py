@@ -0,0 +1,248 @@
+# Write-behind queue for comment and vote writes
+#
+# On SQLite a write request holds the database write lock for its whole
+# transaction, so a burst of voters serializes behind it and requests time
+# out. With WRITE_QUEUE['ENABLED'], add_project_comment and
+# vote_community_action validate the request, append it to a queue kept in a
+# SQLite file of its own (whose lock is held for the append only) and answer
+# 202 with a job id. `manage.py drain_write_queue` applies the queued jobs in
+# batches through fundoorAPI/bulk.py, one transaction per batch, and
+# GET /api/get_write_status/<job id>/ reports each job as pending, done or
+# failed along with the result of its write.
+#
+# Backpressure: enqueue raises QueueFull once MAX_PENDING jobs are waiting or
+# when the queue file stays locked for ENQUEUE_TIMEOUT seconds; the endpoints
+# answer 503 with Retry-After. Each batch commits together with the
+# WriteQueueCheckpoint of its last job, so a worker that dies before marking
+# the jobs finished never applies them twice; the next drain marks them from
+# the checkpoint's results.
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+
+from .bulk import ingest_comments, ingest_votes
+from .models import WriteQueueCheckpoint
+
+DEFAULTS = {
+    'ENABLED': False,
+    # the queue file, None for write_queue.sqlite3 next to manage.py
+    'PATH': None,
+    # jobs waiting to be applied before new writes get 503
+    'MAX_PENDING': 10000,
+    # seconds an append waits for the queue file's lock
+    'ENQUEUE_TIMEOUT': 2.0,
+    # Retry-After of the 503 answers
+    'RETRY_AFTER': 1,
+    # jobs applied per transaction by the worker
+    'BATCH_SIZE': 500,
+    # seconds the worker sleeps when the queue is empty
+    'POLL_INTERVAL': 0.5,
+    # seconds finished jobs stay readable at the status endpoint
+    'KEEP_FINISHED': 24 * 60 * 60,
+}
+
+# kind -> bulk ingest function taking the payloads of the jobs
+INGEST = {
+    'comment': ingest_comments,
+    'vote': ingest_votes,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_id ON jobs (status, id);
+"""
+
+
+class QueueFull(Exception):
+    pass
+
+
+def queue_settings():
+    options = {**DEFAULTS, **getattr(settings, 'WRITE_QUEUE', {})}
+    if options['PATH'] is None:
+        options['PATH'] = os.path.join(settings.BASE_DIR, 'write_queue.sqlite3')
+    return options
+
+
+def enabled():
+    return queue_settings()['ENABLED']
+
+
+_local = threading.local()
+# appends of this process take turns here instead of polling in SQLite's busy handler
+_append_lock = threading.Lock()
+
+
+def reset():
+    global _local, _append_lock
+    _local = threading.local()
+    _append_lock = threading.Lock()
+
+
+# SQLite connections must not cross a fork
+os.register_at_fork(after_in_child=reset)
+
+
+def connect(options):
+    # (connection, queue id) of this thread for the configured file
+    opened = getattr(_local, 'connections', None)
+    if opened is None:
+        opened = _local.connections = {}
+    path = str(options['PATH'])
+    if path not in opened:
+        db = sqlite3.connect(path, timeout=options['ENQUEUE_TIMEOUT'], isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        # a 202 promises the write, so every append is fsynced
+        db.execute('PRAGMA synchronous=FULL')
+        db.executescript(SCHEMA)
+        # AUTOINCREMENT never reuses ids, but a new file starts over at 1, so
+        # checkpoints are kept per file
+        db.execute("INSERT OR IGNORE INTO meta VALUES ('queue', ?)", (uuid.uuid4().hex,))
+        queue_id = db.execute("SELECT value FROM meta WHERE key = 'queue'").fetchone()[0]
+        opened[path] = (db, queue_id)
+    return opened[path]
+
+
+def close():
+    for db, _ in getattr(_local, 'connections', {}).values():
+        db.close()
+    _local.connections = {}
+
+
+def enqueue(kind, payload):
+    # append a validated write and return its job id
+    options = queue_settings()
+    if not _append_lock.acquire(timeout=options['ENQUEUE_TIMEOUT']):
+        raise QueueFull('Write queue is busy')
+    try:
+        return append(options, kind, payload)
+    finally:
+        _append_lock.release()
+
+
+def append(options, kind, payload):
+    try:
+        db, _ = connect(options)
+        db.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError:
+        raise QueueFull('Write queue is busy')
+    try:
+        pending = db.execute("SELECT count(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        if pending >= options['MAX_PENDING']:
+            raise QueueFull('Write queue is full')
+        job_id = db.execute('INSERT INTO jobs (kind, payload, created_at) VALUES (?, ?, ?)', (
+            kind, json.dumps(payload), time.time())).lastrowid
+        db.execute('COMMIT')
+    except sqlite3.OperationalError:
+        db.execute('ROLLBACK')
+        raise QueueFull('Write queue is busy')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return job_id
+
+
+def job_status(job_id):
+    options = queue_settings()
+    if not os.path.exists(options['PATH']):
+        return None
+    db, _ = connect(options)
+    row = db.execute('SELECT id, kind, status, result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    return {'id': row[0], 'kind': row[1], 'status': row[2], 'result': json.loads(row[3]) if row[3] else None}
+
+
+def ingest_each(ingest, payloads):
+    # one job at a time, so the one the batch cannot take fails alone
+    results = []
+    for payload in payloads:
+        try:
+            results += ingest([payload])
+        except (OperationalError, InterfaceError):
+            # the database, not the job: leave the batch pending
+            raise
+        except Exception as e:
+            results.append({'status': 'error', 'error': str(e)})
+    return results
+
+
+def apply(jobs):
+    # {job id: {'status', 'result'}} for [(id, kind, payload)], applied in the caller's transaction
+    finished = {}
+    for kind, ingest in INGEST.items():
+        batch = [(job_id, json.loads(payload)) for job_id, job_kind, payload in jobs if job_kind == kind]
+        if not batch:
+            continue
+        payloads = [payload for _, payload in batch]
+        try:
+            results = ingest(payloads)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception:
+            results = ingest_each(ingest, payloads)
+        for (job_id, _), result in zip(batch, results):
+            result.pop('index', None)
+            finished[job_id] = {'status': 'failed' if result['status'] == 'error' else 'done', 'result': result}
+    for job_id, kind, _ in jobs:
+        if kind not in INGEST:
+            finished[job_id] = {'status': 'failed', 'result': {'status': 'error', 'error': 'Unknown job kind'}}
+    return finished
+
+
+def mark_finished(db, finished):
+    now = time.time()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.executemany("UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ? AND status = 'pending'", [
+            (job['status'], json.dumps(job['result']), now, int(job_id)) for job_id, job in finished.items()])
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+
+
+def drain(batch_size=None):
+    # apply the next batch of pending jobs, returns {job id: {'status', 'result'}}
+    options = queue_settings()
+    db, queue_id = connect(options)
+    with transaction.atomic():
+        # also keeps a second worker off the same jobs until this batch commits
+        checkpoint, _ = WriteQueueCheckpoint.objects.select_for_update().get_or_create(queue=queue_id)
+        last = db.execute('SELECT status FROM jobs WHERE id = ?', (checkpoint.job_id,)).fetchone()
+        if last is not None and last[0] == 'pending':
+            # the worker of the last batch stopped before marking it
+            mark_finished(db, checkpoint.results)
+        jobs = db.execute("SELECT id, kind, payload FROM jobs WHERE status = 'pending' AND id > ? ORDER BY id LIMIT ?", (
+            checkpoint.job_id, batch_size or options['BATCH_SIZE'])).fetchall()
+        if not jobs:
+            return {}
+        finished = apply(jobs)
+        checkpoint.job_id = jobs[-1][0]
+        checkpoint.results = finished
+        checkpoint.save()
+    mark_finished(db, finished)
+    return finished
+
+
+def prune(keep_seconds=None):
+    # forget finished jobs older than KEEP_FINISHED, returns how many
+    options = queue_settings()
+    db, _ = connect(options)
+    keep = options['KEEP_FINISHED'] if keep_seconds is None else keep_seconds
+    return db.execute("DELETE FROM jobs WHERE status != 'pending' AND finished_at < ?", (time.time() - keep,)).rowcount